@@ -0,0 +1,161 @@
+''' Timings of the dashboard and ProcessLogger on a synthetic home (see synthetic.py)
+
+    python benchmarks/bench_dashboard.py [--tasks 200] [--runs 100000] [--machines 3] [--log-kb 64]
+        [--logs 100] [--repeat 5] [--output results.json] [--baseline benchmarks/baseline.json]
+        [--tolerance 0.5] [--save-baseline]
+
+Times config.build (first and cached), webapp.last_run_table, every display_page route and the
+ProcessLogger constructor, progress and complete. Results are written as JSON (--output, or stdout),
+with the median and minimum seconds of each benchmark. With --baseline, a benchmark whose median is
+more than tolerance (a fraction) and MIN_DELTA seconds slower than in the baseline is a regression,
+and the exit status is 1. --save-baseline writes the results to the baseline file instead.
+
+Baselines only compare with results of the same parameters on the same machine.
+
+The package is pointed at the synthetic home with TASK_DASHBOARD_* environment overrides of its configs.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from task_scheduler_dashboard_shauncampbell20.core import CONFIG_ENV_PREFIX
+from task_scheduler_dashboard_shauncampbell20.db import close_all
+
+DB_NAME = 'process_automation.db'
+MIN_DELTA = 0.002
+PARAMETERS = ['tasks', 'runs', 'machines', 'log_kb', 'logs', 'seed', 'progress_items']
+
+@contextmanager
+def home_config(home):
+    # Points the package at home through environment overrides of its configs, config.json is left as it is
+    overrides = {'PROCESS_AUTOMATION_HOME': home, 'SCHEDULER_FOLDER': '\\Automation', 'DB_NAME': DB_NAME,
+                 'TASK_XML_FOLDER': os.path.join(home, 'xml')}
+    previous = {name: os.environ.get(CONFIG_ENV_PREFIX + name) for name in overrides}
+    os.environ.update({CONFIG_ENV_PREFIX + name: value for name, value in overrides.items()})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[CONFIG_ENV_PREFIX + name]
+            else:
+                os.environ[CONFIG_ENV_PREFIX + name] = value
+
+def timed(fn, repeat):
+    # Seconds taken by each of repeat calls of fn
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return times
+
+def summary(times):
+    return {'median': statistics.median(times), 'min': min(times), 'repeat': len(times)}
+
+def run_benchmarks(args, home):
+    ''' Generates the synthetic home and times each benchmark
+        returns {name: [seconds]}
+    '''
+    import synthetic
+    os.environ['COMPUTERNAME'] = synthetic.LOCAL_MACHINE
+    generated = synthetic.generate(home, DB_NAME, args.tasks, args.runs, args.machines, args.log_kb, args.logs, seed=args.seed)
+    from task_scheduler_dashboard_shauncampbell20.config import build
+    from task_scheduler_dashboard_shauncampbell20.sources import XmlTaskSource
+    source = XmlTaskSource(generated['xml_dir'], generated['machine'])
+    times = {'build': timed(lambda: build(update=True, source=source), 1),
+             'build_cached': timed(lambda: build(update=True, source=source), args.repeat)}
+
+    from task_scheduler_dashboard_shauncampbell20 import webapp
+    times['last_run_table'] = timed(webapp.last_run_table, args.repeat)
+    routes = {'home': '/', 'stats': '/stats', 'search': '/search', 'task': '/' + generated['script_id']}
+    if generated['log_file']:
+        routes['log'] = '/' + generated['log_file']
+    for route, pathname in routes.items():
+        times['display_page_' + route] = timed(lambda: webapp.display_page(pathname), args.repeat)
+
+    from task_scheduler_dashboard_shauncampbell20.core import ProcessLogger
+    for name in ['logger_start', 'logger_progress', 'logger_complete']:
+        times[name] = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        logger = ProcessLogger('bench_logger')
+        times['logger_start'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for i in logger.progress(range(args.progress_items)):
+            logger.info('processed record %d', i)
+        times['logger_progress'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        logger.complete()
+        times['logger_complete'].append(time.perf_counter() - started)
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+    return times
+
+def compare(results, baseline, tolerance):
+    ''' Regressions of results against baseline
+        returns a list of (name, baseline median, median)
+    '''
+    regressions = []
+    for name, result in results['results'].items():
+        before = baseline['results'].get(name)
+        if before and result['median'] > before['median'] * (1 + tolerance) and result['median'] - before['median'] > MIN_DELTA:
+            regressions.append((name, before['median'], result['median']))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=100000)
+    parser.add_argument('--machines', type=int, default=3)
+    parser.add_argument('--log-kb', type=int, default=64)
+    parser.add_argument('--logs', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--progress-items', type=int, default=10000)
+    parser.add_argument('--output', type=str)
+    parser.add_argument('--baseline', type=str)
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='dashboard-bench-')
+    try:
+        with home_config(home):
+            times = run_benchmarks(args, home)
+    finally:
+        # Release the pooled connections before removing the database
+        close_all()
+        shutil.rmtree(home, ignore_errors=True)
+    results = {'parameters': {name: getattr(args, name) for name in PARAMETERS},
+               'python': platform.python_version(), 'platform': platform.platform(),
+               'results': {name: summary(seconds) for name, seconds in times.items()}}
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(output)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['parameters'] != results['parameters']:
+            sys.exit('Baseline parameters %s differ from %s' % (baseline['parameters'], results['parameters']))
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print('REGRESSION %-24s %9.4f s -> %9.4f s' % (name, before, after), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
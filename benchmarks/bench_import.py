@@ -0,0 +1,50 @@
+''' Time to import ProcessLogger, the startup cost every scheduled script pays
+
+    python benchmarks/bench_import.py [--repeat 10] [--budget 30]
+
+Each import runs in a new interpreter with -X importtime; the time is the package's own cumulative
+import time, without the interpreter's startup. Exits with status 1 if the median is over the budget
+in milliseconds. The modules the import loaded are listed with --modules, e.g. to check that pandas
+and dash are not among them.
+'''
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+PACKAGE = 'task_scheduler_dashboard_shauncampbell20'
+IMPORT = 'from %s import ProcessLogger' % PACKAGE
+IMPORT_BUDGET_MS = 30
+
+def import_time():
+    # (milliseconds, modules) of the import in a new interpreter
+    env = dict(os.environ, PYTHONPATH=SRC)
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT], env=env,
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, module = line[len('import time:'):].split('|')
+            modules.append(module.strip())
+            if module.strip() == PACKAGE:
+                return int(cumulative) / 1000, modules
+    raise RuntimeError('%s not in -X importtime output' % PACKAGE)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--modules', action='store_true')
+    args = parser.parse_args()
+    times = []
+    for _ in range(args.repeat):
+        milliseconds, modules = import_time()
+        times.append(milliseconds)
+    median = statistics.median(times)
+    if args.modules:
+        print('\n'.join(modules))
+    print('%s: median %.1f ms, min %.1f ms, budget %.0f ms' % (IMPORT, median, min(times), args.budget))
+    if median > args.budget:
+        sys.exit(1)
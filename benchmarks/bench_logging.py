@@ -0,0 +1,43 @@
+''' Records per second logged with the FileHandler ProcessLogger uses by default and with
+    BatchFileHandler (ProcessLogger(async_writes=True))
+
+    python benchmarks/bench_logging.py [--records 200000]
+
+caller is the rate seen by the logging thread, total includes waiting for the last write.
+'''
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from task_scheduler_dashboard_shauncampbell20.core import BatchFileHandler
+
+def run(handler, records):
+    # Logs records messages through handler, returns (caller seconds, total seconds)
+    handler.setFormatter(logging.Formatter('%(levelname)s:%(asctime)s - %(message)s'))
+    logger = logging.Logger('bench')
+    logger.addHandler(handler)
+    started = time.perf_counter()
+    for i in range(records):
+        logger.info('processed record %d of %d', i, records)
+    caller = time.perf_counter() - started
+    handler.flush()
+    total = time.perf_counter() - started
+    handler.close()
+    return caller, total
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=200000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, make in [('sync', logging.FileHandler), ('async', BatchFileHandler)]:
+            path = os.path.join(tmp, mode + '.log')
+            caller, total = run(make(path), args.records)
+            with open(path) as f:
+                written = sum(1 for line in f)
+            assert written == args.records, (mode, written)
+            print('%-6s caller %10.0f records/s   total %10.0f records/s' % (mode, args.records / caller, args.records / total))
@@ -0,0 +1,188 @@
+''' Load test of the dashboard served by the development server (--run) and by serve() (--serve)
+
+    python benchmarks/bench_serve.py [--tasks 200] [--runs 20000] [--clients 16] [--duration 20]
+        [--threads 8] [--modes development production] [--output results.json]
+
+Generates a synthetic home (see synthetic.py), then for each mode starts the dashboard in a new
+process and has clients threads load pages for duration seconds. A page load is what a browser
+does: the HTML, the scripts it references, the layout, the callback dependencies and the callback
+rendering the page, cycling over the home, statistics, task and log pages. Like a browser, a client
+asks for gzip and does not fetch again the scripts it was allowed to cache. Results are written as
+JSON (--output, or stdout) with the requests and pages per second, the bytes received and the
+latency of the page callbacks of each mode.
+'''
+import os
+import re
+import sys
+import json
+import time
+import gzip
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+from bench_dashboard import DB_NAME, home_config
+
+SCRIPT_SRC = re.compile(r'src="([^"]+)"')
+MODES = ['development', 'production']
+STARTUP_TIMEOUT = 120
+
+def start_server(mode, port, threads):
+    # Dashboard in a new process, with the environment of home_config
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--server', mode, '--port', str(port),
+                                '--threads', str(threads)])
+    url = 'http://127.0.0.1:%d' % port
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('%s server exited with status %d' % (mode, process.returncode))
+        try:
+            urllib.request.urlopen(url + '/', timeout=5).read()
+            return process, url
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError('%s server did not start in %d seconds' % (mode, STARTUP_TIMEOUT))
+
+def run_server(mode, port, threads):
+    # --server: the dashboard as --run (development) or --serve (production) starts it
+    from task_scheduler_dashboard_shauncampbell20.webapp import app
+    from task_scheduler_dashboard_shauncampbell20.serve import run, serve
+    if mode == 'production':
+        serve(app, '127.0.0.1', port, threads)
+    else:
+        run(app, '127.0.0.1', port)
+
+def page_callback(pathname):
+    # Body of the callback rendering pathname
+    return json.dumps({'output': '..page-content.children...execute-button.style..',
+                       'outputs': [{'id': 'page-content', 'property': 'children'}, {'id': 'execute-button', 'property': 'style'}],
+                       'inputs': [{'id': 'url', 'property': 'pathname', 'value': pathname}],
+                       'changedPropIds': ['url.pathname']}).encode()
+
+class Client(threading.Thread):
+    ''' Loads the pages in turn until stop is set, keeping the scripts it may cache
+        Counts the requests, pages and bytes received, and the latency of the page callbacks
+    '''
+    def __init__(self, url, pages, stop):
+        super().__init__(daemon=True)
+        self.url = url
+        self.pages = pages
+        self.stop = stop
+        self.cached = set()
+        self.requests = 0
+        self.loaded = 0
+        self.received = 0
+        self.latencies = []
+        self.errors = 0
+
+    def fetch(self, path, data=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.url + path, data=data, headers=headers)
+        with urllib.request.urlopen(request, timeout=60) as response:
+            body = response.read()
+            cache_control = response.headers.get('Cache-Control', '')
+            encoding = response.headers.get('Content-Encoding')
+        self.requests += 1
+        self.received += len(body)
+        if 'max-age' in cache_control and 'max-age=0' not in cache_control:
+            self.cached.add(path)
+        return gzip.decompress(body) if encoding == 'gzip' else body
+
+    def run(self):
+        n = 0
+        while not self.stop.is_set():
+            pathname = self.pages[n % len(self.pages)]
+            n += 1
+            try:
+                html = self.fetch(pathname).decode()
+                for src in SCRIPT_SRC.findall(html):
+                    if src.startswith('/') and src not in self.cached:
+                        self.fetch(src)
+                self.fetch('/_dash-layout')
+                self.fetch('/_dash-dependencies')
+                started = time.perf_counter()
+                self.fetch('/_dash-update-component', page_callback(pathname))
+                self.latencies.append(time.perf_counter() - started)
+                self.loaded += 1
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                self.errors += 1
+
+def load(url, pages, clients, duration):
+    ''' Runs clients for duration seconds against url
+        returns the requests and pages per second, the MB received, the callback latencies and the errors
+    '''
+    stop = threading.Event()
+    running = [Client(url, pages, stop) for _ in range(clients)]
+    started = time.perf_counter()
+    for client in running:
+        client.start()
+    time.sleep(duration)
+    stop.set()
+    for client in running:
+        client.join()
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for client in running for latency in client.latencies)
+    return {'requests_per_s': sum(client.requests for client in running) / elapsed,
+            'pages_per_s': sum(client.loaded for client in running) / elapsed,
+            'mb_received': sum(client.received for client in running) / 1e6,
+            'callback_p50_s': statistics.median(latencies) if latencies else None,
+            'callback_p95_s': latencies[int(len(latencies) * 0.95)] if latencies else None,
+            'errors': sum(client.errors for client in running)}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=20000)
+    parser.add_argument('--machines', type=int, default=3)
+    parser.add_argument('--logs', type=int, default=100)
+    parser.add_argument('--log-kb', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--output', type=str)
+    parser.add_argument('--server', choices=MODES)
+    parser.add_argument('--port', type=int)
+    args = parser.parse_args()
+    if args.server:
+        run_server(args.server, args.port, args.threads)
+        sys.exit()
+
+    import synthetic
+    home = tempfile.mkdtemp(prefix='dashboard-bench-')
+    results = {'parameters': {name: getattr(args, name) for name in ['tasks', 'runs', 'machines', 'logs', 'log_kb', 'clients',
+                                                                       'duration', 'threads']}, 'results': {}}
+    try:
+        with home_config(home):
+            generated = synthetic.generate(home, DB_NAME, args.tasks, args.runs, args.machines, args.log_kb, args.logs)
+            pages = ['/', '/stats', '/' + generated['script_id']] + (['/' + generated['log_file']] if generated['log_file'] else [])
+            for mode in args.modes:
+                process, url = start_server(mode, free_port(), args.threads)
+                try:
+                    results['results'][mode] = load(url, pages, args.clients, args.duration)
+                finally:
+                    process.terminate()
+                    process.wait()
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,140 @@
+''' Synthetic dashboard homes for the benchmarks
+
+    generate() fills an empty PROCESS_AUTOMATION_HOME with task XML exports and the batch files they
+    run (read by config.build), Tasks and Executors of other machines, a Runs history with its rollups,
+    and log files. The same arguments and seed always give the same home, apart from the run times,
+    which end at the time of the call.
+
+    Point the package's configs at the home before importing webapp (see bench_dashboard.py).
+'''
+import os
+import time
+import random
+import sqlite3
+
+from task_scheduler_dashboard_shauncampbell20.schema import migrate
+from task_scheduler_dashboard_shauncampbell20.rollups import ROLLUP_BATCH_SIZE, rollup_runs
+from task_scheduler_dashboard_shauncampbell20.logfiles import shard_path
+from task_scheduler_dashboard_shauncampbell20.core import LOG_FILE_BASE
+
+LOCAL_MACHINE = 'BENCH01'
+TASK_FOLDER = '\\Automation'
+RESULTS = ['success'] * 12 + ['warning', 'error', 'no records', 'critical']
+TASK_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+  <RegistrationInfo><URI>%(folder)s\\%(name)s</URI></RegistrationInfo>
+  <Settings><Enabled>%(enabled)s</Enabled><Hidden>false</Hidden></Settings>
+  <Actions Context="Author"><Exec><Command>%(command)s</Command></Exec></Actions>
+</Task>
+'''
+
+def task_name(i):
+    return 'task%04d' % i
+
+def machine_name(i):
+    # Machine 0 is the local machine, synced by config.build from the XML exports
+    return LOCAL_MACHINE if i == 0 else 'BENCH%02d' % (i + 1)
+
+def write_task_definitions(home, tasks):
+    ''' Writes an XML export and a batch file for each local task
+        returns the directory of the exports
+    '''
+    xml_dir = os.path.join(home, 'xml')
+    batch_dir = os.path.join(home, 'batch')
+    scripts = os.path.join(home, 'scripts')
+    os.makedirs(xml_dir)
+    os.makedirs(batch_dir)
+    for i in range(tasks):
+        name = task_name(i)
+        command = os.path.join(batch_dir, name + '.cmd')
+        with open(command, 'w') as f:
+            f.write(':: %s\ncd "%s"\n"C:/Python/python.exe" "%s"\n' % (name, scripts, os.path.join(scripts, name + '.py')))
+        with open(os.path.join(xml_dir, name + '.xml'), 'w', encoding='UTF-8') as f:
+            f.write(TASK_XML % {'folder': TASK_FOLDER, 'name': name, 'command': command,
+                                'enabled': 'false' if i % 10 == 9 else 'true'})
+    return xml_dir
+
+def insert_remote_tasks(local, tasks, machines):
+    # Tasks and Executors of the other machines, as uploaded by their pushes
+    for m in range(1, machines):
+        machine = machine_name(m)
+        for i in range(tasks):
+            name = task_name(i)
+            command = 'C:\\Automation\\%s.cmd' % name
+            local.execute('''INSERT INTO Executors (name, state, next_run_time, last_run_time, last_run_result, hidden, command, folder, machine)
+                VALUES (?, 'Ready', NULL, NULL, '', 'False', ?, ?, ?)''', (name, command, TASK_FOLDER, machine))
+            local.execute('''INSERT INTO Tasks (script_id, command, script, run_dir, execution_command, machine)
+                VALUES (?, ?, ?, 'C:\\Automation', ?, ?)''', (name, command, 'C:\\Automation\\%s.py' % name,
+                                                               'C:/Python/python.exe C:\\Automation\\%s.py' % name, machine))
+
+def run_rows(rng, tasks, machines, runs, days, now):
+    # Runs rows spread over the last days, the last run of every 20th task still running
+    rows = []
+    start = now - days * 86400
+    step = days * 86400 / max(runs, 1)
+    for run_id in range(1, runs + 1):
+        i = rng.randrange(tasks)
+        machine = machine_name(i % machines)
+        start_time = int(start + run_id * step)
+        duration_ms = int(rng.lognormvariate(9, 1.2))
+        records = rng.randrange(0, 5000)
+        result = rng.choice(RESULTS)
+        rows.append([run_id, task_name(i), str(LOG_FILE_BASE + run_id), start_time, start_time + duration_ms // 1000,
+                     duration_ms, records, result, int(result == 'error'), int(result == 'warning'), 'bench', machine, None])
+    running = set()
+    for row in reversed(rows):
+        i = int(row[1][4:])
+        if i % 20 == 0 and i not in running:
+            running.add(i)
+            row[4] = row[5] = None
+            row[7] = 'running'
+            row[12] = now
+    return rows
+
+def write_log(path, script_id, size):
+    # A log of about size bytes in the format of ProcessLogger
+    lines = ['INFO:2024-01-01 00:00:00,000 - starting execution for %s\n' % script_id]
+    written = len(lines[0])
+    n = 0
+    while written < size:
+        line = 'INFO:2024-01-01 00:00:%02d,000 - processed record %d of the synthetic batch\n' % (n % 60, n)
+        lines.append(line)
+        written += len(line)
+        n += 1
+    lines.append('INFO:2024-01-01 00:01:00,000 - execution for %s completed.\n' % script_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+def generate(home, db_name, tasks=200, runs=100000, machines=3, log_kb=64, logs=100, days=90, seed=0):
+    ''' Fills home with a synthetic dashboard
+        tasks: tasks per machine, machines: number of machines, runs: runs over the last days,
+        logs: number of most recent runs given a log file of log_kb KiB
+        returns a dict with the XML exports folder, the local machine and a log file and task with history
+    '''
+    rng = random.Random(seed)
+    now = int(time.time())
+    xml_dir = write_task_definitions(home, tasks)
+    db_path = os.path.join(home, db_name)
+    migrate(db_path)
+    local = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        local.execute('''BEGIN''')
+        insert_remote_tasks(local, tasks, machines)
+        rows = run_rows(rng, tasks, machines, runs, days, now)
+        local.executemany('''INSERT INTO Runs (run_id, script_id, log_file, start_time, end_time, duration_ms, records,
+            result, errors, warnings, user, machine, heartbeat_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+        local.execute('''COMMIT''')
+        while True:
+            local.execute('''BEGIN IMMEDIATE''')
+            added = rollup_runs(local.cursor())
+            local.execute('''COMMIT''')
+            if added < ROLLUP_BATCH_SIZE:
+                break
+    finally:
+        local.close()
+    logs_dir = os.path.join(home, 'logs')
+    for row in rows[-logs:] if logs else []:
+        write_log(shard_path(logs_dir, row[2]), row[1], log_kb * 1024)
+    return {'xml_dir': xml_dir, 'machine': LOCAL_MACHINE, 'log_file': rows[-1][2] if logs else None,
+            'script_id': rows[-1][1]}
@@ -0,0 +1,281 @@
+import json
+import gzip
+import zlib
+import hmac
+import queue
+import sqlite3
+import threading
+import time
+import warnings
+import urllib.request
+import urllib.error
+import concurrent.futures
+from task_scheduler_dashboard_shauncampbell20.db import connection, open_connection, transaction
+from task_scheduler_dashboard_shauncampbell20.schema import schema_version
+from task_scheduler_dashboard_shauncampbell20.config import EXECUTOR_COLUMNS, TASK_COLUMNS, sync_graph, sync_rows
+
+## Aggregation of many machines into one database
+# Each machine keeps its own database and uploads batches of its executors, tasks and runs to a
+# central dashboard (push), or the central dashboard merges copies of the per-machine databases
+# (merge_database). A batch is a dict:
+#   {'machine': name, 'executors': [row, ...], 'tasks': [row, ...], 'runs': [row, ...]}
+# executors and tasks, when present, replace all rows of the machine. Runs are identified by the
+# machine and their run_id on that machine (origin_run_id), so uploading a run again updates it.
+
+RUN_COLUMNS = ['script_id', 'start_time', 'end_time', 'duration_ms', 'records', 'result', 'errors', 'warnings', 'user']
+INGEST_QUEUE_SIZE = 64
+INGEST_MAX_BYTES = 16 * 1024 * 1024
+INGEST_RETRY_AFTER = 5
+INGEST_WAIT = 30
+PUSH_BATCH_SIZE = 1000
+PUSH_RETRIES = 5
+PUSH_RUNNING_WINDOW = 24 * 3600
+
+def check_batch(batch):
+    # Raises ValueError if batch is not a well formed batch
+    if not isinstance(batch, dict) or not isinstance(batch.get('machine'), str) or not batch['machine']:
+        raise ValueError('batch needs a machine')
+    for key in ['executors', 'tasks', 'runs']:
+        rows = batch.get(key, [])
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('%s must be a list of objects' % key)
+    for row in batch.get('runs', []):
+        if not isinstance(row.get('run_id'), int):
+            raise ValueError('runs need an integer run_id')
+    return batch
+
+def apply_batch(cursor, batch):
+    ''' Writes a batch to the database, inside the caller's transaction
+        returns {table: counts}
+    '''
+    machine = batch['machine']
+    report = {}
+    if 'executors' in batch:
+        desired = {}
+        for row in batch['executors']:
+            values = tuple(row.get(c) for c in EXECUTOR_COLUMNS[:-1]) + (machine,)
+            desired[(machine, values[0])] = values
+        current = {(row[8], row[0]): row for row in cursor.execute(
+            '''SELECT %s FROM Executors WHERE machine = ?''' % ', '.join(EXECUTOR_COLUMNS), (machine,))}
+        report['Executors'] = sync_rows(cursor, 'Executors', ['machine', 'name'], EXECUTOR_COLUMNS, current, desired)
+    if 'tasks' in batch:
+        desired = {}
+        for row in batch['tasks']:
+            values = tuple(row.get(c) for c in TASK_COLUMNS[:-1]) + (machine,)
+            desired[(machine, values[1], values[2])] = values
+        current = {(row[5], row[1], row[2]): row for row in cursor.execute(
+            '''SELECT %s FROM Tasks WHERE machine = ?''' % ', '.join(TASK_COLUMNS), (machine,))}
+        report['Tasks'] = sync_rows(cursor, 'Tasks', ['machine', 'command', 'script'], TASK_COLUMNS, current, desired)
+    if 'executors' in batch or 'tasks' in batch:
+        executors = cursor.execute('''SELECT %s FROM Executors WHERE machine = ?''' % ', '.join(EXECUTOR_COLUMNS), (machine,)).fetchall()
+        tasks = cursor.execute('''SELECT %s FROM Tasks WHERE machine = ?''' % ', '.join(TASK_COLUMNS), (machine,)).fetchall()
+        script_ids = {row[0] for row in cursor.execute('''SELECT DISTINCT script_id FROM Tasks''')}
+        report['TaskGraph'] = sync_graph(cursor, machine, executors, tasks, script_ids)
+    if batch.get('runs'):
+        rows = [(row['run_id'], machine) + tuple(row.get(c) for c in RUN_COLUMNS) for row in batch['runs']]
+        cursor.executemany('''
+            INSERT INTO Runs (origin_run_id, machine, %s) VALUES (?, ?, %s)
+            ON CONFLICT (machine, origin_run_id) WHERE origin_run_id IS NOT NULL DO UPDATE SET %s
+            WHERE %s''' % (', '.join(RUN_COLUMNS), ', '.join('?' * len(RUN_COLUMNS)),
+                           ', '.join('%s = excluded.%s' % (c, c) for c in RUN_COLUMNS),
+                           ' OR '.join('Runs.%s IS NOT excluded.%s' % (c, c) for c in RUN_COLUMNS)), rows)
+        # rowcount leaves out the rows the LatestRuns triggers write
+        report['Runs'] = {'received': len(rows), 'changed': cursor.rowcount}
+    return report
+
+def write_batches(db_path, batches):
+    # Applies batches in a single transaction on a pooled connection to db_path
+    with transaction(db_path) as cursor:
+        return [apply_batch(cursor, batch) for batch in batches]
+
+class IngestQueue:
+    ''' Bounded queue of uploaded batches, written to the database by a single thread
+        submit() raises queue.Full when maxsize batches are waiting, so uploaders are told to retry
+        later instead of piling up requests while the database is busy. The writer applies all
+        waiting batches in one transaction, and each batch alone if that transaction fails, so a
+        batch the database refuses fails by itself.
+    '''
+    def __init__(self, db_path, maxsize=INGEST_QUEUE_SIZE):
+        self.db_path = db_path
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._write, name='ingest', daemon=True)
+        self.thread.start()
+
+    def submit(self, batch):
+        # Queues batch, returns a Future of its apply_batch report or of the error writing it
+        future = concurrent.futures.Future()
+        self.queue.put_nowait((check_batch(batch), future))
+        return future
+
+    def _write_batches(self, batches):
+        # write_batches, retried while the database is locked by another writer
+        delay = 1
+        while True:
+            try:
+                return write_batches(self.db_path, batches)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _write_alone(self, batch):
+        # Report of batch written in its own transaction, or the error
+        try:
+            return self._write_batches([batch])[0]
+        except Exception as e:
+            return e
+
+    def _write(self):
+        while True:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            batches = [batch for batch, _ in items]
+            try:
+                results = self._write_batches(batches)
+            except Exception as e:
+                results = [e] if len(batches) == 1 else [self._write_alone(batch) for batch in batches]
+            for (batch, future), result in zip(items, results):
+                if isinstance(result, Exception):
+                    warnings.warn('Ingest of %s failed: %s' % (batch['machine'], result))
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+                self.queue.task_done()
+
+def read_body(request, max_bytes=INGEST_MAX_BYTES):
+    # Body of a flask request, gunzipped if sent with Content-Encoding gzip, at most max_bytes
+    data = request.get_data()
+    if request.headers.get('Content-Encoding') == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(data, max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError('batch larger than %d bytes' % max_bytes)
+    return data
+
+def register_ingest(server, db_path, token):
+    ''' Adds the POST /api/ingest endpoint to the flask server of the dashboard
+        Requests must send the header Authorization: Bearer <token>.
+        Responds 200 with the counts of the rows written once the batch is in the database, 500 if
+        writing it failed, and 503 with Retry-After when the queue is full or the batch is not written
+        within INGEST_WAIT seconds. Sending a batch again is harmless, it updates the same rows.
+    '''
+    from flask import request
+    ingest_queue = IngestQueue(db_path)
+
+    @server.route('/api/ingest', methods=['POST'])
+    def ingest_batch():
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode('UTF-8'), ('Bearer ' + token).encode('UTF-8')):
+            return {'error': 'unauthorized'}, 401
+        if (request.content_length or 0) > INGEST_MAX_BYTES:
+            return {'error': 'batch too large'}, 413
+        try:
+            future = ingest_queue.submit(json.loads(read_body(request)))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        except queue.Full:
+            return {'error': 'busy'}, 503, {'Retry-After': str(INGEST_RETRY_AFTER)}
+        try:
+            return future.result(INGEST_WAIT), 200
+        except concurrent.futures.TimeoutError:
+            return {'error': 'busy'}, 503, {'Retry-After': str(INGEST_RETRY_AFTER)}
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+    return ingest_queue
+
+def post_batch(url, token, batch, retries=PUSH_RETRIES):
+    # Uploads a batch to the ingest endpoint at url, waiting and retrying while it answers 503
+    data = gzip.compress(json.dumps(batch).encode('UTF-8'))
+    for attempt in range(retries + 1):
+        request = urllib.request.Request(url, data=data, method='POST', headers={
+            'Content-Type': 'application/json', 'Content-Encoding': 'gzip', 'Authorization': 'Bearer ' + token})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code != 503 or attempt == retries:
+                raise
+            time.sleep(float(e.headers.get('Retry-After', INGEST_RETRY_AFTER)))
+
+def push(url, token, db_path, machine, batch_size=PUSH_BATCH_SIZE):
+    ''' Uploads the executors, tasks and runs of machine to the aggregator at url
+        Runs are sent from the oldest one that was still running at the previous push, so runs
+        that completed since are sent again with their results.
+        returns the number of runs sent
+    '''
+    ingest_url = url.rstrip('/') + '/api/ingest'
+    with connection(db_path) as local:
+        row = local.execute('''SELECT run_id FROM PushState WHERE url = ?''', (url,)).fetchone()
+        since = row[0] if row else 0
+        batch = {'machine': machine,
+                 'executors': [dict(zip(EXECUTOR_COLUMNS, row)) for row in local.execute(
+                     '''SELECT %s FROM Executors WHERE machine = ?''' % ', '.join(EXECUTOR_COLUMNS), (machine,))],
+                 'tasks': [dict(zip(TASK_COLUMNS, row)) for row in local.execute(
+                     '''SELECT %s FROM Tasks WHERE machine = ?''' % ', '.join(TASK_COLUMNS), (machine,))]}
+        sent = 0
+        hold = None
+        while True:
+            runs = [dict(zip(['run_id'] + RUN_COLUMNS, row)) for row in local.execute(
+                '''SELECT run_id, %s FROM Runs WHERE run_id > ? AND origin_run_id IS NULL
+                ORDER BY run_id LIMIT ?''' % ', '.join(RUN_COLUMNS), (since, batch_size))]
+            batch['runs'] = runs
+            post_batch(ingest_url, token, batch)
+            sent += len(runs)
+            if runs:
+                # Send runs that are still running again next time, unless they look abandoned
+                running = [run['run_id'] for run in runs if run['end_time'] is None
+                           and (run['start_time'] or 0) > time.time() - PUSH_RUNNING_WINDOW]
+                if running and hold is None:
+                    hold = running[0]
+                since = runs[-1]['run_id']
+                local.execute('''INSERT OR REPLACE INTO PushState (url, run_id, push_time) VALUES (?, ?, ?)''',
+                              (url, hold - 1 if hold else since, int(time.time())))
+            if len(runs) < batch_size:
+                break
+            batch = {'machine': machine}
+    return sent
+
+def merge_database(db_path, other_path, machine=None, batch_size=PUSH_BATCH_SIZE):
+    ''' Merges the executors, tasks and runs of the database copied from another machine
+        Runs without a machine (still running when the copy was made) are taken to be from machine,
+        or from the only machine in the copy's Executors.
+        returns the number of runs merged
+    '''
+    other = open_connection(other_path, read_only=True)
+    try:
+        if schema_version(other) < 4:
+            raise ValueError('%s uses an old schema, upgrade it with --update first' % other_path)
+        machines = [row[0] for row in other.execute('''SELECT DISTINCT machine FROM Executors WHERE machine IS NOT NULL''')]
+        if machine is None and len(machines) == 1:
+            machine = machines[0]
+        origin = 'COALESCE(origin_run_id, run_id)' if schema_version(other) >= 8 else 'run_id'
+        batches = []
+        for name in machines:
+            batches.append({'machine': name,
+                            'executors': [dict(zip(EXECUTOR_COLUMNS, row)) for row in other.execute(
+                                '''SELECT %s FROM Executors WHERE machine = ?''' % ', '.join(EXECUTOR_COLUMNS), (name,))],
+                            'tasks': [dict(zip(TASK_COLUMNS, row)) for row in other.execute(
+                                '''SELECT %s FROM Tasks WHERE machine = ?''' % ', '.join(TASK_COLUMNS), (name,))]})
+        write_batches(db_path, batches)
+        merged = 0
+        cursor = other.execute('''SELECT %s, COALESCE(machine, ?), %s FROM Runs ORDER BY run_id''' % (origin, ', '.join(RUN_COLUMNS)),
+                               (machine,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if any(row[1] is None for row in rows):
+                raise ValueError('%s has runs without a machine, pass the machine it was copied from' % other_path)
+            by_machine = {}
+            for row in rows:
+                by_machine.setdefault(row[1], []).append(dict(zip(['run_id'] + RUN_COLUMNS, (row[0],) + row[2:])))
+            write_batches(db_path, [{'machine': name, 'runs': runs} for name, runs in by_machine.items()])
+            merged += len(rows)
+    finally:
+        other.close()
+    return merged
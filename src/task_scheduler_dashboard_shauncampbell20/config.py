@@ -1,12 +1,15 @@
 import os
-import sqlite3
-import re
-import pandas as pd
-import sys
-from core import resultCodes, _loc, set_config
+from task_scheduler_dashboard_shauncampbell20.core import set_config, get_config, get_configs
+from task_scheduler_dashboard_shauncampbell20.schema import migrate, rebuild_latest_runs, to_epoch
+from task_scheduler_dashboard_shauncampbell20.db import connection, transaction
+from task_scheduler_dashboard_shauncampbell20.sources import SchedulerTaskSource, task_source
+from task_scheduler_dashboard_shauncampbell20.graph import GRAPH_COLUMNS, find_cycles, graph_edges
 import argparse
 import json
 import warnings
+import hashlib
+import locale
+import io
 
 def set_home_directory(config_value):
     set_config('PROCESS_AUTOMATION_HOME', config_value)
@@ -23,116 +26,182 @@ def set_port(config_value):
 def set_host(config_value):
     set_config('HOST', config_value)
 
+def set_xml_folder(config_value):
+    set_config('TASK_XML_FOLDER', config_value)
+
+def set_sync_interval(config_value):
+    set_config('SYNC_INTERVAL', config_value)
+
+def set_push_url(config_value):
+    set_config('PUSH_URL', config_value)
+
+def set_ingest_token(config_value):
+    set_config('INGEST_TOKEN', config_value)
+
 def list_configs():
-    with open(os.path.join(_loc, 'config.json'), 'r') as config:
-        configs = json.load(config)
-    for k, v in configs.items():
+    for k, v in get_configs().items():
         print(k,":",v)
 
 def parse_task_scheduler(SCHEDULER_FOLDER):
-    import win32com.client
-    import pythoncom
-    TASK_ENUM_HIDDEN = 1
-    TASK_STATE = {0: 'Unknown',
-                  1: 'Disabled',
-                  2: 'Queued',
-                  3: 'Ready',
-                  4: 'Running'}
-
-    scheduler = win32com.client.Dispatch('Schedule.Service')
-    scheduler.Connect()
-    
-    # Get folders and tasks
-    try:
-        folders = [scheduler.GetFolder(SCHEDULER_FOLDER)]
-    except pythoncom.com_error:
-        raise pythoncom.com_error('"'+SCHEDULER_FOLDER+'" folder not found in Task Scheduler')
-        quit
+    # Tasks of the Task Scheduler folder SCHEDULER_FOLDER and its subfolders, by name
     d = {}
-    tasks = []
-    while folders:
-        folder = folders.pop(0)
-        folders += list(folder.GetFolders(0))
-        tasks += list(folder.GetTasks(TASK_ENUM_HIDDEN))
-        
-        # Loop through each task
-        for task in tasks:
-            settings = task.Definition.Settings
-            taskName = os.path.split(task.Path)[-1]
-            taskFolder = os.path.split(task.Path)[-2]
-            d[taskName] = {'Hidden': settings.Hidden, 'State': TASK_STATE[task.State], 'Last Run': task.LastRunTime,
-                           'Next Run': task.NextRunTime, 'Folder':taskFolder}
-            d[taskName]['Command'] = re.search('<Command>.+</Command>', task.Xml).group(0)[9:-10]
-            try:
-                d[taskName]['Last Result'] = resultCodes[task.LastTaskResult]
-            except KeyError:
-                d[taskName]['Last Result'] = task.LastTaskResult
-            d[taskName]['Machine'] = os.environ['COMPUTERNAME']
+    for record in SchedulerTaskSource(SCHEDULER_FOLDER).tasks():
+        d[record['Name']] = record
     return d
 
-def build(update=True):
+EXECUTOR_COLUMNS = ['name', 'state', 'next_run_time', 'last_run_time', 'last_run_result', 'hidden', 'command', 'folder', 'machine']
+TASK_COLUMNS = ['script_id', 'command', 'script', 'run_dir', 'execution_command', 'machine']
+
+def parse_batch_file(batchFile):
+    # Finds the python scripts run by a batch file, returns {script: (script_id, run_dir, execution_command)}
+    with open(batchFile, 'r') as f:
+        batchContents = f.readlines()
+    return parse_batch_contents(batchContents)
+
+def parse_batch_contents(batchContents):
+    # Finds the python scripts run by the lines of a batch file
+    tasks = {}
+    runDir = ''
+    for line in batchContents:
+        if line[:3] == 'cd ':
+            runDir = line.replace('cd ','').replace('"','').strip()
+        if line[:2] != '::' and 'python.exe' in line:
+            script = line.split('" "')[-1].replace('"','').strip()
+            scriptID = os.path.splitext(os.path.split(script)[-1])[0]
+            executionCommand = line.replace('"','').strip()
+            tasks[script] = (scriptID, runDir, executionCommand)
+    return tasks
+
+def check_batch_file(batchFile, cached):
+    ''' Parses batchFile unless it matches its cache entry
+        cached is the (mtime_ns, size, sha1, tasks) stored for the file or None.
+        A file whose mtime and size are unchanged is not opened, a file whose content hash is
+        unchanged is not parsed.
+        returns (tasks, cache entry to store or None if the cache is current)
+    '''
+    st = os.stat(batchFile)
+    if cached and (cached[0], cached[1]) == (st.st_mtime_ns, st.st_size):
+        return cached[3], None
+    with open(batchFile, 'rb') as f:
+        data = f.read()
+    sha1 = hashlib.sha1(data).hexdigest()
+    if cached and cached[2] == sha1:
+        tasks = cached[3]
+    else:
+        text = data.decode(locale.getpreferredencoding(False))
+        tasks = parse_batch_contents(io.StringIO(text, newline=None).readlines())
+    return tasks, (st.st_mtime_ns, st.st_size, sha1, tasks)
+
+def parse_batch_files(cursor, machine, batchFiles, workers=1):
+    ''' Parses the batch files of a machine, reusing the results cached in BatchFiles
+        workers: number of threads used to check and parse the files
+        returns ({batchFile: tasks}, [rows to store in BatchFiles])
+    '''
+    cache = {}
+    for path, mtime_ns, size, sha1, tasks in cursor.execute(
+            '''SELECT path, mtime_ns, size, sha1, tasks FROM BatchFiles WHERE machine = ?''', (machine,)):
+        cache[path] = (mtime_ns, size, sha1, {k: tuple(v) for k, v in json.loads(tasks).items()})
+
+    def check(batchFile):
+        try:
+            return batchFile, check_batch_file(batchFile, cache.get(batchFile))
+        except Exception as e:
+            warnings.warn('Exception in '+batchFile+': '+str(e))
+            return batchFile, None
+
+    if workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(check, batchFiles))
+    else:
+        results = [check(batchFile) for batchFile in batchFiles]
+    parsed = {}
+    updates = []
+    for batchFile, result in results:
+        if result is None:
+            continue
+        tasks, entry = result
+        parsed[batchFile] = tasks
+        if entry:
+            updates.append((machine, batchFile, entry[0], entry[1], entry[2], json.dumps(entry[3])))
+    return parsed, updates
+
+def derived_executors(cursor, machine, executors, all_tasks):
+    ''' Executors for the batch files in Tasks that are not run by Task Scheduler (tasks that trigger other tasks)
+        executors are the new rows of this machine, keyed like the table's primary key, all_tasks the Tasks rows of every machine
+        The run information is inherited from the task whose script_id is the batch file, from its row in LatestRuns on its machine
+    '''
+    next_runs = {}
+    for command, next_run_time in cursor.execute('''SELECT command, next_run_time FROM Executors WHERE machine <> ?''', (machine,)):
+        next_runs.setdefault(command, next_run_time)
+    for row in executors.values():
+        next_runs.setdefault(row[6], row[2])
+    by_script = {}
+    for row in all_tasks:
+        by_script.setdefault(row[0], row)
+    commands = list(dict.fromkeys(row[1] for row in all_tasks if row[1] not in next_runs))
+    latest = {(machine, script_id): (end_time, result) for machine, script_id, end_time, result in cursor.execute(
+        '''SELECT machine, script_id, end_time, result FROM LatestRuns WHERE script_id IN (SELECT value FROM json_each(?))''',
+        (json.dumps([command for command in commands if command in by_script]),))}
+    derived = {}
+    for command in commands:
+        trigger = by_script.get(command)
+        last_run_time, last_run_result = latest.get((trigger[5] or '', command) if trigger else None, (None, None))
+        derived[(machine, command)] = (command, 'Ready', next_runs.get(trigger[1]) if trigger else None,
+                                       last_run_time, last_run_result, 'False', command, None, machine)
+    return derived
+
+def sync_graph(cursor, machine, executors, tasks, script_ids):
+    ''' Replaces the TaskGraph edges of machine by those of its Executors and Tasks rows, warns about new cycles
+        returns the sync_rows counts
+    '''
+    current = {row: row for row in cursor.execute('''SELECT %s FROM TaskGraph WHERE machine = ?''' % ', '.join(GRAPH_COLUMNS), (machine,))}
+    counts = sync_rows(cursor, 'TaskGraph', GRAPH_COLUMNS, GRAPH_COLUMNS, current, graph_edges(machine, executors, tasks, script_ids))
+    if counts['inserted']:
+        for cycle in find_cycles(cursor.execute('''SELECT %s FROM TaskGraph''' % ', '.join(GRAPH_COLUMNS))):
+            warnings.warn('Task dependency cycle: ' + ' -> '.join('%s %s' % node for node in cycle))
+    return counts
+
+def sync_rows(cursor, table, key_columns, columns, current, desired):
+    ''' Applies the differences between the current and desired rows of table with batched statements
+        current and desired map primary key tuples to rows ordered like columns
+        returns {'inserted': n, 'updated': n, 'deleted': n}
+    '''
+    inserts = [row for key, row in desired.items() if key not in current]
+    updates = [row for key, row in desired.items() if key in current and tuple(current[key]) != tuple(row)]
+    deletes = [key for key in current if key not in desired]
+    where = ' AND '.join('%s = ?' % c for c in key_columns)
+    value_columns = [c for c in columns if c not in key_columns]
+    cursor.executemany('''DELETE FROM %s WHERE %s''' % (table, where), deletes)
+    cursor.executemany('''INSERT INTO %s (%s) VALUES (%s)''' % (table, ', '.join(columns), ', '.join('?' * len(columns))), inserts)
+    # Tables keyed by all their columns (TaskGraph) have nothing to update
+    if value_columns:
+        cursor.executemany('''UPDATE %s SET %s WHERE %s''' % (table, ', '.join('%s = ?' % c for c in value_columns), where),
+                           [tuple(row[columns.index(c)] for c in value_columns + key_columns) for row in updates])
+    return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes)}
+
+def print_report(report):
+    # Prints the changes made by build()
+    for table, changes in report.items():
+        print('%s: %d inserted, %d updated, %d deleted' % (table, changes['inserted'], changes['updated'], changes['deleted']))
+
+def default_source():
+    # Task source from the configs, the TASK_XML_FOLDER exports if set, else the SCHEDULER_FOLDER of the Task Scheduler
+    configs = get_configs()
+    return task_source(configs['SCHEDULER_FOLDER'], configs.get('TASK_XML_FOLDER'))
+
+def build(update=True, workers=1, source=None):
     ## Main function for building and updating the database
+    ## workers: number of threads used to parse changed batch files
+    ## source: TaskSource to read the tasks from, default_source() if None
     
-    def create_run_table():
-        # Create run table if it does not exist
-        if ('Runs',) not in cursor.execute('''SELECT name FROM sqlite_master WHERE type = 'table' ''').fetchall():
-            cursor.execute('''DROP TABLE IF EXISTS Runs''')
-            cursor.execute('''
-            CREATE TABLE Runs (
-            run_id INTEGER PRIMARY KEY,
-            script_id VARCHAR,
-            log_file VARCHAR,
-            start_time VARCHAR,
-            end_time VARCHAR,
-            records INT,
-            result VARCHAR,
-            errors INT,
-            warnings INT,
-            user VARCHAR,
-            machine VARCHAR
-            )
-            ''')
-            local.commit()
-        else:
-            warnings.warn('Runs table exists, skipping create run table')
-        
-    def create_executors_table():
-        # Creates Executors table
-        cursor.execute('''DROP TABLE IF EXISTS Executors;''')
-        cursor.execute('''
-        CREATE TABLE Executors (
-        name VARCHAR,
-        state VARCHAR,
-        next_run_time VARCHAR,
-        last_run_time VARCHAR,
-        last_run_result VARCHAR,
-        hidden VARCHAR,
-        command VARCHAR,
-        folder VARCHAR,
-        machine VARCHAR
-        )''')
-        local.commit()
-        
-    def create_tasks_table():
-        # Creates Tasks table
-        cursor.execute('''DROP TABLE IF EXISTS Tasks;''')
-        cursor.execute('''
-        CREATE TABLE Tasks (
-        script_id VARCHAR,
-        command VARCHAR,
-        script VARCHAR,
-        run_dir VARCHAR,
-        execution_command VARCHAR,
-        machine VARCHAR
-        )''')
-        
     # Load configs
-    with open(os.path.join(_loc, 'config.json'), 'r') as config:
-        configs = json.load(config)
+    configs = get_configs()
     PROCESS_AUTOMATION_HOME = configs['PROCESS_AUTOMATION_HOME']
-    SCHEDULER_FOLDER = configs['SCHEDULER_FOLDER']
     DB_NAME = configs["DB_NAME"]
-    machine = os.environ['COMPUTERNAME']
+    if source is None:
+        source = default_source()
+    machine = source.machine
     
     # Create directory PROCESS_AUTOMATION_HOME if doesn't exist
     if not os.path.exists(PROCESS_AUTOMATION_HOME):
@@ -149,82 +218,53 @@ def build(update=True):
     if not os.path.exists(process_automation_logs):
         os.mkdir(process_automation_logs)
     
-    # If update = False, i.e. initializing for the first time, create the Runs, Executors, and Tasks tables.
+    # Create or upgrade the tables.
+    # If update = False, i.e. initializing for the first time or resetting, Executors and Tasks are cleared.
     if not os.path.exists(os.path.join(PROCESS_AUTOMATION_HOME, DB_NAME)):
         update = False
-    local = sqlite3.connect(os.path.join(PROCESS_AUTOMATION_HOME, DB_NAME))
-    cursor = local.cursor()
-    if not update:
-        create_run_table()
-        create_executors_table()
-        create_tasks_table()
-    else:
-        if ('Runs',) not in cursor.execute('''SELECT name FROM sqlite_master WHERE type = 'table' ''').fetchall():
-            create_run_table()
-        if ('Executors',) not in cursor.execute('''SELECT name FROM sqlite_master WHERE type = 'table' ''').fetchall():
-            create_executors_table()
-        if ('Tasks',) not in cursor.execute('''SELECT name FROM sqlite_master WHERE type = 'table' ''').fetchall():
-            create_tasks_table()
+    db_path = os.path.join(PROCESS_AUTOMATION_HOME, DB_NAME)
+    migrate(db_path)
 
     # Get Task Scheduler information
-    d = parse_task_scheduler(SCHEDULER_FOLDER)
+    executors = {}
+    for record in source.tasks():
+        executors[(machine, record['Name'])] = (record['Name'], record['State'], to_epoch(record['Next Run']), to_epoch(record['Last Run']),
+                                                str(record['Last Result']), str(record['Hidden']), record['Command'],
+                                                record['Folder'], machine)
 
-    # Insert Task Scheduler Information into Executors table
-    cursor.execute(f'''DELETE FROM Executors WHERE machine = '{machine}' ''')
-    for pname in d.keys():
-            cursor.execute(f'''
-            INSERT INTO Executors 
-            VALUES ('{pname}', '{d[pname]['State']}', '{str(d[pname]['Next Run'])}', 
-            '{str(d[pname]['Last Run'])}', '{d[pname]['Last Result']}', 
-            '{d[pname]['Hidden']}', '{d[pname]['Command']}', '{d[pname]['Folder']}', '{d[pname]['Machine']}')
-            ''')
-    local.commit()
+    # Parse batch files of the executors that changed since the last build
+    with connection(db_path) as local:
+        batchFiles, batchFileUpdates = parse_batch_files(local.cursor(), machine, sorted(set(row[6] for row in executors.values())), workers)
+    tasks = {}
+    for batchFile, batchTasks in batchFiles.items():
+        for script, (scriptID, runDir, executionCommand) in batchTasks.items():
+            tasks[(machine, batchFile, script)] = (scriptID, batchFile, script, runDir, executionCommand, machine)
 
-    # Parse batch files and insert into Tasks table
-    cursor.execute(f'''DELETE FROM Tasks WHERE machine = '{machine}' ''')
-    df = pd.read_sql_query(f'''SELECT * FROM Executors WHERE machine = '{machine}' ''', local)
-    for batchFile, taskfolder in zip(df['command'], df['folder']):
-        try:
-            with open(batchFile, 'r') as f:
-                batchContents = f.readlines()
-            tasks = {}
-            runDir = ''
-            for line in batchContents:
-                if line[:3] == 'cd ':
-                    runDir = line.replace('cd ','').replace('"','').strip()
-                if line[:2] != '::' and 'python.exe' in line:
-                    script = line.split('" "')[-1].replace('"','').strip()
-                    scriptID = os.path.splitext(os.path.split(script)[-1])[0]
-                    executionCommand = line.replace('"','').strip()
-                    tasks[script] = {'command':batchFile, 'script_id':scriptID, 'execution_command':executionCommand, 'run_dir':runDir, 'folder':taskfolder}
-            for tname in tasks.keys():
-                cursor.execute(f'''
-                INSERT INTO Tasks 
-                VALUES ('{tasks[tname]['script_id']}', '{tasks[tname]['command']}', '{tname}', '{tasks[tname]['run_dir']}', '{tasks[tname]['execution_command']}', '{machine}')
-                ''')
-            local.commit()
-        except Exception as e:
-            warnings.warn('Exception in '+batchFile+': '+str(e))
-    local.commit()
-    
-    # Add tasks that trigger other tasks to Executors table
-    pd.read_sql_query(f'''
-    SELECT DISTINCT
-    t1.command as name,
-    'Ready' as state,
-    (SELECT next_run_time FROM Executors WHERE command = t2.command) as next_run_time,
-    (SELECT end_time FROM Runs WHERE script_id = t2.script_id ORDER BY end_time DESC) as last_run_time,
-    (SELECT result FROM Runs WHERE script_id = t2.script_id ORDER BY end_time DESC ) as last_run_result,
-    'False' as hidden,
-    t1.command as command,
-    '{machine}' as machine
-    FROM Tasks t1 
-    LEFT JOIN Tasks t2 ON t1.command = t2.script_id 
-    WHERE t1.command NOT IN (SELECT command FROM Executors)
-    ''', local).to_sql('Executors', local, if_exists='append', index=False)
+    # Apply the differences to the Executors and Tasks rows of this machine in a single transaction,
+    # so readers see either the previous or the new state
+    with transaction(db_path) as cursor:
+        if not update:
+            cursor.execute('''DELETE FROM Executors''')
+            cursor.execute('''DELETE FROM Tasks''')
+        all_tasks = list(tasks.values()) + cursor.execute(
+            '''SELECT %s FROM Tasks WHERE machine <> ?''' % ', '.join(TASK_COLUMNS), (machine,)).fetchall()
+        for key, row in derived_executors(cursor, machine, executors, all_tasks).items():
+            executors.setdefault(key, row)
+        current_executors = {(row[8], row[0]): row for row in cursor.execute(
+            '''SELECT %s FROM Executors WHERE machine = ?''' % ', '.join(EXECUTOR_COLUMNS), (machine,))}
+        current_tasks = {(row[5], row[1], row[2]): row for row in cursor.execute(
+            '''SELECT %s FROM Tasks WHERE machine = ?''' % ', '.join(TASK_COLUMNS), (machine,))}
+        report = {'Executors': sync_rows(cursor, 'Executors', ['machine', 'name'], EXECUTOR_COLUMNS, current_executors, executors),
+                  'Tasks': sync_rows(cursor, 'Tasks', ['machine', 'command', 'script'], TASK_COLUMNS, current_tasks, tasks)}
+        report['TaskGraph'] = sync_graph(cursor, machine, executors.values(), tasks.values(), {row[0] for row in all_tasks})
+        cursor.executemany('''INSERT OR REPLACE INTO BatchFiles (machine, path, mtime_ns, size, sha1, tasks) 
+        VALUES (?, ?, ?, ?, ?, ?)''', batchFileUpdates)
+        cursor.execute('''DELETE FROM BatchFiles WHERE machine = ? AND path NOT IN (SELECT command FROM Executors WHERE machine = ?)''',
+                       (machine, machine))
 
     if update == False:
         print('DB Initialized Successfully')
+    return report
 
 
 if __name__ == "__main__":
@@ -234,11 +274,29 @@ if __name__ == "__main__":
     parser.add_argument('--dbname', type=str)
     parser.add_argument('--host', type=str)
     parser.add_argument('--port', type=str)
+    parser.add_argument('--xml', type=str)
+    parser.add_argument('--interval', type=float)
+    parser.add_argument('--push-url', type=str)
+    parser.add_argument('--token', type=str)
+    parser.add_argument('--push', action='store_true')
+    parser.add_argument('--merge', type=str, nargs='+')
+    parser.add_argument('--machine', type=str)
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--list', '-l' , action='store_true')
     parser.add_argument('--update', '-u' , action='store_true')
     parser.add_argument('--reset', '-r' , action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--index', action='store_true')
+    parser.add_argument('--sync', action='store_true')
     parser.add_argument('--run', action='store_true')
+    parser.add_argument('--serve', action='store_true')
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--maintain', action='store_true')
+    parser.add_argument('--retain-days', type=float)
+    parser.add_argument('--retain-runs', type=int)
+    parser.add_argument('--archive-days', type=float)
+    parser.add_argument('--compress', type=str, choices=['gzip', 'zstd', 'none'])
     args = parser.parse_args()
     if args.home:
         set_config('PROCESS_AUTOMATION_HOME', args.home)
@@ -250,17 +308,83 @@ if __name__ == "__main__":
         set_config('HOST', args.host)
     if args.port:
         set_config('PORT', args.port)
+    if args.xml is not None:
+        set_config('TASK_XML_FOLDER', args.xml)
+    if args.interval:
+        set_config('SYNC_INTERVAL', args.interval)
+    if args.push_url is not None:
+        set_config('PUSH_URL', args.push_url)
+    if args.token is not None:
+        set_config('INGEST_TOKEN', args.token)
+    if args.retain_days is not None or args.retain_runs is not None:
+        try:
+            retention = get_config('RETENTION')
+        except KeyError:
+            retention = {}
+        policy = retention.setdefault('*', {})
+        if args.retain_days is not None:
+            policy['days'] = args.retain_days
+        if args.retain_runs is not None:
+            policy['runs'] = args.retain_runs
+        set_config('RETENTION', retention)
+    if args.archive_days is not None:
+        set_config('LOG_ARCHIVE_DAYS', args.archive_days)
+    if args.compress:
+        set_config('LOG_COMPRESSION', None if args.compress == 'none' else args.compress)
     if args.list:
         list_configs()
     if args.reset:
-        build(update=False)
+        print_report(build(update=False, workers=args.workers))
     elif args.update:
-        build(update=True)
-    if args.run:
-        build(update=True)
-        from webapp import *
-        debug = args.debug
+        print_report(build(update=True, workers=args.workers))
+    if args.rebuild:
+        with transaction(os.path.join(get_config('PROCESS_AUTOMATION_HOME'), get_config('DB_NAME'))) as cursor:
+            rebuild_latest_runs(cursor)
+    if args.index:
+        from task_scheduler_dashboard_shauncampbell20.search import ingest
+        home = get_config('PROCESS_AUTOMATION_HOME')
+        print('Indexed %d log lines' % ingest(os.path.join(home, get_config('DB_NAME')), os.path.join(home, 'logs')))
+    if args.push:
+        from task_scheduler_dashboard_shauncampbell20.aggregate import push
+        home = get_config('PROCESS_AUTOMATION_HOME')
+        print('Pushed %d runs' % push(get_config('PUSH_URL'), get_config('INGEST_TOKEN'), os.path.join(home, get_config('DB_NAME')),
+                                      default_source().machine))
+    if args.merge:
+        from task_scheduler_dashboard_shauncampbell20.aggregate import merge_database
+        home = get_config('PROCESS_AUTOMATION_HOME')
+        migrate(os.path.join(home, get_config('DB_NAME')))
+        for other_path in args.merge:
+            print('Merged %d runs from %s' % (merge_database(os.path.join(home, get_config('DB_NAME')), other_path, args.machine), other_path))
+    if args.maintain:
+        from task_scheduler_dashboard_shauncampbell20.retention import maintain
+        home = get_config('PROCESS_AUTOMATION_HOME')
+        migrate(os.path.join(home, get_config('DB_NAME')))
+        report = maintain(os.path.join(home, get_config('DB_NAME')), os.path.join(home, 'logs'))
+        print('Deleted %(runs_deleted)d runs, compressed %(logs_compressed)d logs, archived %(logs_archived)d logs, '
+              'released %(pages_released)d pages' % report)
+    if args.sync and not args.run:
+        from task_scheduler_dashboard_shauncampbell20.sync import SyncService, sync_interval
+        print('Syncing every %g seconds, press Ctrl+C to stop' % sync_interval())
+        service = SyncService(workers=args.workers)
+        service.start()
+        try:
+            while service.is_alive():
+                service.join(1)
+        except KeyboardInterrupt:
+            service.stop()
+    if args.run or args.serve:
+        from task_scheduler_dashboard_shauncampbell20.sync import SyncService, sync_once, sync_interval
+        sync_once(workers=args.workers)
+        from task_scheduler_dashboard_shauncampbell20.webapp import app
+        from task_scheduler_dashboard_shauncampbell20.serve import SERVE_THREADS, run, serve
+        debug = args.debug and not args.serve
         host = get_config('HOST')
         port = get_config('PORT')
-        app.run_server(host=host, port=port, debug=debug)
+        # With debug the reloader runs the app in a child process, only sync there
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            SyncService(workers=args.workers, delay=sync_interval()).start()
+        if args.serve:
+            serve(app, host, port, args.threads or SERVE_THREADS)
+        else:
+            run(app, host, port, debug)
         
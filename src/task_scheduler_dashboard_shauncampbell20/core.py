@@ -1,49 +1,99 @@
 import os
+import sys
+import copy
 import sqlite3
-import datetime
 import logging
 from logging import Logger
 import json
-import inspect
-import warnings
+import time
+import collections
+import threading
+from task_scheduler_dashboard_shauncampbell20.db import STATEMENTS, transaction, execute, query_one
+from task_scheduler_dashboard_shauncampbell20.schema import SCHEMA_VERSION, migrate
+from task_scheduler_dashboard_shauncampbell20.rollups import rollup_runs
+from task_scheduler_dashboard_shauncampbell20.logfiles import shard_path, stored_paths
 
 _loc = os.path.split(__file__)[0]
 
+## Configuration
+# Configs are read from config.json next to this module and cached until the file's modification time
+# or size changes, so get_config costs one stat. A TASK_DASHBOARD_<NAME> environment variable overrides
+# the config NAME: it is taken as a string, or parsed as JSON if the file holds a non string value for
+# NAME or the variable starts with { or [. PROCESS_AUTOMATION_HOME, SCHEDULER_FOLDER and DB_NAME are
+# also module attributes, read when first used.
+
+CONFIG_ENV_PREFIX = 'TASK_DASHBOARD_'
+MODULE_CONFIGS = ['PROCESS_AUTOMATION_HOME', 'SCHEDULER_FOLDER', 'DB_NAME']
+_config_cache = (None, {})
+_config_lock = threading.Lock()
+
+def config_path():
+    return os.path.join(_loc, 'config.json')
+
 def create_config_file():
     # Create config file in current directory
-    if 'config.json' not in os.listdir(_loc):
+    if not os.path.exists(config_path()):
         default = os.path.join(os.path.expanduser('~'),'Process Dashboard')
         configs = {'PROCESS_AUTOMATION_HOME': default, 'SCHEDULER_FOLDER': '\\Automation', 'DB_NAME':'process_automation.db','HOST':'127.0.0.1', 'PORT':'8050'}
-        with open (os.path.join(_loc, 'config.json'), 'w') as f:
+        with open (config_path(), 'w') as f:
             json.dump(configs, f)
 
-def get_config(config_name):
-    # Get a named config from config file
-    if 'config.json' not in os.listdir(_loc):
+def _file_configs():
+    # Configs of config.json, creating it if missing, re-read only when the file changed
+    global _config_cache
+    try:
+        stat = os.stat(config_path())
+    except FileNotFoundError:
         create_config_file()
-    with open(os.path.join(_loc, 'config.json'), 'r') as config:
-        configs = json.load(config)
-    return configs[config_name]
-    
+        stat = os.stat(config_path())
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _config_cache[0] != key:
+        with _config_lock:
+            with open(config_path(), 'r') as config:
+                _config_cache = (key, json.load(config))
+    return _config_cache[1]
+
+def _env_config(config_name, value, file_value):
+    # Value of an environment override, see above
+    if value[:1] in ('{', '[') or (file_value is not None and not isinstance(file_value, str)):
+        return json.loads(value)
+    return value
+
+def get_config(config_name):
+    # Get a named config from the environment or the config file
+    configs = _file_configs()
+    value = os.environ.get(CONFIG_ENV_PREFIX + config_name)
+    if value is not None:
+        return _env_config(config_name, value, configs.get(config_name))
+    return copy.deepcopy(configs[config_name])
+
+def get_configs():
+    # All configs, with the environment overrides applied, as a new dict
+    configs = copy.deepcopy(_file_configs())
+    for key, value in os.environ.items():
+        if key.startswith(CONFIG_ENV_PREFIX):
+            config_name = key[len(CONFIG_ENV_PREFIX):]
+            configs[config_name] = _env_config(config_name, value, configs.get(config_name))
+    return configs
+
 def set_config(config_name, config_value):
-    # Set a named config in the config file
-    with open(os.path.join(_loc, 'config.json'), 'r') as config:
-        configs = json.load(config)
-    configs[config_name] = config_value
-    with open (os.path.join(_loc, 'config.json'), 'w') as f:
-        json.dump(configs, f)
-
-# Create config file if not present in directory
-if 'config.json' not in os.listdir(_loc):
-    create_config_file()
-
-# Load configs
-with open(os.path.join(_loc, 'config.json'), 'r') as config:
-    configs = json.load(config)
-PROCESS_AUTOMATION_HOME = configs["PROCESS_AUTOMATION_HOME"]
-SCHEDULER_FOLDER = configs["SCHEDULER_FOLDER"]
-DB_NAME = configs["DB_NAME"]
-    
+    # Set a named config in the config file, environment overrides still take precedence
+    global _config_cache
+    with _config_lock:
+        with open(config_path(), 'r') as config:
+            configs = json.load(config)
+        configs[config_name] = config_value
+        with open (config_path(), 'w') as f:
+            json.dump(configs, f)
+        stat = os.stat(config_path())
+        _config_cache = ((stat.st_mtime_ns, stat.st_size), configs)
+
+def __getattr__(name):
+    # PROCESS_AUTOMATION_HOME, SCHEDULER_FOLDER and DB_NAME, read from the configs when used
+    if name in MODULE_CONFIGS:
+        return get_config(name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
 resultCodes = {0: 'The operation completed successfully.',
                1: '',
                10: 'The environment is incorrect.',
@@ -63,61 +113,232 @@ resultCodes = {0: 'The operation completed successfully.',
                3228369022: 'Unknown software exception.',
                -2147020576: 'The operator or administrator has refused the request.'}
 
+def _progress_line(num, total):
+    # Progress bar line for num of total items, or a running count if total is unknown
+    if not total:
+        return '+PROGRESS | %d items' % num
+    filled = int(num/total*10)
+    return '+PROGRESS |' + '-'*filled + ' '*(10-filled) + '| ' + '{:.1%}'.format(num/total)
+
+LOG_FILE_BASE = 1000000
+
+def allocate_run(process_automation_db, process_automation_logs, script_id, start_time, user=None, machine=None, heartbeat=None):
+    ''' Inserts a running record of script_id on machine into Runs and creates its log file in its shard directory
+        heartbeat is the interval in seconds of the run's heartbeats, None if it sends none
+        The log file is named from the run_id the INTEGER PRIMARY KEY assigns to the new row,
+        so processes starting at the same time never share a run or a log file
+        Raises sqlite3.OperationalError if the database is missing or older than SCHEMA_VERSION
+        returns (run_id, log_file, log_path)
+    '''
+    with transaction(process_automation_db) as cursor:
+        # Databases of earlier versions may still take the insert, but not the updates of the run
+        if cursor.execute('''PRAGMA user_version''').fetchone()[0] < SCHEMA_VERSION:
+            raise sqlite3.OperationalError('database schema is older than version %d' % SCHEMA_VERSION)
+        cursor.execute(STATEMENTS['insert_run'], (script_id, None, start_time, None, 0, 'running', 0, 0, user, machine, heartbeat))
+        run_id = cursor.lastrowid
+        log_file = str(LOG_FILE_BASE + run_id)
+        attempt = 0
+        while True:
+            log_path = shard_path(process_automation_logs, log_file)
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            try:
+                if any(os.path.exists(path) for path in stored_paths(process_automation_logs, log_file)):
+                    raise FileExistsError(log_path)
+                open(log_path, 'x').close()
+                break
+            except FileExistsError:
+                # Left over from before log files were named by run_id
+                attempt += 1
+                log_file = '%d-%d' % (LOG_FILE_BASE + run_id, attempt)
+        cursor.execute(STATEMENTS['set_run_log_file'], (log_file, run_id))
+    return run_id, log_file, log_path
+
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT_MISSED = 20
+HEARTBEAT_TIMEOUT = HEARTBEAT_INTERVAL * HEARTBEAT_MISSED
+LEGACY_RUN_TIMEOUT = 24 * 3600
+
+def sweep_abandoned_runs(process_automation_db, now=None):
+    ''' Marks runs whose ProcessLogger stopped sending heartbeats as 'abandoned'
+        A run is abandoned when it missed HEARTBEAT_MISSED of its heartbeats, counted from its start
+        until the first one. Runs started before their interval was recorded are abandoned when their
+        last heartbeat is older than HEARTBEAT_TIMEOUT seconds, and runs without heartbeats when they
+        started more than LEGACY_RUN_TIMEOUT seconds ago. Runs uploaded from other machines are left
+        to those machines.
+        returns the number of runs marked
+    '''
+    now = int(time.time()) if now is None else now
+    with transaction(process_automation_db) as cursor:
+        cursor.execute(STATEMENTS['sweep_abandoned_runs'], (HEARTBEAT_MISSED, now, now - HEARTBEAT_TIMEOUT, now - LEGACY_RUN_TIMEOUT))
+        return cursor.rowcount
+
+LOG_QUEUE_SIZE = 10000
+LOG_FLUSH_INTERVAL = 0.5
+
+class BatchFileHandler(logging.Handler):
+    ''' Handler that leaves formatting and writing of records to a background thread
+        Records wait in a buffer of at most capacity records; when it is full the logging call waits,
+        so no record is dropped. The thread writes whatever is buffered in one write, at least every
+        flush_interval seconds. flush() returns once every record logged before it is written, and
+        logging.shutdown() closes the handler, writing the rest, when the interpreter exits.
+    '''
+    def __init__(self, filename, capacity=LOG_QUEUE_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+        super().__init__()
+        self.stream = open(filename, 'a')
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.buffer = collections.deque()
+        self.wake = threading.Event()
+        self.written = threading.Condition()
+        self.thread = threading.Thread(target=self._write, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        # Merge the arguments now, they may change after the call returns
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+                record.exc_info = None
+            if self.thread.is_alive() and len(self.buffer) >= self.capacity:
+                # Block until the thread has written the buffer, checking every flush_interval that it still runs
+                self.wake.set()
+                with self.written:
+                    while not self.written.wait_for(lambda: len(self.buffer) < self.capacity or not self.thread.is_alive(),
+                                                    self.flush_interval):
+                        self.wake.set()
+            if self.thread.is_alive():
+                self.buffer.append(record)
+            elif not self.stream.closed:
+                # Logged after close()
+                self.stream.write(self.format(record) + '\n')
+                self.stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def _write(self):
+        stop = False
+        while not stop:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            lines = []
+            done = []
+            record = None
+            while self.buffer:
+                item = self.buffer.popleft()
+                if isinstance(item, logging.LogRecord):
+                    record = item
+                    try:
+                        lines.append(self.format(item) + '\n')
+                    except Exception:
+                        self.handleError(item)
+                else:
+                    done.append(item)
+                    stop = stop or item.stop
+            if lines:
+                try:
+                    self.stream.write(''.join(lines))
+                    self.stream.flush()
+                except Exception:
+                    # Reported with the last record of the batch, the items after it are markers
+                    self.handleError(record)
+            with self.written:
+                self.written.notify_all()
+            for event in done:
+                event.set()
+
+    def _mark(self, stop=False):
+        # Adds a marker to the buffer and waits until the thread has written everything before it
+        if not self.thread.is_alive():
+            return
+        event = threading.Event()
+        event.stop = stop
+        self.buffer.append(event)
+        self.wake.set()
+        event.wait()
+
+    def flush(self):
+        self._mark()
+
+    def close(self):
+        self._mark(stop=True)
+        if not self.stream.closed:
+            self.stream.close()
+        super().close()
+
 class ProcessLogger(Logger):
     ''' Wrapper for logging.Logger object
         Sets file handler to write logs to PROCESS_AUTOMATION_HOME/logs
         Integrates with PROCESS_AUTOMATION_HOME/DB_NAME to update it when tasks run/complete
     '''
-    def __init__(self, name=None):
+    def __init__(self, name=None, async_writes=False, heartbeat=HEARTBEAT_INTERVAL):
         ''' sets file handler and adds record to Runs table
-            calls config.build() to initialize database if it does not exist
+            creates the database, or upgrades it to the current schema, if needed (schema.migrate)
+            async_writes: write the log from a background thread in batches (BatchFileHandler),
+            for scripts that log for every record
+            heartbeat: seconds between updates of the run's counters in Runs while it runs, None to disable;
+            the run is marked abandoned once HEARTBEAT_MISSED updates are missing
         '''
         if not name:
-            name = os.path.splitext(os.path.split(inspect.stack()[1][1])[-1])[0]
+            name = os.path.splitext(os.path.split(sys._getframe(1).f_code.co_filename)[-1])[0]
         super().__init__(name)
-        self.start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self.start_time = int(time.time())
+        self._started = time.monotonic()
         self.records = 0
         self.errors = 0
         self.warnings = 0
         self.criticals = 0
         self.result = ''
         self.script_id = name
-        self.user = os.getlogin()
+        try:
+            self.user = os.getlogin()
+        except OSError:
+            # No controlling terminal, e.g. a service or a cron job outside Windows
+            import getpass
+            self.user = getpass.getuser()
         self.machine = os.environ['COMPUTERNAME']
-        self.process_automation_db = os.path.join(PROCESS_AUTOMATION_HOME, DB_NAME)
-        self.process_automation_logs = os.path.join(PROCESS_AUTOMATION_HOME, 'logs')
-        if not os.path.exists(self.process_automation_logs):
-            os.mkdir(self.process_automation_logs)
-        if len(os.listdir(self.process_automation_logs)) == 0:
-            self.log_file = '1000000'
+        home = get_config('PROCESS_AUTOMATION_HOME')
+        self.process_automation_db = os.path.join(home, get_config('DB_NAME'))
+        self.process_automation_logs = os.path.join(home, 'logs')
+        os.makedirs(self.process_automation_logs, exist_ok=True)
+        try:
+            self.run_id, self.log_file, self.log_path = allocate_run(
+                self.process_automation_db, self.process_automation_logs, self.script_id, self.start_time,
+                self.user, self.machine, heartbeat or None)
+        except sqlite3.OperationalError:
+            # Database missing or older than this version: create or upgrade its tables, never clear them
+            migrate(self.process_automation_db)
+            self.run_id, self.log_file, self.log_path = allocate_run(
+                self.process_automation_db, self.process_automation_logs, self.script_id, self.start_time,
+                self.user, self.machine, heartbeat or None)
+        self.progress_path = self.log_path + '.progress'
+        if async_writes:
+            handler = BatchFileHandler(self.log_path)
         else:
-            self.log_file = str(int(sorted(os.listdir(self.process_automation_logs))[-1]) + 1)
-        self.log_path = os.path.join(self.process_automation_logs, self.log_file)
-        handler = logging.FileHandler(self.log_path)
+            handler = logging.FileHandler(self.log_path)
         handler.setFormatter(logging.Formatter('%(levelname)s:%(asctime)s - %(message)s'))
         self.addHandler(handler)
         self.info('starting execution for %s' % self.script_id)
+        self._completed = threading.Event()
         try:
-            with sqlite3.connect(self.process_automation_db) as local:
-                cursor = local.cursor()
-                cursor.execute('''INSERT INTO Runs (script_id, log_file, start_time, 
-                end_time, records, result, errors, warnings) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                                    (self.script_id, self.log_file, self.start_time, '', 0, 'running', 0, 0))
-                local.commit()
-        except:
-            from task_scheduler_dashboard_shauncampbell20.config import build
-            build(update=False)
-            with sqlite3.connect(self.process_automation_db) as local:
-                cursor = local.cursor()
-                cursor.execute('''INSERT INTO Runs 
-                (script_id, log_file, start_time, end_time, records, result, errors, warnings) VALUES 
-                (?, ?, ?, ?, ?, ?, ?, ?)''', (self.script_id, self.log_file, self.start_time, '', 0, 'running', 0, 0))
-                local.commit()
-        
-        with sqlite3.connect(self.process_automation_db) as local:
-            cursor = local.cursor()
-            self.run_id = cursor.execute(
-                f'''SELECT * FROM Runs WHERE script_id = '{self.script_id}' ORDER BY start_time DESC ''').fetchone()[0]
+            sweep_abandoned_runs(self.process_automation_db)
+        except sqlite3.Error:
+            pass
+        if heartbeat:
+            threading.Thread(target=self._heartbeat, args=(heartbeat,), name='heartbeat', daemon=True).start()
+
+    def _heartbeat(self, interval):
+        ''' Reports the counters and a last seen time to Runs every interval seconds until complete()
+            Runs on its own thread and reads the counters as they are, so logging and progress() do no
+            extra work. A failed update (e.g. the database is busy) is skipped until the next one.
+        '''
+        while not self._completed.wait(interval):
+            try:
+                execute(self.process_automation_db, 'heartbeat_run',
+                        (self.records, self.errors, self.warnings, self.user, self.machine, int(time.time()), self.run_id))
+            except Exception:
+                pass
 
     def error(self, msg, *args, **kwargs):
         # Increment errors by 1 and log to file
@@ -136,49 +357,70 @@ class ProcessLogger(Logger):
     
     def last_run(self):
         # Retrieves date last ran for script_id
-        with sqlite3.connect(self.process_automation_db) as local:
-            cursor = local.cursor()
-            last_ran = cursor.execute(f'''SELECT start_time FROM Runs WHERE script_id = '{self.script_id}' ORDER BY start_time DESC ''').fetchone()[0]
-            if last_ran == None:
-                return '1/1/1900'
-            else:
-                return last_ran
+        last_ran = query_one(self.process_automation_db, 'last_run', (self.script_id,))
+        if last_ran == None or last_ran[0] == None:
+            return '1/1/1900'
+        else:
+            return last_ran[0]
     
-    def progress(self, iterable, records = True):
-        # function to add incrementing progress bar to log file
-        if inspect.isgenerator(iterable):
-            iterable = [i for i in iterable]
-        total = len(iterable)
-        num = 1
-        for item in iterable:
-            s = '+PROGRESS |'
-            s += '-'*int(num/total*10)
-            s += ' '*(10-int(num/total*10))
-            s += '| '
-            s += '{:.1%}'.format(num/total)
-            with open(self.log_path, 'r', encoding='UTF-8') as f:
-                cur_log = f.readlines()
-            if '+PROGRESS' in cur_log[-1]:
-                cur_log[-1] = s
-            else:
-                cur_log.extend(s)
-            with open(self.log_path, 'w', encoding='UTF-8') as f:
-                f.write(''.join(cur_log))
-                
-            yield item
-            num += 1
-            if records == True:
-                self.records += 1
-        with open(self.log_path, 'r', encoding='UTF-8') as f:
-            cur_log = f.read()
-        cur_log += '\n'
-        with open(self.log_path, 'w', encoding='UTF-8') as f:
-            f.write(cur_log)
+    def progress(self, iterable, records = True, interval = 1.0, every = None):
+        ''' Yields each item of iterable while tracking progress
+            The current progress bar is kept in a sidecar file (<log_path>.progress) that is
+            replaced on update, so the cost per item is constant and the log is only appended to.
+            Iterables without a length (e.g. generators) are not materialized, progress is
+            reported as a running count instead.
+            interval: minimum number of seconds between progress updates
+            every: also update after every n items, regardless of interval
+        '''
+        try:
+            total = len(iterable)
+        except TypeError:
+            total = None
+        num = 0
+        last_update = time.monotonic()
+        self._write_progress(_progress_line(num, total))
+        try:
+            for item in iterable:
+                yield item
+                num += 1
+                if records == True:
+                    self.records += 1
+                now = time.monotonic()
+                if now - last_update >= interval or (every and num % every == 0):
+                    self._write_progress(_progress_line(num, total))
+                    last_update = now
+        finally:
+            # Append the final state to the log and remove the sidecar
+            self.flush_logs()
+            with open(self.log_path, 'a', encoding='UTF-8') as f:
+                f.write(_progress_line(num, total) + '\n')
+            try:
+                os.remove(self.progress_path)
+            except OSError:
+                pass
+
+    def flush_logs(self):
+        # Writes any log records still queued by a BatchFileHandler
+        for handler in self.handlers:
+            handler.flush()
+
+    def _write_progress(self, line):
+        # Atomically replace the progress sidecar file
+        tmp = self.progress_path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='UTF-8') as f:
+                f.write(line)
+            os.replace(tmp, self.progress_path)
+        except OSError:
+            pass
                 
     def complete(self):
         # Update Runs table with results
-        end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._completed.set()
+        end_time = int(time.time())
+        duration_ms = int((time.monotonic() - self._started) * 1000)
         self.info('execution for %s completed.' % self.script_id)
+        self.flush_logs()
         if self.criticals > 0:
             self.result = 'critical'
         elif self.errors > 0:
@@ -189,17 +431,12 @@ class ProcessLogger(Logger):
             self.result = 'no records'
         else:
             self.result = 'success'
-        with sqlite3.connect(self.process_automation_db) as local:
-            cursor = local.cursor()
-            cursor.execute(f'''
-                UPDATE Runs 
-                SET end_time = '{end_time}', 
-                records = {self.records}, 
-                result = '{self.result}', 
-                errors = {self.errors},
-                warnings = {self.warnings},
-                user = '{self.user}',
-                machine = '{self.machine}'
-                WHERE run_id = {self.run_id}
-            ''')
-            local.commit()
+        execute(self.process_automation_db, 'complete_run',
+                (end_time, duration_ms, self.records, self.result, self.errors, self.warnings,
+                 self.user, self.machine, self.run_id))
+        # Add the run to the statistics, left to the next sync if the database is busy
+        try:
+            with transaction(self.process_automation_db) as cursor:
+                rollup_runs(cursor, run_id=self.run_id)
+        except sqlite3.Error:
+            pass
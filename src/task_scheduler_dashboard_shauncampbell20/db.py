@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+## Data access shared by core, config and webapp
+# connection() lends out pooled connections, so a ProcessLogger or a dashboard request reuses an
+# open connection and its compiled statements instead of connecting for every query. The queries
+# the project runs are kept in STATEMENTS and always take their values as parameters. The dashboard
+# reads through read-only connections, pooled apart from the others.
+
+TIMEOUT = 30
+POOL_SIZE = 8
+CACHED_STATEMENTS = 256
+PRAGMAS = ['PRAGMA busy_timeout = %d' % (TIMEOUT * 1000),
+           'PRAGMA synchronous = NORMAL',
+           'PRAGMA cache_size = -16000',
+           'PRAGMA temp_store = MEMORY']
+
+STATEMENTS = {
+    # Runs, written by ProcessLogger
+    'insert_run': '''INSERT INTO Runs (script_id, log_file, start_time,
+        end_time, records, result, errors, warnings, user, machine, heartbeat_interval) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'set_run_log_file': '''UPDATE Runs SET log_file = ? WHERE run_id = ?''',
+    'complete_run': '''
+        UPDATE Runs
+        SET end_time = ?,
+        duration_ms = ?,
+        records = ?,
+        result = ?,
+        errors = ?,
+        warnings = ?,
+        user = ?,
+        machine = ?
+        WHERE run_id = ?''',
+    'heartbeat_run': '''UPDATE Runs SET records = ?, errors = ?, warnings = ?, user = ?, machine = ?, heartbeat_time = ?
+        WHERE run_id = ? AND end_time IS NULL''',
+    # Runs with a heartbeat_interval are late after that many intervals, runs of earlier versions after a fixed time
+    'sweep_abandoned_runs': '''
+        UPDATE Runs
+        SET result = 'abandoned',
+        end_time = COALESCE(heartbeat_time, start_time),
+        duration_ms = (COALESCE(heartbeat_time, start_time) - start_time) * 1000
+        WHERE end_time IS NULL AND origin_run_id IS NULL
+        AND CASE WHEN heartbeat_interval IS NOT NULL THEN COALESCE(heartbeat_time, start_time) + heartbeat_interval * ? < ?
+            WHEN heartbeat_time IS NOT NULL THEN heartbeat_time < ?
+            ELSE start_time < ? END''',
+    'last_run': '''SELECT strftime('%Y-%m-%d %H:%M:%S', start_time, 'unixepoch') FROM Runs
+        WHERE script_id = ? ORDER BY start_time DESC LIMIT 1''',
+    # Tasks and Executors
+    'is_task': '''SELECT 1 FROM Tasks WHERE script_id = ? LIMIT 1''',
+    'task_info': '''SELECT script_id, command, script, run_dir, execution_command, machine FROM Tasks
+        WHERE script_id = ? LIMIT 1''',
+    'machines': '''SELECT DISTINCT machine FROM Tasks WHERE machine IS NOT NULL ORDER BY machine''',
+    # Rows of the home page DataTable: Task and LogFile as markdown links, times formatted, NULL as ''
+    # Only the tasks of a machine if one is given, and only the tasks whose LatestRuns row changed after a version
+    'last_run_table': '''
+        SELECT
+        '[' || Tasks.script_id || '](/' || Tasks.script_id || ')' as Task,
+        COALESCE(strftime('%Y-%m-%d %H:%M:%S', LatestRuns.start_time, 'unixepoch'), '') as StartTime,
+        COALESCE(strftime('%Y-%m-%d %H:%M:%S', LatestRuns.end_time, 'unixepoch'), '') as EndTime,
+        COALESCE(LatestRuns.result, '') as Result,
+        COALESCE(LatestRuns.records, '') as Records,
+        COALESCE(ROUND(CASE WHEN LatestRuns.end_time IS NULL
+            THEN LatestRuns.records * 1.0 / NULLIF(LatestRuns.heartbeat_time - LatestRuns.start_time, 0)
+            ELSE LatestRuns.records * 1000.0 / NULLIF(LatestRuns.duration_ms, 0) END, 1), '') as RecordsPerSec,
+        COALESCE(LatestRuns.errors, '') as Errors,
+        COALESCE(LatestRuns.warnings, '') as Warnings,
+        COALESCE('[' || LatestRuns.log_file || '](/' || LatestRuns.log_file || ')', '') as LogFile,
+        COALESCE(LatestRuns.user, '') as RanBy,
+        COALESCE(LatestRuns.machine, '') as Machine,
+        COALESCE(Executors.name, '') as Executor,
+        COALESCE(Executors.state, '') as Status,
+        COALESCE(strftime('%Y-%m-%d %H:%M:%S', Executors.last_run_time, 'unixepoch'), '') as LastRunTime,
+        COALESCE(strftime('%Y-%m-%d %H:%M:%S', Executors.next_run_time, 'unixepoch'), '') as NextRunTime
+        FROM Tasks
+        LEFT JOIN LatestRuns ON LatestRuns.machine = COALESCE(Tasks.machine, '') AND LatestRuns.script_id = Tasks.script_id
+        LEFT JOIN Executors ON Tasks.command = Executors.command AND Tasks.machine = Executors.machine
+        WHERE (? IS NULL OR Tasks.machine = ?)
+        AND COALESCE(LatestRuns.version, 0) > ?
+        --AND Executors.state <> 'Disabled'
+        ORDER BY LatestRuns.start_time DESC''',
+    'data_versions': '''SELECT name, version FROM DataVersions''',
+    # SyncStatus
+    'record_sync': '''
+        INSERT INTO SyncStatus (machine, sync_time, duration_ms, changes, status, error, success_time)
+        VALUES (?, ?, ?, ?, ?, ?, CASE WHEN ? = 'ok' THEN ? END)
+        ON CONFLICT (machine) DO UPDATE SET
+        sync_time = excluded.sync_time,
+        duration_ms = excluded.duration_ms,
+        changes = excluded.changes,
+        status = excluded.status,
+        error = excluded.error,
+        success_time = COALESCE(excluded.success_time, SyncStatus.success_time)''',
+    'sync_status': '''SELECT * FROM SyncStatus ORDER BY machine''',
+}
+
+_held = threading.local()
+_idle = {}
+_idle_lock = threading.Lock()
+
+def open_connection(db_path, timeout=TIMEOUT, read_only=False):
+    ''' Opens a connection for the pool
+        Connections are in autocommit mode, so reads never keep a transaction open; writes that
+        must be atomic use transaction(). The statement cache keeps the compiled statements of
+        STATEMENTS and of the other repeated queries. A read_only connection fails on any write.
+    '''
+    if read_only:
+        # Imported here, it would add http.client and ssl to every ProcessLogger import
+        import urllib.request
+        db_path = 'file:%s?mode=ro' % urllib.request.pathname2url(os.path.abspath(db_path))
+    local = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False,
+                            cached_statements=CACHED_STATEMENTS, uri=read_only)
+    for pragma in PRAGMAS:
+        local.execute(pragma)
+    return local
+
+@contextmanager
+def connection(db_path, read_only=False):
+    ''' Lends a pooled connection to db_path to the current thread
+        Nested calls in the same thread get the same connection. On return, a transaction left
+        open is rolled back and the connection goes back to the pool.
+    '''
+    key = (db_path, read_only)
+    held = _held.__dict__.setdefault('connections', {})
+    if key in held:
+        yield held[key]
+        return
+    with _idle_lock:
+        idle = _idle.setdefault(key, [])
+        local = idle.pop() if idle else None
+    if local is None:
+        local = open_connection(db_path, read_only=read_only)
+    held[key] = local
+    try:
+        yield local
+    finally:
+        del held[key]
+        if local.in_transaction:
+            local.rollback()
+        with _idle_lock:
+            if len(_idle[key]) < POOL_SIZE:
+                _idle[key].append(local)
+                local = None
+        if local is not None:
+            local.close()
+
+@contextmanager
+def transaction(db_path):
+    # Cursor inside BEGIN IMMEDIATE ... COMMIT on a pooled connection, rolled back on error
+    with connection(db_path) as local:
+        cursor = local.cursor()
+        cursor.execute('''BEGIN IMMEDIATE''')
+        try:
+            yield cursor
+            cursor.execute('''COMMIT''')
+        except:
+            cursor.execute('''ROLLBACK''')
+            raise
+
+def execute(db_path, name, params=()):
+    # Runs the named statement, returns the cursor's lastrowid
+    with connection(db_path) as local:
+        return local.execute(STATEMENTS[name], params).lastrowid
+
+def query(db_path, name, params=(), row_factory=None, read_only=False):
+    # Rows of the named statement, as tuples or made by row_factory (e.g. sqlite3.Row)
+    with connection(db_path, read_only) as local:
+        cursor = local.cursor()
+        cursor.row_factory = row_factory
+        return cursor.execute(STATEMENTS[name], params).fetchall()
+
+def query_one(db_path, name, params=(), row_factory=None, read_only=False):
+    # First row of the named statement, or None
+    with connection(db_path, read_only) as local:
+        cursor = local.cursor()
+        cursor.row_factory = row_factory
+        return cursor.execute(STATEMENTS[name], params).fetchone()
+
+def close_all():
+    # Closes the idle pooled connections, e.g. before replacing a database file
+    with _idle_lock:
+        for idle in _idle.values():
+            while idle:
+                idle.pop().close()
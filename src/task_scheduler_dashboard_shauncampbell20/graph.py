@@ -0,0 +1,133 @@
+import json
+from collections import deque
+from task_scheduler_dashboard_shauncampbell20.db import connection
+
+## Task dependency graph
+# TaskGraph holds the edges between the jobs of each machine:
+#   executor -> batch file it runs -> script the batch file runs -> batch file the script triggers
+# A script triggers the batch files whose command is its script_id; those batch files get an
+# executor derived from the script (config.derived_executors). config.build and aggregate.apply_batch
+# rebuild a machine's edges in one pass over its Executors and Tasks rows. upstream and downstream
+# jobs are found by walking the edges, and their status is read from Executors and LatestRuns,
+# never from Runs.
+
+EXECUTOR = 'executor'
+BATCH = 'batch'
+SCRIPT = 'script'
+GRAPH_COLUMNS = ['machine', 'source_kind', 'source', 'target_kind', 'target']
+MAX_DEPTH = 20
+
+def graph_edges(machine, executors, tasks, script_ids):
+    ''' Edges of machine from its Executors and Tasks rows, ordered like config.EXECUTOR_COLUMNS and TASK_COLUMNS
+        script_ids: script_ids of the tasks of every machine, which can trigger this machine's batch files
+        returns {edge: edge}, rows of TaskGraph keyed by themselves for config.sync_rows
+    '''
+    edges = set()
+    commands = set()
+    for row in executors:
+        edges.add((machine, EXECUTOR, row[0], BATCH, row[6]))
+        commands.add(row[6])
+    for row in tasks:
+        edges.add((machine, BATCH, row[1], SCRIPT, row[0]))
+        commands.add(row[1])
+    for command in commands & set(script_ids):
+        edges.add((machine, SCRIPT, command, BATCH, command))
+    return {edge: edge for edge in edges}
+
+def find_cycles(edges):
+    ''' Cycles of the graph of edges, across machines
+        returns a list of cycles, each a list of (kind, name) nodes starting and ending with the same node
+    '''
+    adjacency = {}
+    for _, source_kind, source, target_kind, target in edges:
+        adjacency.setdefault((source_kind, source), set()).add((target_kind, target))
+    # Depth first, without recursion: state is 1 while a node is on the path, 2 once it is done
+    state = {}
+    cycles = []
+    for root in sorted(adjacency):
+        if root in state:
+            continue
+        state[root] = 1
+        path = [root]
+        stack = [iter(sorted(adjacency[root]))]
+        while stack:
+            for node in stack[-1]:
+                if state.get(node) == 1:
+                    cycles.append(path[path.index(node):] + [node])
+                elif node not in state:
+                    state[node] = 1
+                    path.append(node)
+                    stack.append(iter(sorted(adjacency.get(node, ()))))
+                    break
+            else:
+                state[path.pop()] = 2
+                stack.pop()
+    return cycles
+
+def walk(cursor, script_id, direction, max_depth=MAX_DEPTH):
+    ''' Jobs upstream ('up') or downstream ('down') of script_id, breadth first
+        returns a list of dicts with kind, name, machine and depth, each job once
+    '''
+    if direction == 'up':
+        sql = '''SELECT source_kind, source, machine FROM TaskGraph WHERE target_kind = ? AND target = ?'''
+    else:
+        sql = '''SELECT target_kind, target, machine FROM TaskGraph WHERE source_kind = ? AND source = ?'''
+    seen = {(SCRIPT, script_id)}
+    jobs = []
+    frontier = deque([(SCRIPT, script_id, 0)])
+    while frontier:
+        kind, name, depth = frontier.popleft()
+        if depth == max_depth:
+            continue
+        for next_kind, next_name, machine in cursor.execute(sql, (kind, name)).fetchall():
+            if (next_kind, next_name) in seen:
+                continue
+            seen.add((next_kind, next_name))
+            jobs.append({'kind': next_kind, 'name': next_name, 'machine': machine, 'depth': depth + 1})
+            frontier.append((next_kind, next_name, depth + 1))
+    return jobs
+
+def add_status(cursor, jobs):
+    ''' Adds status and last_run_time to jobs
+        Scripts have the result of their latest run on their machine. Executors have their state and last result, and batch
+        files inherit them from the executor that runs them, derived from the triggering script if any.
+    '''
+    scripts = json.dumps([job['name'] for job in jobs if job['kind'] == SCRIPT])
+    latest = {(machine, script_id): (result, end_time or start_time) for machine, script_id, result, start_time, end_time in cursor.execute(
+        '''SELECT machine, script_id, result, start_time, end_time FROM LatestRuns WHERE script_id IN (SELECT value FROM json_each(?))''',
+        (scripts,))}
+    names = json.dumps([job['name'] for job in jobs if job['kind'] != SCRIPT])
+    executors = {}
+    for machine, name, command, state, result, last_run_time in cursor.execute(
+            '''SELECT machine, name, command, state, last_run_result, last_run_time FROM Executors
+            WHERE name IN (SELECT value FROM json_each(?1)) OR command IN (SELECT value FROM json_each(?1))''', (names,)):
+        status = '%s, last result %s' % (state, result) if result else state
+        executors[(machine, EXECUTOR, name)] = (status, last_run_time)
+        executors.setdefault((machine, BATCH, command), (status, last_run_time))
+    for job in jobs:
+        if job['kind'] == SCRIPT:
+            job['status'], job['last_run_time'] = latest.get((job['machine'] or '', job['name']), (None, None))
+        else:
+            job['status'], job['last_run_time'] = executors.get((job['machine'], job['kind'], job['name']), (None, None))
+    return jobs
+
+def task_graph(db_path, script_id):
+    # Upstream and downstream jobs of script_id with their status, and the cycles script_id is part of
+    with connection(db_path, read_only=True) as local:
+        cursor = local.cursor()
+        upstream = add_status(cursor, walk(cursor, script_id, 'up'))
+        downstream = add_status(cursor, walk(cursor, script_id, 'down'))
+        # A cycle through script_id only has jobs that are both upstream and downstream of it
+        nodes = {(job['kind'], job['name']) for job in upstream} & {(job['kind'], job['name']) for job in downstream}
+        nodes.add((SCRIPT, script_id))
+        edges = [edge for edge in cursor.execute('''SELECT %s FROM TaskGraph WHERE source IN (SELECT value FROM json_each(?))'''
+                                                 % ', '.join(GRAPH_COLUMNS), (json.dumps([name for _, name in nodes]),))
+                 if (edge[1], edge[2]) in nodes and (edge[3], edge[4]) in nodes]
+        cycles = [cycle for cycle in find_cycles(edges) if (SCRIPT, script_id) in cycle]
+    return {'script_id': script_id, 'upstream': upstream, 'downstream': downstream, 'cycles': cycles}
+
+def register_graph_api(server, db_path):
+    # Adds GET /api/tasks/<script_id>/graph, the task_graph of script_id as JSON, to the flask server of the dashboard
+    @server.route('/api/tasks/<script_id>/graph')
+    def get_task_graph(script_id):
+        return task_graph(db_path, script_id)
@@ -0,0 +1,305 @@
+import os
+import re
+import zlib
+import bisect
+import struct
+import locale
+import zipfile
+import functools
+
+## Byte offset access to ProcessLogger log files
+# The dashboard log view reads logs in windows of CHUNK_SIZE bytes instead of loading whole files.
+# ProcessLogger writes each log into a shard directory of SHARD_SIZE runs (logs/1000/1000123), and
+# log_path() finds a log by its name wherever it is stored, so /<log_file> links keep working:
+#  - in its shard, plain or compressed by retention.compress_logs (<log_file>.gz or .zst)
+#  - in logs itself, written before shards
+#  - in a zip bundle in logs/archive, moved there by retention.archive_logs; the path of an archived
+#    log is the path of its bundle joined with its name
+# Compressed logs are split into independently compressed frames of FRAME_SIZE bytes with a table of
+# their sizes, so reading a range decompresses only the frames it overlaps. .gz files are a series of
+# gzip members, each recording its sizes in an extra field, that gzip -d reads as one file. .zst files
+# use the zstd seekable format and need the zstandard package.
+
+CHUNK_SIZE = 64 * 1024
+HEADER_SIZE = 4 * 1024
+ARCHIVE_DIR = 'archive'
+ARCHIVE_BUNDLE_SIZE = 10000
+SHARD_SIZE = 1000
+FRAME_SIZE = 256 * 1024
+COMPRESSED_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_FRAME_ID = b'TS'
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+
+def _decode(data):
+    # Log files are written by logging.FileHandler with the default encoding
+    return data.decode(locale.getpreferredencoding(False), errors='replace')
+
+def archive_path(process_automation_logs, log_file):
+    # Bundle that holds log_file once archived, logs are grouped by number, ARCHIVE_BUNDLE_SIZE per bundle
+    number = re.match('[0-9]+', log_file)
+    name = '%d.zip' % (int(number.group(0)) // ARCHIVE_BUNDLE_SIZE) if number else 'other.zip'
+    return os.path.join(process_automation_logs, ARCHIVE_DIR, name)
+
+@functools.lru_cache(maxsize=64)
+def _archive_members(bundle, mtime_ns):
+    with zipfile.ZipFile(bundle) as archive:
+        return {info.filename: info.file_size for info in archive.infolist()}
+
+def archive_members(bundle):
+    # {log_file: size} of the logs in a bundle, empty if it does not exist
+    try:
+        return _archive_members(bundle, os.stat(bundle).st_mtime_ns)
+    except (OSError, zipfile.BadZipFile):
+        return {}
+
+def _archived(path):
+    # (bundle, log_file) if path is a log inside a bundle, else None
+    bundle, log_file = os.path.split(path)
+    if bundle.endswith('.zip') and os.path.isfile(bundle):
+        return bundle, log_file
+    return None
+
+def shard_path(process_automation_logs, log_file):
+    # Path a new log is written to, in the shard of its number, or in logs if the name is not a number
+    number = re.match('[0-9]+', log_file)
+    if not number:
+        return os.path.join(process_automation_logs, log_file)
+    return os.path.join(process_automation_logs, str(int(number.group(0)) // SHARD_SIZE), log_file)
+
+def stored_paths(process_automation_logs, log_file):
+    # Every path a log named log_file can be stored at outside the archive, plain and compressed
+    paths = []
+    for path in dict.fromkeys([shard_path(process_automation_logs, log_file), os.path.join(process_automation_logs, log_file)]):
+        paths += [path] + [path + suffix for suffix in COMPRESSED_SUFFIXES.values()]
+    return paths
+
+def log_path(process_automation_logs, log_file):
+    # Path of the log file named log_file, see above for where it is looked for
+    for path in stored_paths(process_automation_logs, log_file):
+        if os.path.exists(path):
+            return path
+    bundle = archive_path(process_automation_logs, log_file)
+    if log_file in archive_members(bundle):
+        return os.path.join(bundle, log_file)
+    return shard_path(process_automation_logs, log_file)
+
+def log_exists(path):
+    # True if there is a log at path
+    archived = _archived(path)
+    if archived:
+        return archived[1] in archive_members(archived[0])
+    return os.path.exists(path)
+
+def log_size(path):
+    # Size of the log at path in bytes, uncompressed
+    archived = _archived(path)
+    if archived:
+        return archive_members(archived[0])[archived[1]]
+    if path.endswith(tuple(COMPRESSED_SUFFIXES.values())):
+        return _frame_table(path)[-1][2]
+    return os.path.getsize(path)
+
+def _open(path):
+    # Binary file object of the log at path, decompressing archived and compressed logs as they are read
+    archived = _archived(path)
+    if archived:
+        with zipfile.ZipFile(archived[0]) as archive:
+            return archive.open(archived[1])
+    if path.endswith(tuple(COMPRESSED_SUFFIXES.values())):
+        return CompressedLog(path)
+    return open(path, 'rb')
+
+def _gzip_frame(data, level):
+    # One gzip member holding data, with its own size and the size of data in a TS extra field
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' + struct.pack('<H2sHII', 12, GZIP_FRAME_ID, 8, 32 + len(body), len(data))
+    return header + body + struct.pack('<II', zlib.crc32(data), len(data))
+
+def compress_log(path, method='gzip', level=6):
+    ''' Replaces the plain log at path by a compressed copy (path + .gz or .zst) made of frames
+        The copy is written next to the log and renamed when complete. If the log cannot be removed
+        (e.g. it is open on Windows), the copy is removed instead and the log stays plain.
+        returns the path of the compressed log, or path if it stayed plain
+    '''
+    if method == 'zstd':
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=level)
+        compress = compressor.compress
+    else:
+        compress = lambda data: _gzip_frame(data, level)
+    target = path + COMPRESSED_SUFFIXES[method]
+    frames = []
+    with open(path, 'rb') as source, open(target + '.tmp', 'wb') as f:
+        while True:
+            data = source.read(FRAME_SIZE)
+            if not data and frames:
+                break
+            frame = compress(data)
+            f.write(frame)
+            frames.append((len(frame), len(data)))
+            if not data:
+                break
+        if method == 'zstd':
+            entries = b''.join(struct.pack('<II', size, data_size) for size, data_size in frames)
+            f.write(struct.pack('<II', ZSTD_SKIPPABLE_MAGIC, len(entries) + 9) + entries
+                    + struct.pack('<IBI', len(frames), 0, ZSTD_SEEKABLE_MAGIC))
+    os.replace(target + '.tmp', target)
+    try:
+        os.remove(path)
+    except OSError:
+        os.remove(target)
+        return path
+    return target
+
+@functools.lru_cache(maxsize=256)
+def _frames(path, mtime_ns, size):
+    # [(offset, compressed size, uncompressed end)] of the frames of a compressed log
+    frames = []
+    end = 0
+    with open(path, 'rb') as f:
+        if path.endswith(COMPRESSED_SUFFIXES['zstd']):
+            f.seek(size - 9)
+            count, descriptor, magic = struct.unpack('<IBI', f.read(9))
+            entry_size = 12 if descriptor & 0x80 else 8
+            if magic != ZSTD_SEEKABLE_MAGIC:
+                raise ValueError('%s is not a seekable zstd file' % path)
+            f.seek(size - 9 - count * entry_size)
+            table = f.read(count * entry_size)
+            offset = 0
+            for i in range(count):
+                frame_size, data_size = struct.unpack_from('<II', table, i * entry_size)
+                end += data_size
+                frames.append((offset, frame_size, end))
+                offset += frame_size
+        else:
+            offset = 0
+            while offset < size:
+                f.seek(offset)
+                header = f.read(24)
+                if header[:4] != b'\x1f\x8b\x08\x04' or header[12:14] != GZIP_FRAME_ID:
+                    raise ValueError('%s is not a framed gzip log' % path)
+                frame_size, data_size = struct.unpack_from('<II', header, 16)
+                end += data_size
+                frames.append((offset, frame_size, end))
+                offset += frame_size
+    return frames
+
+def _frame_table(path):
+    # Frames of the compressed log at path, read once per version of the file
+    stat = os.stat(path)
+    return _frames(path, stat.st_mtime_ns, stat.st_size)
+
+class CompressedLog:
+    ''' Read only binary file object over a compressed log
+        read() decompresses the frames it overlaps, keeping the last one for the next read.
+    '''
+    def __init__(self, path):
+        self.frames = _frame_table(path)
+        self.ends = [end for _, _, end in self.frames]
+        self.size = self.ends[-1]
+        if path.endswith(COMPRESSED_SUFFIXES['zstd']):
+            import zstandard
+            self.decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self.decompress = lambda frame: zlib.decompress(frame, 16 + zlib.MAX_WBITS)
+        self._file = open(path, 'rb')
+        self._position = 0
+        self._cached = (None, b'')
+
+    def _frame(self, index):
+        # Uncompressed data of a frame
+        if self._cached[0] != index:
+            offset, frame_size, _ = self.frames[index]
+            self._file.seek(offset)
+            self._cached = (index, self.decompress(self._file.read(frame_size)))
+        return self._cached[1]
+
+    def seek(self, offset, whence=0):
+        self._position = max(0, offset + [0, self._position, self.size][whence])
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self._position + size)
+        parts = []
+        while self._position < end:
+            index = bisect.bisect_right(self.ends, self._position)
+            start = self.ends[index - 1] if index else 0
+            part = self._frame(index)[self._position - start:end - start]
+            parts.append(part)
+            self._position += len(part)
+        return b''.join(parts)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_range(path, start, end):
+    ''' Reads the bytes between offsets start and end of the log at path, trimmed to whole lines
+        A partial first line is dropped unless start is 0, and a partial last line is dropped
+        unless end is the end of the file.
+        returns (text, start, end) with the offsets actually read
+    '''
+    size = log_size(path)
+    start = max(0, min(start, size))
+    end = max(start, min(end, size))
+    with _open(path) as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if start > 0:
+        cut = data.find(b'\n')
+        if cut >= 0 and cut < len(data) - 1:
+            start += cut + 1
+            data = data[cut + 1:]
+    if end < size:
+        cut = data.rfind(b'\n')
+        if cut >= 0:
+            end -= len(data) - cut - 1
+            data = data[:cut + 1]
+    return _decode(data), start, end
+
+def read_lines(path, offset, limit=4 * 1024 * 1024):
+    ''' Reads up to limit bytes of complete lines of the log at path, starting at offset
+        A partial line at the end of the file is left for the next read.
+        returns (lines, offset after the last complete line)
+    '''
+    with _open(path) as f:
+        f.seek(offset)
+        data = f.read(limit)
+    cut = data.rfind(b'\n')
+    if cut < 0:
+        if len(data) < limit:
+            return [], offset
+        # A single line longer than limit
+        cut = len(data) - 1
+    return _decode(data[:cut + 1]).splitlines(), offset + cut + 1
+
+def read_header(path):
+    # Script name and start date from the first lines of the log at path
+    text, _, _ = read_range(path, 0, HEADER_SIZE)
+    script_name = re.search('starting execution for .+', text)
+    script_name = script_name.group(0).replace('starting execution for ', '') if script_name else ''
+    if re.search(r'[0-9]{4}-[0-9]{2}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', text):
+        date = re.search(r'[0-9]{4}-[0-9]{2}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', text).group(0)
+    elif re.search(r'[0-9]{2}-\w{3}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', text):
+        date = re.search(r'[0-9]{2}-\w{3}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', text).group(0)
+    else:
+        date = ''
+    return script_name, date
+
+def read_progress(path):
+    # Current progress of a running script, kept next to its log by ProcessLogger.progress
+    try:
+        with open(path + '.progress', encoding='UTF-8') as f:
+            return f.read()
+    except OSError:
+        return ''
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import shutil
+import zipfile
+import functools
+import warnings
+import importlib.util
+from task_scheduler_dashboard_shauncampbell20.core import get_config
+from task_scheduler_dashboard_shauncampbell20.db import connection, transaction
+from task_scheduler_dashboard_shauncampbell20.rollups import ROLLUP_BATCH_SIZE, rollup_runs
+from task_scheduler_dashboard_shauncampbell20.logfiles import COMPRESSED_SUFFIXES, archive_members, archive_path, compress_log, stored_paths
+
+## Retention of Runs and of the logs directory
+# maintain() deletes the runs outside the RETENTION policies, after adding them to the rollups,
+# compresses finished logs if LOG_COMPRESSION is "gzip" or "zstd", moves the plain logs older than
+# LOG_ARCHIVE_DAYS, if set, into zip bundles in logs/archive (see logfiles.py) and gives the space freed in
+# the database back with an incremental VACUUM. SyncService runs it once every
+# MAINTENANCE_INTERVAL seconds, and config.py --maintain runs it on demand.
+#
+# RETENTION is {script_id or "*": {"days": n, "runs": n}}. A completed run is kept while it started
+# less than days ago or is one of the last runs runs of its task; without a policy runs are kept.
+
+LOG_ARCHIVE_DAYS = None
+COMPRESS_AFTER = 3600
+MAINTENANCE_INTERVAL = 86400
+DELETE_BATCH_SIZE = 5000
+
+def retention_policies():
+    # RETENTION config, {} if not set
+    try:
+        return get_config('RETENTION')
+    except KeyError:
+        return {}
+
+def log_archive_days():
+    # Days after which finished logs are archived, from the LOG_ARCHIVE_DAYS config, None to never archive
+    try:
+        days = get_config('LOG_ARCHIVE_DAYS')
+    except KeyError:
+        return LOG_ARCHIVE_DAYS
+    return None if days is None else float(days)
+
+def log_compression():
+    # "gzip" or "zstd" from the LOG_COMPRESSION config, None to keep logs plain
+    try:
+        return get_config('LOG_COMPRESSION')
+    except KeyError:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def compression_method(method):
+    # method if it is known and its compressor can be imported, else None, warning once per method
+    if method not in COMPRESSED_SUFFIXES:
+        warnings.warn('Unknown LOG_COMPRESSION %r, logs are not compressed' % (method,))
+        return None
+    if method == 'zstd' and importlib.util.find_spec('zstandard') is None:
+        warnings.warn('zstandard is not installed (pip install zstandard), logs are not compressed')
+        return None
+    return method
+
+def _expired_sql(policy, now, script_ids, default):
+    # SELECT of (run_id, log_file) of the rolled up runs outside policy, for script_ids or, if default, all other tasks
+    keep = []
+    params = []
+    if policy.get('days') is not None:
+        keep.append('''start_time >= ?''')
+        params.append(now - policy['days'] * 86400)
+    if policy.get('runs') is not None:
+        keep.append('''n <= ?''')
+        params.append(policy['runs'])
+    if not keep:
+        return None, []
+    marks = ', '.join('?' * len(script_ids))
+    where = ('''script_id NOT IN (%s)''' if default else '''script_id IN (%s)''') % marks
+    sql = '''
+        SELECT run_id, log_file FROM (
+            SELECT run_id, log_file, start_time, rolled_up,
+            ROW_NUMBER() OVER (PARTITION BY script_id ORDER BY start_time DESC, run_id DESC) AS n
+            FROM Runs WHERE end_time IS NOT NULL AND %s)
+        WHERE rolled_up = 1 AND NOT (%s)
+        LIMIT ?''' % (where, ' OR '.join(keep))
+    return sql, list(script_ids) + params
+
+def expire_runs(db_path, logs, policies=None, now=None):
+    ''' Deletes the completed runs outside the retention policies with their logs and search index
+        Runs are added to the rollups first, so the statistics page keeps counting them.
+        returns the number of runs deleted
+    '''
+    policies = retention_policies() if policies is None else policies
+    now = int(time.time()) if now is None else now
+    script_ids = [script_id for script_id in policies if script_id != '*']
+    queries = [_expired_sql(policies[script_id], now, [script_id], False) for script_id in script_ids]
+    if '*' in policies:
+        queries.append(_expired_sql(policies['*'], now, script_ids, True))
+    queries = [(sql, params) for sql, params in queries if sql]
+    deleted = 0
+    for sql, params in queries:
+        while True:
+            with transaction(db_path) as cursor:
+                while rollup_runs(cursor) == ROLLUP_BATCH_SIZE:
+                    pass
+                runs = cursor.execute(sql, params + [DELETE_BATCH_SIZE]).fetchall()
+                run_ids = json.dumps([run_id for run_id, _ in runs])
+                cursor.executemany('''DELETE FROM LogLines WHERE rowid BETWEEN ? AND ?''', cursor.execute(
+                    '''SELECT first_rowid, last_rowid FROM LogLineRanges WHERE run_id IN (SELECT value FROM json_each(?))''',
+                    (run_ids,)).fetchall())
+                cursor.execute('''DELETE FROM LogLineRanges WHERE run_id IN (SELECT value FROM json_each(?))''', (run_ids,))
+                cursor.execute('''DELETE FROM LogIngest WHERE run_id IN (SELECT value FROM json_each(?))''', (run_ids,))
+                cursor.execute('''DELETE FROM Runs WHERE run_id IN (SELECT value FROM json_each(?))''', (run_ids,))
+            remove_logs(logs, [log_file for _, log_file in runs if log_file])
+            deleted += len(runs)
+            if len(runs) < DELETE_BATCH_SIZE:
+                break
+    return deleted
+
+def remove_logs(logs, log_files):
+    # Deletes log files, plain, compressed or archived, with their progress files
+    bundles = {}
+    for log_file in log_files:
+        paths = stored_paths(logs, log_file)
+        for name in paths + [path + '.progress' for path in paths]:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+        bundles.setdefault(archive_path(logs, log_file), set()).add(log_file)
+    for bundle, drop in bundles.items():
+        if drop & set(archive_members(bundle)):
+            rewrite_bundle(bundle, drop=drop)
+
+def rewrite_bundle(bundle, add=(), drop=()):
+    ''' Replaces bundle by a copy with the files in add (paths) and without the logs in drop (names)
+        Files already in the bundle are not added again. The bundle is replaced only once the copy
+        is complete, and deleted if it ends up empty.
+        returns the names of the files added
+    '''
+    members = archive_members(bundle)
+    add = [path for path in add if os.path.basename(path) not in members]
+    drop = set(drop) & set(members)
+    if not add and not drop:
+        return []
+    os.makedirs(os.path.dirname(bundle), exist_ok=True)
+    partial = bundle + '.tmp'
+    if drop:
+        with zipfile.ZipFile(bundle) as old, zipfile.ZipFile(partial, 'w') as new:
+            for info in old.infolist():
+                if info.filename not in drop:
+                    with old.open(info) as source, new.open(info, 'w') as target:
+                        shutil.copyfileobj(source, target)
+    elif members:
+        shutil.copyfile(bundle, partial)
+    with zipfile.ZipFile(partial, 'a', zipfile.ZIP_DEFLATED) as new:
+        for path in add:
+            new.write(path, os.path.basename(path))
+        empty = not new.namelist()
+    if empty:
+        os.remove(partial)
+        if os.path.exists(bundle):
+            os.remove(bundle)
+    else:
+        os.replace(partial, bundle)
+    return [os.path.basename(path) for path in add]
+
+def plain_logs(db_path, logs, cutoff):
+    ''' Uncompressed log files in logs and its shards last written before cutoff (epoch seconds)
+        Logs of runs that are still running are left out.
+        yields os.DirEntry
+    '''
+    with connection(db_path) as local:
+        running = {log_file for log_file, in local.execute('''
+            SELECT log_file FROM Runs WHERE end_time IS NULL AND log_file IS NOT NULL''')}
+    skipped = ('.progress', '.tmp') + tuple(COMPRESSED_SUFFIXES.values())
+    directories = [logs]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Shards are named by number, the archive is not
+                    if entry.name.isdigit():
+                        directories.append(entry.path)
+                elif (entry.name not in running and not entry.name.endswith(skipped)
+                        and entry.stat().st_mtime < cutoff):
+                    yield entry
+
+def compress_logs(db_path, logs, method=None, now=None):
+    # Compresses the logs of finished runs not written to for COMPRESS_AFTER seconds, returns the number compressed
+    method = log_compression() if method is None else method
+    if not method or not compression_method(method):
+        return 0
+    compressed = 0
+    for entry in list(plain_logs(db_path, logs, (int(time.time()) if now is None else now) - COMPRESS_AFTER)):
+        if compress_log(entry.path, method) != entry.path:
+            compressed += 1
+    return compressed
+
+def archive_logs(db_path, logs, days=None, now=None):
+    ''' Moves the plain log files not written to for days into their archive bundles
+        Compressed logs stay in their shard.
+        returns the number of log files archived
+    '''
+    days = log_archive_days() if days is None else days
+    if days is None:
+        return 0
+    bundles = {}
+    for entry in plain_logs(db_path, logs, (int(time.time()) if now is None else now) - days * 86400):
+        bundles.setdefault(archive_path(logs, entry.name), []).append(entry.path)
+    archived = 0
+    for bundle, paths in sorted(bundles.items()):
+        rewrite_bundle(bundle, add=paths)
+        # Every path is in the bundle now, whether added by this call or an earlier interrupted one
+        for path in paths:
+            for name in [path, path + '.progress']:
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+        archived += len(paths)
+    return archived
+
+def vacuum(db_path):
+    ''' Returns the free pages of the database to the file system
+        The first call switches the database to incremental auto_vacuum, which takes a full VACUUM;
+        later calls only release the free pages.
+        returns the number of pages released
+    '''
+    with connection(db_path) as local:
+        if local.execute('''PRAGMA auto_vacuum''').fetchone()[0] != 2:
+            local.execute('''PRAGMA auto_vacuum = INCREMENTAL''')
+            pages = local.execute('''PRAGMA freelist_count''').fetchone()[0]
+            local.execute('''VACUUM''')
+        else:
+            pages = local.execute('''PRAGMA freelist_count''').fetchone()[0]
+            local.execute('''PRAGMA incremental_vacuum''').fetchall()
+        local.execute('''PRAGMA optimize''')
+        local.execute('''PRAGMA wal_checkpoint(TRUNCATE)''').fetchall()
+    return pages
+
+def maintain(db_path, logs, policies=None, days=None):
+    ''' Expires runs, compresses and archives logs and vacuums the database, and records the run in Maintenance
+        returns a dict with the runs deleted, logs compressed, logs archived and pages released
+    '''
+    run_time = int(time.time())
+    started = time.monotonic()
+    report = {'runs_deleted': expire_runs(db_path, logs, policies, run_time)}
+    report['logs_compressed'] = compress_logs(db_path, logs, now=run_time)
+    report['logs_archived'] = archive_logs(db_path, logs, days, run_time)
+    report['pages_released'] = vacuum(db_path)
+    with connection(db_path) as local:
+        local.execute('''INSERT OR REPLACE INTO Maintenance (step, run_time, duration_ms, report) VALUES (?, ?, ?, ?)''',
+                      ('maintain', run_time, int((time.monotonic() - started) * 1000), json.dumps(report)))
+    return report
+
+def maintain_if_due(db_path, logs, interval=MAINTENANCE_INTERVAL):
+    # Runs maintain() if it has not run in the last interval seconds, returns its report or None
+    with connection(db_path) as local:
+        last = local.execute('''SELECT run_time FROM Maintenance WHERE step = 'maintain' ''').fetchone()
+    if last and last[0] > time.time() - interval:
+        return None
+    return maintain(db_path, logs)
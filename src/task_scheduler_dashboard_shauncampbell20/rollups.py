@@ -0,0 +1,123 @@
+## Hourly and daily statistics of completed runs per script_id
+# RunRollups holds the number of runs, failures, records and total duration of each script in each
+# hour and day (by start time, UTC). RollupDurations counts the runs of each bucket by duration, in
+# bins a quarter of a power of two wide, from which percentiles are estimated within about 12%.
+# Completed runs are added once, Runs.rolled_up marks the runs already counted.
+
+HOUR = 3600
+DAY = 86400
+PERIODS = [HOUR, DAY]
+FAILED_RESULTS = ('error', 'critical', 'abandoned')
+ROLLUP_BATCH_SIZE = 5000
+SUB_BINS = 4
+
+def duration_bin(duration_ms):
+    # Histogram bin of a duration: 0 for 0 ms, else each power of two is split into SUB_BINS bins
+    duration_ms = int(max(duration_ms or 0, 0))
+    if duration_ms == 0:
+        return 0
+    exponent = duration_ms.bit_length() - 1
+    sub = ((duration_ms * SUB_BINS) >> exponent) - SUB_BINS
+    return 1 + exponent * SUB_BINS + sub
+
+def bin_value(duration_bin):
+    # Duration in ms representing a histogram bin, the middle of its range
+    if duration_bin == 0:
+        return 0
+    exponent, sub = divmod(duration_bin - 1, SUB_BINS)
+    return 2 ** exponent * (1 + (sub + 0.5) / SUB_BINS)
+
+def percentile(histogram, q):
+    # Estimated q-th quantile (0 to 1) in ms of a histogram {bin: runs}, None if it is empty
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for duration_bin in sorted(histogram):
+        seen += histogram[duration_bin]
+        if seen >= q * total:
+            return bin_value(duration_bin)
+
+def rollup_runs(cursor, run_id=None, limit=ROLLUP_BATCH_SIZE):
+    ''' Adds completed runs that are not rolled up yet to RunRollups and RollupDurations
+        Call inside a write transaction, so concurrent callers never count a run twice.
+        run_id: only this run
+        returns the number of runs added
+    '''
+    sql = '''SELECT run_id, script_id, start_time, duration_ms, records, result FROM Runs
+        WHERE rolled_up = 0 AND end_time IS NOT NULL'''
+    params = []
+    if run_id is not None:
+        sql += ''' AND run_id = ?'''
+        params.append(run_id)
+    sql += ''' ORDER BY run_id LIMIT ?'''
+    runs = cursor.execute(sql, params + [limit]).fetchall()
+    if not runs:
+        return 0
+    totals = {}
+    durations = {}
+    for _, script_id, start_time, duration_ms, records, result in runs:
+        if start_time is None:
+            continue
+        for period in PERIODS:
+            bucket = (script_id, period, start_time - start_time % period)
+            total = totals.setdefault(bucket, [0, 0, 0, 0])
+            total[0] += 1
+            total[1] += result in FAILED_RESULTS
+            total[2] += records or 0
+            total[3] += duration_ms or 0
+            key = bucket + (duration_bin(duration_ms),)
+            durations[key] = durations.get(key, 0) + 1
+    cursor.executemany('''
+        INSERT INTO RunRollups (script_id, period, bucket, runs, failures, records, duration_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (script_id, period, bucket) DO UPDATE SET
+        runs = runs + excluded.runs,
+        failures = failures + excluded.failures,
+        records = records + excluded.records,
+        duration_ms = duration_ms + excluded.duration_ms''',
+        [key + tuple(total) for key, total in totals.items()])
+    cursor.executemany('''
+        INSERT INTO RollupDurations (script_id, period, bucket, bin, runs) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (script_id, period, bucket, bin) DO UPDATE SET runs = runs + excluded.runs''',
+        [key + (count,) for key, count in durations.items()])
+    cursor.executemany('''UPDATE Runs SET rolled_up = 1 WHERE run_id = ?''', [(run[0],) for run in runs])
+    return len(runs)
+
+def rollup_series(cursor, script_id, period, since):
+    ''' Statistics of each bucket of script_id from since (epoch seconds) on
+        returns a list of dicts with bucket, runs, failure_rate, records_per_run, p50_ms and p95_ms
+    '''
+    histograms = {}
+    for bucket, duration_bin, runs in cursor.execute('''
+            SELECT bucket, bin, runs FROM RollupDurations
+            WHERE script_id = ? AND period = ? AND bucket >= ?''', (script_id, period, since)):
+        histograms.setdefault(bucket, {})[duration_bin] = runs
+    series = []
+    for bucket, runs, failures, records in cursor.execute('''
+            SELECT bucket, runs, failures, records FROM RunRollups
+            WHERE script_id = ? AND period = ? AND bucket >= ? ORDER BY bucket''', (script_id, period, since)):
+        histogram = histograms.get(bucket, {})
+        series.append({'bucket': bucket, 'runs': runs, 'failure_rate': failures / runs,
+                       'records_per_run': records / runs,
+                       'p50_ms': percentile(histogram, 0.5), 'p95_ms': percentile(histogram, 0.95)})
+    return series
+
+def rollup_summary(cursor, since):
+    ''' Statistics of every script over the daily buckets from since (epoch seconds) on
+        returns a list of dicts with script_id, runs, failure_rate, records_per_run, avg_ms, p50_ms and p95_ms
+    '''
+    histograms = {}
+    for script_id, duration_bin, runs in cursor.execute('''
+            SELECT script_id, bin, SUM(runs) FROM RollupDurations
+            WHERE period = ? AND bucket >= ? GROUP BY script_id, bin''', (DAY, since)):
+        histograms.setdefault(script_id, {})[duration_bin] = runs
+    summary = []
+    for script_id, runs, failures, records, duration_ms in cursor.execute('''
+            SELECT script_id, SUM(runs), SUM(failures), SUM(records), SUM(duration_ms) FROM RunRollups
+            WHERE period = ? AND bucket >= ? GROUP BY script_id ORDER BY script_id''', (DAY, since)):
+        histogram = histograms.get(script_id, {})
+        summary.append({'script_id': script_id, 'runs': runs, 'failure_rate': failures / runs,
+                        'records_per_run': records / runs, 'avg_ms': duration_ms / runs,
+                        'p50_ms': percentile(histogram, 0.5), 'p95_ms': percentile(histogram, 0.95)})
+    return summary
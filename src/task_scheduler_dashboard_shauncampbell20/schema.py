@@ -0,0 +1,588 @@
+import sqlite3
+import datetime
+
+## Versioned schema for the process automation database
+# The schema version is stored in PRAGMA user_version. Each function in MIGRATIONS upgrades
+# the database by one version and is applied in its own transaction by migrate().
+
+LATEST_RUN_COLUMNS = '''run_id, script_id, log_file, start_time, end_time, duration_ms, records, result, errors, warnings, user, machine, heartbeat_time'''
+LATEST_RUN_KEY = '''machine, script_id'''
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def connect(db_path, timeout=30):
+    # Opens a connection to the database with the settings shared by readers and writers
+    local = sqlite3.connect(db_path, timeout=timeout)
+    local.execute('''PRAGMA busy_timeout = %d''' % (timeout * 1000))
+    local.execute('''PRAGMA synchronous = NORMAL''')
+    return local
+
+def to_epoch(value):
+    ''' Converts a datetime, or a date string in one of the formats stored by earlier versions,
+        to UTC epoch seconds. Naive values are taken as UTC. Returns None for empty or unparseable values.
+    '''
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        dt = value
+    else:
+        text = str(value).strip()
+        if text.lstrip('-').isdigit():
+            return int(text)
+        try:
+            dt = datetime.datetime.fromisoformat(text)
+        except ValueError:
+            for fmt in ('%m/%d/%y %H:%M:%S', '%m/%d/%Y %H:%M:%S', '%d-%b-%y %H:%M:%S'):
+                try:
+                    dt = datetime.datetime.strptime(text, fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int((dt - EPOCH).total_seconds())
+
+def create_base_tables(cursor):
+    # Creates Runs, Executors and Tasks tables
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Runs (
+    run_id INTEGER PRIMARY KEY,
+    script_id VARCHAR,
+    log_file VARCHAR,
+    start_time VARCHAR,
+    end_time VARCHAR,
+    records INT,
+    result VARCHAR,
+    errors INT,
+    warnings INT,
+    user VARCHAR,
+    machine VARCHAR
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Executors (
+    name VARCHAR,
+    state VARCHAR,
+    next_run_time VARCHAR,
+    last_run_time VARCHAR,
+    last_run_result VARCHAR,
+    hidden VARCHAR,
+    command VARCHAR,
+    folder VARCHAR,
+    machine VARCHAR
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Tasks (
+    script_id VARCHAR,
+    command VARCHAR,
+    script VARCHAR,
+    run_dir VARCHAR,
+    execution_command VARCHAR,
+    machine VARCHAR
+    )''')
+
+def create_latest_runs_table(cursor):
+    # Creates LatestRuns table holding the last run of each script_id, and the triggers keeping it current
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS LatestRuns (
+    run_id INTEGER,
+    script_id VARCHAR PRIMARY KEY,
+    log_file VARCHAR,
+    start_time VARCHAR,
+    end_time VARCHAR,
+    records INT,
+    result VARCHAR,
+    errors INT,
+    warnings INT,
+    user VARCHAR,
+    machine VARCHAR
+    )''')
+    columns = '''run_id, script_id, log_file, start_time, end_time, records, result, errors, warnings, user, machine'''
+    create_latest_runs_triggers(cursor, columns, 'script_id')
+    rebuild_latest_runs(cursor, columns, 'script_id')
+
+def latest_run_values(row, columns, key):
+    # Values of a Runs row for the LatestRuns columns, a missing machine is stored as '' where it is part of the key
+    return ["COALESCE(%s.machine, '')" % row if c == 'machine' and 'machine' in key else '%s.%s' % (row, c) for c in columns]
+
+def create_latest_runs_triggers(cursor, latest_run_columns=LATEST_RUN_COLUMNS, key_columns=LATEST_RUN_KEY):
+    # Triggers on Runs that keep LatestRuns current, LatestRuns has a row per key_columns
+    # The latest run is the one started last, runs merged from other machines can arrive out of order
+    # Updates of other Runs columns, e.g. rolled_up, or not changing any value leave LatestRuns alone
+    columns = [c.strip() for c in latest_run_columns.split(',')]
+    key = [c.strip() for c in key_columns.split(',')]
+    new_values = ', '.join(latest_run_values('NEW', columns, key))
+    runs_values = ', '.join(latest_run_values('Runs', columns, key))
+    new_assignments = ', '.join('%s = %s' % pair for pair in zip(columns, latest_run_values('NEW', columns, key)))
+    excluded_assignments = ', '.join('%s = excluded.%s' % (c, c) for c in columns)
+    changed = ' OR '.join('OLD.%s IS NOT NEW.%s' % (c, c) for c in columns)
+    new_key = ' AND '.join('%s = %s' % pair for pair in zip(key, latest_run_values('NEW', key, key)))
+    old_key = ' AND '.join('%s = %s' % pair for pair in zip(key, latest_run_values('OLD', key, key)))
+    old_runs_key = ' AND '.join('%s = %s' % pair for pair in zip(latest_run_values('Runs', key, key), latest_run_values('OLD', key, key)))
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_insert AFTER INSERT ON Runs
+    BEGIN
+        INSERT INTO LatestRuns ({latest_run_columns}) VALUES ({new_values})
+        ON CONFLICT({key_columns}) DO UPDATE SET {excluded_assignments}
+        WHERE (COALESCE(excluded.start_time, 0), excluded.run_id) >= (COALESCE(LatestRuns.start_time, 0), LatestRuns.run_id);
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_update AFTER UPDATE OF {latest_run_columns} ON Runs
+    WHEN {changed}
+    BEGIN
+        UPDATE LatestRuns SET {new_assignments}
+        WHERE {new_key} AND run_id = NEW.run_id;
+    END''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_delete AFTER DELETE ON Runs
+    WHEN OLD.run_id = (SELECT run_id FROM LatestRuns WHERE {old_key})
+    BEGIN
+        DELETE FROM LatestRuns WHERE {old_key};
+        INSERT INTO LatestRuns ({latest_run_columns})
+        SELECT {runs_values} FROM Runs WHERE {old_runs_key} ORDER BY start_time DESC, run_id DESC LIMIT 1;
+    END''')
+    if key != ['script_id']:
+        # A run whose machine changes, e.g. one started before runs were inserted with their machine, moves to its new key
+        key_changed = ' OR '.join('OLD.%s IS NOT NEW.%s' % (c, c) for c in key)
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS latest_runs_move AFTER UPDATE OF {key_columns} ON Runs
+        WHEN {key_changed}
+        BEGIN
+            DELETE FROM LatestRuns WHERE {old_key} AND run_id = OLD.run_id;
+            INSERT INTO LatestRuns ({latest_run_columns})
+            SELECT {runs_values} FROM Runs WHERE {old_runs_key} ORDER BY start_time DESC, run_id DESC LIMIT 1
+            ON CONFLICT({key_columns}) DO NOTHING;
+            INSERT INTO LatestRuns ({latest_run_columns}) VALUES ({new_values})
+            ON CONFLICT({key_columns}) DO UPDATE SET {excluded_assignments}
+            WHERE (COALESCE(excluded.start_time, 0), excluded.run_id) >= (COALESCE(LatestRuns.start_time, 0), LatestRuns.run_id);
+        END''')
+
+def rebuild_latest_runs(cursor, latest_run_columns=LATEST_RUN_COLUMNS, key_columns=LATEST_RUN_KEY):
+    # Recomputes LatestRuns from the full Runs table, fixes any drift from the triggers
+    columns = [c.strip() for c in latest_run_columns.split(',')]
+    key = [c.strip() for c in key_columns.split(',')]
+    same_key = ' AND '.join('%s IS R.%s' % (c, c) for c in key)
+    values = ', '.join(latest_run_values('R', columns, key))
+    cursor.execute('''DELETE FROM LatestRuns''')
+    cursor.execute(f'''
+    INSERT INTO LatestRuns ({latest_run_columns})
+    SELECT {values} FROM Runs AS R WHERE run_id = (
+    SELECT run_id FROM Runs WHERE {same_key} ORDER BY start_time DESC, run_id DESC LIMIT 1)
+    ''')
+
+def add_keys_and_indexes(cursor):
+    # Adds primary keys to Executors and Tasks, and indexes for the lookups by script_id and command
+    cursor.execute('''
+    CREATE TABLE Executors_new (
+    name VARCHAR,
+    state VARCHAR,
+    next_run_time VARCHAR,
+    last_run_time VARCHAR,
+    last_run_result VARCHAR,
+    hidden VARCHAR,
+    command VARCHAR,
+    folder VARCHAR,
+    machine VARCHAR,
+    PRIMARY KEY (machine, name)
+    )''')
+    cursor.execute('''INSERT OR IGNORE INTO Executors_new
+    SELECT name, state, next_run_time, last_run_time, last_run_result, hidden, command, folder, machine FROM Executors''')
+    cursor.execute('''DROP TABLE Executors''')
+    cursor.execute('''ALTER TABLE Executors_new RENAME TO Executors''')
+    cursor.execute('''
+    CREATE TABLE Tasks_new (
+    script_id VARCHAR,
+    command VARCHAR,
+    script VARCHAR,
+    run_dir VARCHAR,
+    execution_command VARCHAR,
+    machine VARCHAR,
+    PRIMARY KEY (machine, command, script)
+    )''')
+    cursor.execute('''INSERT OR IGNORE INTO Tasks_new
+    SELECT script_id, command, script, run_dir, execution_command, machine FROM Tasks''')
+    cursor.execute('''DROP TABLE Tasks''')
+    cursor.execute('''ALTER TABLE Tasks_new RENAME TO Tasks''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_runs_script_start ON Runs (script_id, start_time)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_tasks_script ON Tasks (script_id)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_executors_command ON Executors (command, machine)''')
+
+def use_epoch_timestamps(cursor):
+    # Stores Runs and Executors times as UTC epoch seconds and adds Runs.duration_ms
+    cursor.connection.create_function('to_epoch', 1, to_epoch)
+    for trigger in ['latest_runs_insert', 'latest_runs_update', 'latest_runs_delete']:
+        cursor.execute('''DROP TRIGGER IF EXISTS %s''' % trigger)
+    cursor.execute('''
+    CREATE TABLE Runs_new (
+    run_id INTEGER PRIMARY KEY,
+    script_id VARCHAR,
+    log_file VARCHAR,
+    start_time INTEGER,
+    end_time INTEGER,
+    duration_ms INTEGER,
+    records INT,
+    result VARCHAR,
+    errors INT,
+    warnings INT,
+    user VARCHAR,
+    machine VARCHAR
+    )''')
+    cursor.execute('''INSERT INTO Runs_new
+    SELECT run_id, script_id, log_file, to_epoch(start_time), to_epoch(end_time),
+    (to_epoch(end_time) - to_epoch(start_time)) * 1000,
+    records, result, errors, warnings, user, machine FROM Runs''')
+    cursor.execute('''DROP TABLE Runs''')
+    cursor.execute('''ALTER TABLE Runs_new RENAME TO Runs''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_runs_script_start ON Runs (script_id, start_time)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_runs_start ON Runs (start_time)''')
+    cursor.execute('''DROP TABLE LatestRuns''')
+    cursor.execute('''
+    CREATE TABLE LatestRuns (
+    run_id INTEGER,
+    script_id VARCHAR PRIMARY KEY,
+    log_file VARCHAR,
+    start_time INTEGER,
+    end_time INTEGER,
+    duration_ms INTEGER,
+    records INT,
+    result VARCHAR,
+    errors INT,
+    warnings INT,
+    user VARCHAR,
+    machine VARCHAR
+    )''')
+    columns = '''run_id, script_id, log_file, start_time, end_time, duration_ms, records, result, errors, warnings, user, machine'''
+    create_latest_runs_triggers(cursor, columns, 'script_id')
+    rebuild_latest_runs(cursor, columns, 'script_id')
+    cursor.execute('''
+    CREATE TABLE Executors_new (
+    name VARCHAR,
+    state VARCHAR,
+    next_run_time INTEGER,
+    last_run_time INTEGER,
+    last_run_result VARCHAR,
+    hidden VARCHAR,
+    command VARCHAR,
+    folder VARCHAR,
+    machine VARCHAR,
+    PRIMARY KEY (machine, name)
+    )''')
+    cursor.execute('''INSERT INTO Executors_new
+    SELECT name, state, to_epoch(next_run_time), to_epoch(last_run_time), last_run_result, hidden, command, folder, machine
+    FROM Executors''')
+    cursor.execute('''DROP TABLE Executors''')
+    cursor.execute('''ALTER TABLE Executors_new RENAME TO Executors''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_executors_command ON Executors (command, machine)''')
+
+def create_log_search_tables(cursor):
+    # Full text index of log lines (LogLines) and the ingest position of each run's log file (LogIngest)
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS LogLines USING fts5 (
+    message,
+    run_id UNINDEXED,
+    level UNINDEXED,
+    logged_at UNINDEXED
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS LogIngest (
+    run_id INTEGER PRIMARY KEY,
+    log_file VARCHAR,
+    offset INTEGER,
+    done INTEGER
+    )''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_log_ingest_pending ON LogIngest (done) WHERE done = 0''')
+
+def create_batch_file_cache(cursor):
+    # Parsed batch files, keyed by machine and path, with the stat and hash used to detect changes
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS BatchFiles (
+    machine VARCHAR,
+    path VARCHAR,
+    mtime_ns INTEGER,
+    size INTEGER,
+    sha1 VARCHAR,
+    tasks TEXT,
+    PRIMARY KEY (machine, path)
+    )''')
+
+def create_sync_status_table(cursor):
+    # Outcome of the last sync of each machine's tasks, so the dashboard can show how fresh they are
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS SyncStatus (
+    machine VARCHAR PRIMARY KEY,
+    sync_time INTEGER,
+    duration_ms INTEGER,
+    changes INTEGER,
+    status VARCHAR,
+    error VARCHAR,
+    success_time INTEGER
+    )''')
+
+def add_run_origins(cursor):
+    ''' Adds origin_run_id to Runs for runs uploaded or merged from other machines, see aggregate.py
+        (machine, origin_run_id) is unique so repeated uploads update the same row. The LatestRuns
+        triggers are recreated to pick the latest run by start_time, and PushState records how far
+        this machine's runs have been uploaded to each aggregator.
+    '''
+    cursor.execute('''ALTER TABLE Runs ADD COLUMN origin_run_id INTEGER''')
+    cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_runs_origin ON Runs (machine, origin_run_id) WHERE origin_run_id IS NOT NULL''')
+    for trigger in ['latest_runs_insert', 'latest_runs_update', 'latest_runs_delete']:
+        cursor.execute('''DROP TRIGGER IF EXISTS %s''' % trigger)
+    columns = '''run_id, script_id, log_file, start_time, end_time, duration_ms, records, result, errors, warnings, user, machine'''
+    create_latest_runs_triggers(cursor, columns, 'script_id')
+    rebuild_latest_runs(cursor, columns, 'script_id')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS PushState (
+    url VARCHAR PRIMARY KEY,
+    run_id INTEGER,
+    push_time INTEGER
+    )''')
+
+def add_run_heartbeats(cursor):
+    # Adds heartbeat_time, the last time a running ProcessLogger reported its counters, to Runs and LatestRuns
+    cursor.execute('''ALTER TABLE Runs ADD COLUMN heartbeat_time INTEGER''')
+    cursor.execute('''ALTER TABLE LatestRuns ADD COLUMN heartbeat_time INTEGER''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_runs_running ON Runs (start_time) WHERE end_time IS NULL''')
+    for trigger in ['latest_runs_insert', 'latest_runs_update', 'latest_runs_delete']:
+        cursor.execute('''DROP TRIGGER IF EXISTS %s''' % trigger)
+    columns = '''run_id, script_id, log_file, start_time, end_time, duration_ms, records, result, errors, warnings, user, machine, heartbeat_time'''
+    create_latest_runs_triggers(cursor, columns, 'script_id')
+
+def create_rollup_tables(cursor):
+    # Hourly and daily statistics per script_id, see rollups.py
+    cursor.execute('''ALTER TABLE Runs ADD COLUMN rolled_up INTEGER NOT NULL DEFAULT 0''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_runs_rollup_pending ON Runs (run_id) WHERE rolled_up = 0 AND end_time IS NOT NULL''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS RunRollups (
+    script_id VARCHAR,
+    period INTEGER,
+    bucket INTEGER,
+    runs INTEGER,
+    failures INTEGER,
+    records INTEGER,
+    duration_ms INTEGER,
+    PRIMARY KEY (script_id, period, bucket)
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_run_rollups_period ON RunRollups (period, bucket)''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS RollupDurations (
+    script_id VARCHAR,
+    period INTEGER,
+    bucket INTEGER,
+    bin INTEGER,
+    runs INTEGER,
+    PRIMARY KEY (script_id, period, bucket, bin)
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_rollup_durations_period ON RollupDurations (period, bucket)''')
+
+def create_maintenance_table(cursor):
+    # Last run of each retention.maintain() step, so the scheduled job runs once per interval
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Maintenance (
+    step VARCHAR PRIMARY KEY,
+    run_time INTEGER,
+    duration_ms INTEGER,
+    report TEXT
+    )''')
+
+def create_task_graph_table(cursor):
+    # Dependency graph of executors, batch files and scripts, see graph.py, filled from Executors and Tasks
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS TaskGraph (
+    machine VARCHAR,
+    source_kind VARCHAR,
+    source VARCHAR,
+    target_kind VARCHAR,
+    target VARCHAR,
+    PRIMARY KEY (source_kind, source, target_kind, target, machine)
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_task_graph_target ON TaskGraph (target_kind, target)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_task_graph_machine ON TaskGraph (machine)''')
+    cursor.execute('''
+    INSERT OR IGNORE INTO TaskGraph (machine, source_kind, source, target_kind, target)
+    SELECT machine, 'executor', name, 'batch', command FROM Executors
+    UNION SELECT machine, 'batch', command, 'script', script_id FROM Tasks
+    UNION SELECT machine, 'script', command, 'batch', command FROM (
+        SELECT machine, command FROM Executors UNION SELECT machine, command FROM Tasks)
+    WHERE command IN (SELECT script_id FROM Tasks)''')
+
+def add_data_versions(cursor):
+    ''' Version counters the live home page polls, see webapp.refresh_home_table
+        DataVersions 'runs' is bumped by every change of LatestRuns, and the row changed takes the new
+        value in LatestRuns.version, so the rows changed since a version can be selected.
+        DataVersions 'tasks' is bumped by every change of Tasks and Executors and by rows leaving
+        LatestRuns, which the dashboard answers by reloading the whole table.
+    '''
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS DataVersions (
+    name VARCHAR PRIMARY KEY,
+    version INTEGER NOT NULL
+    )''')
+    cursor.execute('''INSERT OR IGNORE INTO DataVersions (name, version) VALUES ('runs', 0), ('tasks', 0)''')
+    cursor.execute('''ALTER TABLE LatestRuns ADD COLUMN version INTEGER NOT NULL DEFAULT 0''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_latest_runs_version ON LatestRuns (version)''')
+    bump_runs = '''
+        UPDATE DataVersions SET version = version + 1 WHERE name = 'runs';
+        UPDATE LatestRuns SET version = (SELECT version FROM DataVersions WHERE name = 'runs') WHERE script_id = NEW.script_id;'''
+    # Setting version is not one of the columns watched, so it does not fire the update trigger again
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS latest_runs_version_insert AFTER INSERT ON LatestRuns BEGIN %s END''' % bump_runs)
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_version_update AFTER UPDATE OF run_id, script_id, log_file, start_time, end_time,
+    duration_ms, records, result, errors, warnings, user, machine, heartbeat_time ON LatestRuns BEGIN %s END''' % bump_runs)
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_version_delete AFTER DELETE ON LatestRuns
+    BEGIN UPDATE DataVersions SET version = version + 1 WHERE name = 'tasks'; END''')
+    for table in ['Tasks', 'Executors']:
+        for event in ['INSERT', 'UPDATE', 'DELETE']:
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS %s_version_%s AFTER %s ON %s
+            BEGIN UPDATE DataVersions SET version = version + 1 WHERE name = 'tasks'; END''' % (table.lower(), event.lower(), event, table))
+
+def skip_unchanged_run_updates(cursor):
+    ''' Recreates the update triggers of Runs and LatestRuns to fire only when a shown value changes
+        Marking runs rolled up no longer rewrites LatestRuns, and a heartbeat only bumps the 'runs'
+        version when it changes what the home page shows, not for heartbeat_time alone.
+    '''
+    for trigger in ['latest_runs_update', 'latest_runs_version_update']:
+        cursor.execute('''DROP TRIGGER IF EXISTS %s''' % trigger)
+    columns = '''run_id, script_id, log_file, start_time, end_time, duration_ms, records, result, errors, warnings, user, machine, heartbeat_time'''
+    create_latest_runs_triggers(cursor, columns, 'script_id')
+    shown = ['run_id', 'script_id', 'log_file', 'start_time', 'end_time', 'duration_ms', 'records', 'result', 'errors',
+             'warnings', 'user', 'machine']
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_version_update AFTER UPDATE OF %s ON LatestRuns
+    WHEN %s
+    BEGIN
+        UPDATE DataVersions SET version = version + 1 WHERE name = 'runs';
+        UPDATE LatestRuns SET version = (SELECT version FROM DataVersions WHERE name = 'runs') WHERE script_id = NEW.script_id;
+    END''' % (', '.join(shown), ' OR '.join('OLD.%s IS NOT NEW.%s' % (c, c) for c in shown)))
+
+def key_latest_runs_by_machine(cursor):
+    ''' Keeps the latest run of each script_id on each machine in LatestRuns, instead of one per script_id
+        Machines running a script of the same name no longer take each other's row on an aggregating
+        dashboard. Runs without a machine are kept under machine ''. The 'tasks' version is bumped so
+        the dashboard reloads its table.
+    '''
+    for trigger in ['latest_runs_insert', 'latest_runs_update', 'latest_runs_delete']:
+        cursor.execute('''DROP TRIGGER IF EXISTS %s''' % trigger)
+    cursor.execute('''
+    CREATE TABLE LatestRuns_new (
+    run_id INTEGER,
+    script_id VARCHAR,
+    log_file VARCHAR,
+    start_time INTEGER,
+    end_time INTEGER,
+    duration_ms INTEGER,
+    records INT,
+    result VARCHAR,
+    errors INT,
+    warnings INT,
+    user VARCHAR,
+    machine VARCHAR NOT NULL DEFAULT '',
+    heartbeat_time INTEGER,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (machine, script_id)
+    )''')
+    cursor.execute('''DROP TABLE LatestRuns''')
+    cursor.execute('''ALTER TABLE LatestRuns_new RENAME TO LatestRuns''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_latest_runs_version ON LatestRuns (version)''')
+    columns = '''run_id, script_id, log_file, start_time, end_time, duration_ms, records, result, errors, warnings, user, machine, heartbeat_time'''
+    create_latest_runs_triggers(cursor, columns, 'machine, script_id')
+    rebuild_latest_runs(cursor, columns, 'machine, script_id')
+    # Dropping LatestRuns dropped its version triggers
+    shown = ['run_id', 'script_id', 'log_file', 'start_time', 'end_time', 'duration_ms', 'records', 'result', 'errors',
+             'warnings', 'user', 'machine']
+    bump_runs = '''
+        UPDATE DataVersions SET version = version + 1 WHERE name = 'runs';
+        UPDATE LatestRuns SET version = (SELECT version FROM DataVersions WHERE name = 'runs')
+        WHERE machine = NEW.machine AND script_id = NEW.script_id;'''
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS latest_runs_version_insert AFTER INSERT ON LatestRuns BEGIN %s END''' % bump_runs)
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_version_update AFTER UPDATE OF %s ON LatestRuns
+    WHEN %s
+    BEGIN %s END''' % (', '.join(shown), ' OR '.join('OLD.%s IS NOT NEW.%s' % (c, c) for c in shown), bump_runs))
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS latest_runs_version_delete AFTER DELETE ON LatestRuns
+    BEGIN UPDATE DataVersions SET version = version + 1 WHERE name = 'tasks'; END''')
+    cursor.execute('''UPDATE DataVersions SET version = version + 1 WHERE name = 'tasks' ''')
+
+def create_log_line_ranges(cursor):
+    ''' LogLineRanges holds the rowids of the lines of each run in LogLines, see search.ingest
+        LogLines.run_id is UNINDEXED, so deleting the lines of a run by run_id reads the whole index;
+        retention deletes them by rowid instead. The lines indexed before are grouped into runs of
+        consecutive rowids of the same run.
+    '''
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS LogLineRanges (
+    run_id INTEGER,
+    first_rowid INTEGER,
+    last_rowid INTEGER,
+    PRIMARY KEY (run_id, first_rowid)
+    ) WITHOUT ROWID''')
+    cursor.execute('''
+    INSERT INTO LogLineRanges (run_id, first_rowid, last_rowid)
+    SELECT run_id, MIN(rowid), MAX(rowid) FROM (
+        SELECT rowid, run_id,
+        ROW_NUMBER() OVER (ORDER BY rowid) - ROW_NUMBER() OVER (PARTITION BY run_id ORDER BY rowid) AS island
+        FROM LogLines)
+    GROUP BY run_id, island''')
+
+def add_heartbeat_intervals(cursor):
+    # Adds the heartbeat interval ProcessLogger was started with to Runs, the sweep of abandoned runs waits a multiple of it
+    cursor.execute('''ALTER TABLE Runs ADD COLUMN heartbeat_interval REAL''')
+
+MIGRATIONS = [
+    create_base_tables,
+    create_latest_runs_table,
+    add_keys_and_indexes,
+    use_epoch_timestamps,
+    create_log_search_tables,
+    create_batch_file_cache,
+    create_sync_status_table,
+    add_run_origins,
+    add_run_heartbeats,
+    create_rollup_tables,
+    create_maintenance_table,
+    create_task_graph_table,
+    add_data_versions,
+    skip_unchanged_run_updates,
+    key_latest_runs_by_machine,
+    create_log_line_ranges,
+    add_heartbeat_intervals,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(local):
+    # Returns the schema version of the database
+    return local.execute('''PRAGMA user_version''').fetchone()[0]
+
+def migrate(db_path):
+    ''' Brings the database at db_path up to SCHEMA_VERSION
+        Switches the database to WAL so the dashboard can read while ProcessLogger writes.
+        Each migration and its version bump are committed together; the version is re-read
+        after taking the write lock so concurrent callers apply each migration once.
+        returns the list of versions applied
+    '''
+    local = connect(db_path)
+    local.isolation_level = None
+    applied = []
+    try:
+        local.execute('''PRAGMA journal_mode = WAL''')
+        while schema_version(local) < SCHEMA_VERSION:
+            local.execute('''BEGIN IMMEDIATE''')
+            try:
+                version = schema_version(local)
+                if version < SCHEMA_VERSION:
+                    MIGRATIONS[version](local.cursor())
+                    local.execute('''PRAGMA user_version = %d''' % (version + 1))
+                    applied.append(version + 1)
+                local.execute('''COMMIT''')
+            except:
+                local.execute('''ROLLBACK''')
+                raise
+    finally:
+        local.close()
+    return applied
@@ -0,0 +1,103 @@
+import re
+import sqlite3
+from task_scheduler_dashboard_shauncampbell20.db import connection, transaction
+from task_scheduler_dashboard_shauncampbell20.logfiles import log_exists, log_path, log_size, read_lines
+
+## Full text search over ProcessLogger log files
+# ingest() feeds new log lines into the LogLines FTS5 table and remembers how far each run's log
+# has been read in LogIngest, so every call only reads what was written since the previous one.
+# The rowids of the lines of each run are recorded in LogLineRanges, retention deletes them by rowid.
+# SyncService calls it after every sync and --index on demand; search() only reads the index.
+
+LINE_PATTERN = re.compile(r'^([A-Z]+):([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}),[0-9]+ - (.*)$')
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+def ingest(db_path, process_automation_logs, max_bytes=None):
+    ''' Indexes the log lines written since the last call
+        Runs newer than any seen before are added to LogIngest, then every log that is not done is
+        read from its stored offset. A log is done once its run has completed and it has been read
+        to the end.
+        max_bytes: stop after reading about this many bytes, the rest is indexed by the next call
+        returns the number of lines indexed
+    '''
+    indexed = 0
+    read = 0
+    with transaction(db_path) as cursor:
+        cursor.execute('''
+            INSERT INTO LogIngest (run_id, log_file, offset, done)
+            SELECT run_id, log_file, 0, 0 FROM Runs
+            WHERE run_id > (SELECT COALESCE(MAX(run_id), 0) FROM LogIngest) AND log_file IS NOT NULL''')
+    with connection(db_path) as local:
+        pending = local.execute('''
+            SELECT LogIngest.run_id, LogIngest.log_file, LogIngest.offset,
+            Runs.run_id IS NULL OR Runs.end_time IS NOT NULL as finished
+            FROM LogIngest LEFT JOIN Runs ON LogIngest.run_id = Runs.run_id
+            WHERE LogIngest.done = 0''').fetchall()
+    for run_id, log_file, offset, finished in pending:
+        path = log_path(process_automation_logs, log_file)
+        if not log_exists(path):
+            with transaction(db_path) as cursor:
+                cursor.execute('''UPDATE LogIngest SET done = 1 WHERE run_id = ?''', (run_id,))
+            continue
+        # The lines of a log, their rowids and its new offset are committed together
+        with transaction(db_path) as cursor:
+            first_rowid = cursor.execute('''SELECT COALESCE(MAX(rowid), 0) + 1 FROM LogLines''').fetchone()[0]
+            run_lines = 0
+            level, logged_at = None, None
+            while not (max_bytes and read >= max_bytes):
+                lines, new_offset = read_lines(path, offset)
+                if not lines:
+                    break
+                rows = []
+                for line in lines:
+                    match = LINE_PATTERN.match(line)
+                    if match:
+                        level, logged_at, message = match.groups()
+                    elif line.startswith('+PROGRESS') or not line.strip():
+                        continue
+                    else:
+                        # Continuation of a multi-line record, e.g. a traceback
+                        message = line
+                    rows.append((message, run_id, level, logged_at))
+                cursor.executemany('''INSERT INTO LogLines (message, run_id, level, logged_at) VALUES (?, ?, ?, ?)''', rows)
+                run_lines += len(rows)
+                read += new_offset - offset
+                offset = new_offset
+            if run_lines:
+                # Nothing else writes LogLines during the transaction, the rowids from first_rowid on are this run's
+                cursor.execute('''INSERT INTO LogLineRanges (run_id, first_rowid, last_rowid) SELECT ?, ?, MAX(rowid) FROM LogLines''',
+                               (run_id, first_rowid))
+            indexed += run_lines
+            done = finished and offset >= log_size(path)
+            cursor.execute('''UPDATE LogIngest SET offset = ?, done = ? WHERE run_id = ?''', (offset, int(done), run_id))
+        if max_bytes and read >= max_bytes:
+            break
+    return indexed
+
+def search(db_path, query, level=None, script_id=None, limit=200):
+    ''' Returns the log lines matching query, most recently indexed first
+        query uses the FTS5 syntax, and is searched as a phrase if it is not valid FTS5
+        returns a list of dicts with run_id, script_id, log_file, level, logged_at and message
+    '''
+    sql = '''
+        SELECT LogLines.run_id as run_id, Runs.script_id as script_id, Runs.log_file as log_file,
+        LogLines.level as level, LogLines.logged_at as logged_at, LogLines.message as message
+        FROM LogLines LEFT JOIN Runs ON Runs.run_id = LogLines.run_id
+        WHERE LogLines MATCH ?'''
+    params = []
+    if level:
+        sql += ''' AND LogLines.level = ?'''
+        params.append(level)
+    if script_id:
+        sql += ''' AND Runs.script_id = ?'''
+        params.append(script_id)
+    sql += ''' ORDER BY LogLines.rowid DESC LIMIT ?'''
+    with connection(db_path, read_only=True) as local:
+        cursor = local.cursor()
+        cursor.row_factory = sqlite3.Row
+        try:
+            rows = cursor.execute(sql, [query] + params + [limit]).fetchall()
+        except sqlite3.OperationalError:
+            phrase = '"%s"' % query.replace('"', '""')
+            rows = cursor.execute(sql, [phrase] + params + [limit]).fetchall()
+    return [dict(row) for row in rows]
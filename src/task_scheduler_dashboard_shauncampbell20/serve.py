@@ -0,0 +1,83 @@
+import gzip
+import warnings
+from flask import request
+
+## Serving the dashboard
+# run() starts Flask's development server, used by --run and webapp.py. serve() runs the dashboard
+# under waitress, a production WSGI server with a pool of worker threads, used by --serve; wsgi.py
+# exposes the same application to other WSGI servers, e.g. gunicorn with several worker processes.
+# Both add production(): gzip compression of the responses, and caching headers that let browsers
+# keep the static files of Dash instead of asking for them on every page load.
+
+SERVE_THREADS = 8
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6
+COMPRESSED_TYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript', 'application/json'}
+STATIC_PREFIXES = ('/_dash-component-suites/', '/assets/')
+STATIC_MAX_AGE = 86400
+_static_bodies = {}
+
+def cache_static(response):
+    ''' Caching headers of the static files of Dash
+        Fingerprinted files, which Dash already gives a max-age of a year, never change under the same
+        URL and are marked immutable; the others can be kept for STATIC_MAX_AGE seconds.
+    '''
+    if response.status_code == 200 and request.path.startswith(STATIC_PREFIXES):
+        response.cache_control.public = True
+        if response.cache_control.max_age and response.cache_control.max_age > STATIC_MAX_AGE:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.max_age = STATIC_MAX_AGE
+    return response
+
+def compress(response):
+    ''' Gzips responses of COMPRESSED_TYPES of at least COMPRESS_MIN_SIZE bytes for clients accepting it
+        The compressed static files are kept, so each is compressed once per process.
+    '''
+    if (response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSED_TYPES or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    static = request.path.startswith(STATIC_PREFIXES)
+    body = _static_bodies.get(request.full_path) if static else None
+    if body is None:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        body = gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+        if static:
+            _static_bodies[request.full_path] = body
+    response.set_data(body)
+    # The ETag of the uncompressed body only matches the compressed one weakly
+    tag, _ = response.get_etag()
+    if tag:
+        response.set_etag(tag, weak=True)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def production(app):
+    # Adds compression and static caching headers to the responses of the Dash app, once
+    server = app.server
+    if 'dashboard_production' not in server.extensions:
+        server.after_request(cache_static)
+        server.after_request(compress)
+        server.extensions['dashboard_production'] = True
+    return server
+
+def run(app, host, port, debug=False):
+    # Flask's development server, with app.run or app.run_server on older Dash versions
+    start = app.run if hasattr(app, 'run') else app.run_server
+    start(host=host, port=port, debug=debug)
+
+def serve(app, host, port, threads=SERVE_THREADS):
+    ''' Serves app on host:port with waitress and threads worker threads
+        Without waitress installed, falls back to the threaded development server with a warning.
+    '''
+    server = production(app)
+    try:
+        import waitress
+    except ImportError:
+        warnings.warn('waitress is not installed (pip install waitress), serving with the development server')
+        server.run(host=host, port=int(port), threaded=True)
+        return
+    waitress.serve(server, host=host, port=int(port), threads=threads)
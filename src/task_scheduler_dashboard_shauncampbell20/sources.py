@@ -0,0 +1,121 @@
+import os
+import re
+import platform
+from collections import deque
+import xml.etree.ElementTree as ET
+from task_scheduler_dashboard_shauncampbell20.core import resultCodes
+
+## Sources of Task Scheduler tasks for config.build()
+# A task source yields one record per task, a dict with the keys
+# Name, Hidden, State, Last Run, Next Run, Folder, Command, Last Result and Machine.
+
+TASK_STATE = {0: 'Unknown',
+              1: 'Disabled',
+              2: 'Queued',
+              3: 'Ready',
+              4: 'Running'}
+
+def machine_name():
+    # Name of this machine, COMPUTERNAME on Windows
+    return os.environ.get('COMPUTERNAME') or platform.node()
+
+def result_text(code):
+    # Description of a task result code, or the code itself if it is not known
+    try:
+        return resultCodes[code]
+    except KeyError:
+        return code
+
+class TaskSource:
+    ''' Base class for task sources
+        Subclasses implement tasks(), a generator of task records
+    '''
+    def __init__(self, machine=None):
+        self.machine = machine or machine_name()
+
+    def tasks(self):
+        raise NotImplementedError
+
+class SchedulerTaskSource(TaskSource):
+    ''' Tasks of the local Task Scheduler, read through its COM interface
+        Folders are visited breadth first from folder, and each task is read once.
+    '''
+    TASK_ENUM_HIDDEN = 1
+
+    def __init__(self, folder, machine=None):
+        super().__init__(machine)
+        self.folder = folder
+
+    def tasks(self):
+        import win32com.client
+        import pythoncom
+        scheduler = win32com.client.Dispatch('Schedule.Service')
+        scheduler.Connect()
+        try:
+            folders = deque([scheduler.GetFolder(self.folder)])
+        except pythoncom.com_error:
+            raise pythoncom.com_error('"'+self.folder+'" folder not found in Task Scheduler')
+        while folders:
+            folder = folders.popleft()
+            folders.extend(folder.GetFolders(0))
+            for task in folder.GetTasks(self.TASK_ENUM_HIDDEN):
+                taskFolder, taskName = os.path.split(task.Path)
+                command = re.search('<Command>.+</Command>', task.Xml)
+                yield {'Name': taskName,
+                       'Hidden': task.Definition.Settings.Hidden,
+                       'State': TASK_STATE[task.State],
+                       'Last Run': task.LastRunTime,
+                       'Next Run': task.NextRunTime,
+                       'Folder': taskFolder,
+                       'Command': command.group(0)[9:-10] if command else '',
+                       'Last Result': result_text(task.LastTaskResult),
+                       'Machine': self.machine}
+
+class XmlTaskSource(TaskSource):
+    ''' Tasks exported from Task Scheduler as XML files (Export... or schtasks /query /xml)
+        Every file below directory is read. The task path comes from RegistrationInfo/URI, or from
+        the file's location below directory when the export has no URI. Exports carry no run
+        history, so Last Run, Next Run and Last Result are empty.
+    '''
+    NS = {'t': 'http://schemas.microsoft.com/windows/2004/02/mit/task'}
+
+    def __init__(self, directory, machine=None):
+        super().__init__(machine)
+        self.directory = directory
+
+    def tasks(self):
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                try:
+                    task = ET.parse(path).getroot()
+                except ET.ParseError:
+                    continue
+                if task.tag != '{%s}Task' % self.NS['t']:
+                    continue
+                yield self.record(task, os.path.relpath(path, self.directory))
+
+    def record(self, task, relpath):
+        # Task record from the root element of an exported task
+        uri = task.findtext('t:RegistrationInfo/t:URI', namespaces=self.NS)
+        if not uri:
+            uri = '\\' + os.path.splitext(relpath)[0].replace(os.sep, '\\')
+        taskFolder, taskName = uri.rsplit('\\', 1)
+        enabled = task.findtext('t:Settings/t:Enabled', 'true', namespaces=self.NS)
+        hidden = task.findtext('t:Settings/t:Hidden', 'false', namespaces=self.NS)
+        return {'Name': taskName,
+                'Hidden': hidden.strip() == 'true',
+                'State': 'Ready' if enabled.strip() == 'true' else 'Disabled',
+                'Last Run': None,
+                'Next Run': None,
+                'Folder': taskFolder or '\\',
+                'Command': (task.findtext('t:Actions/t:Exec/t:Command', '', namespaces=self.NS)).strip(),
+                'Last Result': '',
+                'Machine': self.machine}
+
+def task_source(scheduler_folder, xml_folder=None, machine=None):
+    # The XmlTaskSource of xml_folder if set, else the Task Scheduler folder scheduler_folder
+    if xml_folder:
+        return XmlTaskSource(xml_folder, machine)
+    return SchedulerTaskSource(scheduler_folder, machine)
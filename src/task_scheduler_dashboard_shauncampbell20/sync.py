@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from task_scheduler_dashboard_shauncampbell20.core import get_config, sweep_abandoned_runs
+from task_scheduler_dashboard_shauncampbell20.db import execute, query, transaction
+from task_scheduler_dashboard_shauncampbell20.rollups import ROLLUP_BATCH_SIZE, rollup_runs
+from task_scheduler_dashboard_shauncampbell20.retention import maintain_if_due
+from task_scheduler_dashboard_shauncampbell20.search import ingest
+
+## Background sync of the task source into Executors and Tasks
+# SyncService runs config.build(update=True) every SYNC_INTERVAL seconds, inside the dashboard
+# process (--run) or on its own (--sync). Each sync is recorded in SyncStatus, and pushed to the
+# central dashboard at PUSH_URL if configured. Runs that stopped sending heartbeats are marked
+# abandoned on every sync, log lines written since the last sync are added to the search index, and
+# retention.maintain() runs once a day after a sync.
+
+SYNC_INTERVAL = 300
+BUSY_BACKOFF = 5
+
+def sync_interval():
+    # Seconds between syncs, from the SYNC_INTERVAL config
+    try:
+        return float(get_config('SYNC_INTERVAL'))
+    except KeyError:
+        return SYNC_INTERVAL
+
+def is_busy(error):
+    # True if error means another connection holds the database lock
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+def record_sync(db_path, machine, sync_time, duration_ms, changes, status, error=None):
+    # Stores the outcome of a sync in SyncStatus
+    execute(db_path, 'record_sync', (machine, sync_time, duration_ms, changes, status, error, status, sync_time))
+
+def sync_once(workers=1, source=None):
+    ''' Applies the changes of the task source to the database and records the sync in SyncStatus
+        returns the report of config.build
+    '''
+    from task_scheduler_dashboard_shauncampbell20.config import build, default_source
+    if source is None:
+        source = default_source()
+    db_path = os.path.join(get_config('PROCESS_AUTOMATION_HOME'), get_config('DB_NAME'))
+    sync_time = int(time.time())
+    started = time.monotonic()
+    try:
+        report = build(update=True, workers=workers, source=source)
+    except Exception as e:
+        status = 'busy' if is_busy(e) else 'error'
+        try:
+            record_sync(db_path, source.machine, sync_time, int((time.monotonic() - started) * 1000), 0, status, str(e))
+        except sqlite3.Error:
+            pass
+        raise
+    sweep_abandoned_runs(db_path)
+    # Add runs not rolled up by ProcessLogger.complete(): abandoned, uploaded or from before rollups
+    while True:
+        with transaction(db_path) as cursor:
+            if rollup_runs(cursor) < ROLLUP_BATCH_SIZE:
+                break
+    changes = sum(sum(counts.values()) for counts in report.values())
+    record_sync(db_path, source.machine, sync_time, int((time.monotonic() - started) * 1000), changes, 'ok')
+    # Upload to the central dashboard, if any
+    try:
+        push_url, token = get_config('PUSH_URL'), get_config('INGEST_TOKEN')
+    except KeyError:
+        push_url = None
+    if push_url:
+        from task_scheduler_dashboard_shauncampbell20.aggregate import push
+        push(push_url, token, db_path, source.machine)
+    return report
+
+def sync_status(db_path):
+    # Last sync of each machine, as a list of dicts
+    try:
+        rows = query(db_path, 'sync_status', row_factory=sqlite3.Row)
+    except sqlite3.OperationalError:
+        return []
+    return [dict(row) for row in rows]
+
+class SyncService(threading.Thread):
+    ''' Thread that syncs the task source every interval seconds until stop() is called
+        While the database is locked by another writer, the sync is retried after BUSY_BACKOFF
+        seconds, doubling up to interval.
+    '''
+    def __init__(self, interval=None, workers=1, source=None, delay=0):
+        # delay: seconds before the first sync
+        super().__init__(name='task-sync', daemon=True)
+        self.interval = interval or sync_interval()
+        self.workers = workers
+        self.source = source
+        self.delay = delay
+        self._stop_event = threading.Event()
+
+    def run(self):
+        backoff = BUSY_BACKOFF
+        delay = self.delay
+        while not self._stop_event.wait(delay):
+            delay = self.interval
+            try:
+                sync_once(self.workers, self.source)
+                backoff = BUSY_BACKOFF
+                home = get_config('PROCESS_AUTOMATION_HOME')
+                ingest(os.path.join(home, get_config('DB_NAME')), os.path.join(home, 'logs'))
+                maintain_if_due(os.path.join(home, get_config('DB_NAME')), os.path.join(home, 'logs'))
+            except Exception as e:
+                if is_busy(e):
+                    delay = min(backoff, self.interval)
+                    backoff *= 2
+                else:
+                    warnings.warn('Sync failed: ' + str(e))
+
+    def stop(self):
+        # Ends the loop after the current sync
+        self._stop_event.set()
@@ -1,102 +1,193 @@
 import dash
-from dash import dash_table, dcc, html
+from dash import dash_table, dcc, html, Patch
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-import pandas as pd
+from dash.dependencies import Input, Output, State
 import os
 import sqlite3
-import re
-from core import PROCESS_AUTOMATION_HOME, DB_NAME, set_config, get_config
-import sys
+from task_scheduler_dashboard_shauncampbell20.core import PROCESS_AUTOMATION_HOME, DB_NAME, set_config, get_config
+from task_scheduler_dashboard_shauncampbell20.schema import to_epoch
+from task_scheduler_dashboard_shauncampbell20.db import connection, query, query_one
+from task_scheduler_dashboard_shauncampbell20.search import LEVELS, search
+from task_scheduler_dashboard_shauncampbell20.sync import sync_status
+from task_scheduler_dashboard_shauncampbell20.aggregate import register_ingest
+from task_scheduler_dashboard_shauncampbell20.graph import SCRIPT, register_graph_api, task_graph
+from task_scheduler_dashboard_shauncampbell20.rollups import HOUR, DAY, rollup_series, rollup_summary
+from task_scheduler_dashboard_shauncampbell20.logfiles import CHUNK_SIZE, log_exists, log_path, log_size, read_range, read_header, read_progress
+import time
 import argparse
-from subprocess import Popen, CREATE_NEW_CONSOLE
+import subprocess
+from subprocess import Popen
 
 process_automation_logs = os.path.join(PROCESS_AUTOMATION_HOME, 'logs')
 process_automation_db = os.path.join(PROCESS_AUTOMATION_HOME, DB_NAME)
+# Scripts are started in a console of their own on Windows, the flag does not exist elsewhere
+CREATE_NEW_CONSOLE = getattr(subprocess, 'CREATE_NEW_CONSOLE', 0)
 
-def format_home_table(df):
-    # Helper function to transform Last Run Table into dash DataTable
-    d = {col: df[col].tolist() for col in df.columns}
-    url = get_config('HOST')+':'+get_config('PORT')
-    d['LogFile'] = ['[%s](/%s)' % (i, i) for i in df['LogFile'].tolist()]
-    d['Task'] = ['[%s](/%s)' % (i, i) for i in df['Task'].tolist()]
-    df = pd.DataFrame(d)
-    df['LastRunTime'] = df['LastRunTime'].apply(
-        lambda x: pd.Timestamp(x).strftime('%Y-%m-%d %H:%M:%S') if x != '' else '')
-    df['NextRunTime'] = df['NextRunTime'].apply(
-        lambda x: pd.Timestamp(x).strftime('%Y-%m-%d %H:%M:%S') if x != '' else '')
-    df = df.sort_values('StartTime', ascending=False)
-    table = dash_table.DataTable(
-        data=df.to_dict(orient='records'),
-        columns=[{'id': x, 'name': x, 'presentation': 'markdown'} if x in ['LogFile', 'Task'] else {'id': x, 'name': x}
-                 for x in df.columns],
-        style_table={'position': 'relative', 'top': '5vh', 'left': '5vw', 'width': '60vw'},
-        style_cell={
-            'overflow': 'hidden',
-            'textOverflow': 'ellipsis',
-            'maxWidth': 300,
-            'padding-right': '20px',
-            'padding-left': '20px',
-            'fontSize': 13
-        },
-        style_cell_conditional=[
-            {
-                'if': {'column_id': c},
-                'textAlign': 'left'
-            } for c in ['Executor', 'LastRunResult', 'Status', 'Result']
-        ],
+LOG_STYLE = {'whiteSpace': 'pre-line', "border":"2px #D0D0D0   solid", "background-color":'#F8F8F8', "padding": '15px', 'font':'15px Arial, sans-serif'}
+LOG_FOLLOW_INTERVAL = 2000
+SKIPPED = '\n... %d bytes not shown ...\n\n'
 
-        style_data_conditional=[
-            {
-                'if': {
-                    'filter_query': '{Result} = success',  # matching rows of a hidden column with the id, `id`
-                    'column_id': 'Result'
-                },
-                'backgroundColor': 'green',
-                'color': 'white'
-            },
-            {
-                'if': {
-                    'filter_query': '{Result} = error',  # matching rows of a hidden column with the id, `id`
-                    'column_id': 'Result'
-                },
-                'backgroundColor': '#ff9696',
-                'color': 'white'
-            },
-            {
-                'if': {
-                    'filter_query': "{Result} = 'no records'",  # matching rows of a hidden column with the id, `id`
-                    'column_id': 'Result'
-                },
-                'backgroundColor': '#f1f1f1',
-                'color': 'black'
-            },
-            {
-                'if': {
-                    'filter_query': "{Result} = 'critical'",  # matching rows of a hidden column with the id, `id`
-                    'column_id': 'Result'
-                },
-                'backgroundColor': 'red',
-                'color': 'white'
-            },
-            {
-                'if': {
-                    'filter_query': "{Result} = 'warning'",  # matching rows of a hidden column with the id, `id`
-                    'column_id': 'Result'
-                },
-                'backgroundColor': '#ffc64d',
-                'color': 'white'
-            }
-        ],
+def format_age(seconds):
+    # Human readable age of seconds
+    if seconds < 60:
+        return '%d s' % seconds
+    elif seconds < 3600:
+        return '%d min' % (seconds // 60)
+    elif seconds < 86400:
+        return '%d h' % (seconds // 3600)
+    return '%d days' % (seconds // 86400)
+
+def format_sync_status():
+    # Line telling how fresh the task information of each machine is
+    parts = []
+    now = time.time()
+    for status in sync_status(process_automation_db):
+        if status['success_time']:
+            text = '%s synced %s ago (%d ms)' % (status['machine'], format_age(now - status['success_time']), status['duration_ms'] or 0)
+        else:
+            text = '%s not synced' % status['machine']
+        if status['status'] != 'ok':
+            text += ', last attempt %s: %s' % (status['status'], status['error'])
+        parts.append(text)
+    return html.P(' | '.join(parts), id='sync-status',
+                  style={'position': 'relative', 'top': '3vh', 'left': '5vw', 'fontSize': 12, 'color': 'gray'})
+
+# Home page DataTable, the columns of the last_run_table statement and the styles, built once
+HOME_COLUMNS = ['Task', 'StartTime', 'EndTime', 'Result', 'Records', 'RecordsPerSec', 'Errors', 'Warnings', 'LogFile',
+                'RanBy', 'Machine', 'Executor', 'Status', 'LastRunTime', 'NextRunTime']
+HOME_REFRESH_SECONDS = 5
+HOME_TABLE_COLUMNS = [{'id': x, 'name': x, 'presentation': 'markdown'} if x in ['LogFile', 'Task'] else {'id': x, 'name': x}
+                      for x in HOME_COLUMNS]
+HOME_STYLE_CELL = {
+    'overflow': 'hidden',
+    'textOverflow': 'ellipsis',
+    'maxWidth': 300,
+    'padding-right': '20px',
+    'padding-left': '20px',
+    'fontSize': 13
+}
+HOME_STYLE_CELL_CONDITIONAL = [{'if': {'column_id': c}, 'textAlign': 'left'} for c in ['Executor', 'LastRunResult', 'Status', 'Result']]
+# Result -> (background, text color)
+RESULT_COLORS = {
+    'success': ('green', 'white'),
+    'error': ('#ff9696', 'white'),
+    'no records': ('#f1f1f1', 'black'),
+    'critical': ('red', 'white'),
+    'warning': ('#ffc64d', 'white'),
+    'abandoned': ('#8c8c8c', 'white'),
+}
+HOME_STYLE_DATA_CONDITIONAL = [{'if': {'filter_query': "{Result} = '%s'" % result, 'column_id': 'Result'},
+                                'backgroundColor': background, 'color': color}
+                               for result, (background, color) in RESULT_COLORS.items()]
+
+def format_home_table(records):
+    # Home page DataTable of the records of last_run_table
+    return dash_table.DataTable(
+        id='home-datatable',
+        data=records,
+        columns=HOME_TABLE_COLUMNS,
+        style_table={'position': 'relative', 'top': '5vh', 'left': '5vw', 'width': '60vw'},
+        style_cell=HOME_STYLE_CELL,
+        style_cell_conditional=HOME_STYLE_CELL_CONDITIONAL,
+        style_data_conditional=HOME_STYLE_DATA_CONDITIONAL,
         style_as_list_view=True, fill_width=False, sort_action="native", )
-    return table
 
-def format_hist_table(df):
+# Run history columns: column id -> (SQL expression shown, SQL column used for sorting and filtering)
+HIST_COLUMNS = {
+    'script_id': ('script_id', 'script_id'),
+    'start_time': ("strftime('%Y-%m-%d %H:%M:%S', start_time, 'unixepoch')", 'start_time'),
+    'end_time': ("strftime('%Y-%m-%d %H:%M:%S', end_time, 'unixepoch')", 'end_time'),
+    'records': ('records', 'records'),
+    'errors': ('errors', 'errors'),
+    'warnings': ('warnings', 'warnings'),
+    'result': ('result', 'result'),
+    'log_file': ("'[' || log_file || '](/' || log_file || ')'", 'log_file'),
+    'user': ('user', 'user'),
+    'machine': ('machine', 'machine'),
+}
+HIST_TIME_COLUMNS = ['start_time', 'end_time']
+HIST_PAGE_SIZE = 25
+
+FILTER_OPERATORS = [['ge ', '>='],
+                    ['le ', '<='],
+                    ['lt ', '<'],
+                    ['gt ', '>'],
+                    ['ne ', '!='],
+                    ['eq ', '='],
+                    ['contains '],
+                    ['datestartswith ']]
+SQL_OPERATORS = {'ge': '>=', 'le': '<=', 'lt': '<', 'gt': '>', 'ne': '!=', 'eq': '='}
+
+def split_filter_part(filter_part):
+    # Splits one part of a DataTable filter_query into (column id, operator, value)
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return [None] * 3
+
+def hist_where(script_id, filter_query):
+    # Translates a DataTable filter_query into a parameterized WHERE clause on Runs
+    clauses = ['script_id = ?']
+    params = [script_id]
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name not in HIST_COLUMNS:
+            continue
+        shown, column = HIST_COLUMNS[col_name]
+        if operator in ('contains', 'datestartswith'):
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            clauses.append('%s LIKE ?' % (shown if col_name in HIST_TIME_COLUMNS else column))
+            params.append(('%%%s%%' if operator == 'contains' else '%s%%') % value)
+        else:
+            if col_name in HIST_TIME_COLUMNS:
+                value = to_epoch(value)
+                if value is None:
+                    continue
+            clauses.append('%s %s ?' % (column, SQL_OPERATORS[operator]))
+            params.append(value)
+    return ' AND '.join(clauses), params
+
+def run_history(script_id, page_current=0, page_size=HIST_PAGE_SIZE, sort_by=None, filter_query=''):
+    ''' Returns one page of the run history for script_id as DataTable records, and the number of pages
+        Sorting, filtering and paging are done in SQL on the indexed Runs(script_id, start_time)
+    '''
+    where, params = hist_where(script_id, filter_query)
+    order = []
+    for sort in sort_by or []:
+        if sort['column_id'] in HIST_COLUMNS:
+            order.append('%s %s' % (HIST_COLUMNS[sort['column_id']][1], 'ASC' if sort['direction'] == 'asc' else 'DESC'))
+    order = order or ['start_time DESC']
+    shown = ', '.join('%s AS %s' % (expr, col) for col, (expr, _) in HIST_COLUMNS.items())
+    with connection(process_automation_db, read_only=True) as local:
+        cursor = local.cursor()
+        cursor.row_factory = sqlite3.Row
+        count = cursor.execute('''SELECT COUNT(*) FROM Runs WHERE %s''' % where, params).fetchone()[0]
+        rows = cursor.execute('''SELECT %s FROM Runs WHERE %s ORDER BY %s, run_id DESC LIMIT ? OFFSET ?'''
+                              % (shown, where, ', '.join(order)), params + [page_size, page_current * page_size]).fetchall()
+    return [dict(row) for row in rows], max(1, -(-count // page_size))
+
+def format_hist_table():
+    # Run history DataTable, rows are loaded page by page by update_hist_table
     table = dash_table.DataTable(
-        data=df.to_dict(orient='records'),
+        id='hist-table',
+        data=[],
         columns=[
             {'id': x, 'name': x, 'presentation': 'markdown'} if x in ['log_file', 'script_id'] else {'id': x, 'name': x}
-            for x in df.columns],
+            for x in HIST_COLUMNS],
         # style_table={'position': 'relative', 'top': '5vh', 'left': '5vw', 'width': '60vw'},
         style_cell={
             'overflow': 'hidden',
@@ -112,45 +203,124 @@ def format_hist_table(df):
                 'textAlign': 'left'
             } for c in ['Executor', 'LastRunResult', 'Status']
         ],
+        page_action='custom', page_current=0, page_size=HIST_PAGE_SIZE,
+        sort_action='custom', sort_mode='single', sort_by=[],
+        filter_action='custom', filter_query='',
         style_as_list_view=True, fill_width=False)
     return table
 
-def last_run_table():
-    # Returns table with information for the last run of each task in Tasks that has run
-    with sqlite3.connect(process_automation_db) as local:
-        run_table = pd.read_sql_query('''
-            WITH tab as (
-            SELECT * FROM Runs WHERE run_id IN (
-            SELECT
-            MAX(run_id) as run_id
-            FROM Runs
-            GROUP BY script_id
-            ORDER BY end_time DESC)
-            ) 
-
-            SELECT 
-            Tasks.script_id as Task,
-            tab.start_time as StartTime,
-            tab.end_time as EndTime,
-            tab.result as Result,
-            tab.records as Records,
-            tab.errors as Errors,
-            tab.warnings as Warnings,
-            tab.log_file as LogFile,
-            tab.user as RanBy,
-            tab.machine as Machine,
-            Executors.name as Executor,
-            Executors.state as Status,
-            Executors.last_run_time as LastRunTime,
-            Executors.next_run_time as NextRunTime
-            FROM Tasks
-            LEFT JOIN tab ON Tasks.script_id = tab.script_id 
-            LEFT JOIN Executors ON Tasks.command = Executors.command
-            --WHERE Executors.state <> 'Disabled'
-        ''', local).fillna('')
-    return run_table
-
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+def last_run_table(machine=None, since=None):
+    # Returns the DataTable records of the last run of each task in Tasks, formatted by the last_run_table statement
+    # LatestRuns is kept current by triggers on Runs, see schema.create_latest_runs_triggers
+    # machine: only the tasks of this machine, since: only the tasks whose last run changed after this runs version
+    return [dict(zip(HOME_COLUMNS, row)) for row in query(process_automation_db, 'last_run_table',
+                                                          (machine, machine, -1 if since is None else since), read_only=True)]
+
+def home_version(machine=None):
+    # [machine, tasks version, runs version] of the home table, the token the live home page polls with, see schema.add_data_versions
+    versions = dict(query(process_automation_db, 'data_versions', read_only=True))
+    return [machine, versions['tasks'], versions['runs']]
+
+def home_refresh_interval():
+    # Milliseconds between the home page's polls for changed rows, from the HOME_REFRESH_SECONDS config, 0 for no live updates
+    try:
+        return int(float(get_config('HOME_REFRESH_SECONDS')) * 1000)
+    except KeyError:
+        return HOME_REFRESH_SECONDS * 1000
+
+def machines():
+    # Machines with tasks in the database
+    return [row[0] for row in query(process_automation_db, 'machines', read_only=True)]
+
+def format_home_page():
+    # Sync status, machine filter and last run table of the home page, kept current by refresh_home_table
+    options = machines()
+    # The version is read before the rows, so a change in between is sent again rather than missed
+    version = home_version()
+    interval = home_refresh_interval()
+    return html.Div([
+        dcc.Store(id='home-version', data=version),
+        dcc.Store(id='home-changes'),
+        dcc.Interval(id='home-interval', interval=interval or HOME_REFRESH_SECONDS * 1000, disabled=not interval),
+        html.Div([dcc.Link('Statistics', href='/stats', style={'margin-right': '15px'}), dcc.Link('Search logs', href='/search')],
+                 style={'position': 'relative', 'top': '3vh', 'left': '5vw', 'fontSize': 13}),
+        format_sync_status(),
+        dcc.Dropdown(id='machine-filter', options=[{'label': m, 'value': m} for m in options], placeholder='All machines',
+                     style={'width': '300px', 'position': 'relative', 'top': '3vh', 'left': '5vw',
+                            'display': 'block' if len(options) > 1 else 'none'}),
+        html.Div(format_home_table(last_run_table()), id='home-table')])
+
+STATS_DAYS = [7, 30, 90, 365]
+STATS_COLUMNS = ['script_id', 'runs', 'failure_rate', 'records_per_run', 'avg_s', 'p50_s', 'p95_s']
+
+def format_stats_page():
+    # Statistics page, the summary of every script and the trends of one script, from RunRollups
+    with connection(process_automation_db, read_only=True) as local:
+        scripts = [row[0] for row in local.execute('''SELECT DISTINCT script_id FROM RunRollups WHERE period = ? ORDER BY script_id''', (DAY,))]
+    return html.Div([
+        html.H3('Statistics'),
+        dcc.RadioItems(id='stats-days', options=[{'label': ' Last %d days' % d, 'value': d} for d in STATS_DAYS], value=30,
+                       inline=True, inputStyle={'margin-left': '15px'}),
+        dash_table.DataTable(
+            id='stats-table',
+            columns=[{'id': x, 'name': x} for x in STATS_COLUMNS],
+            sort_action='native',
+            style_cell={'padding-right': '20px', 'padding-left': '20px', 'fontSize': 13},
+            style_as_list_view=True, fill_width=False),
+        html.Div([
+            dcc.Dropdown(id='stats-script', options=[{'label': s, 'value': s} for s in scripts], value=scripts[0] if scripts else None,
+                         placeholder='Script', style={'width': '300px', 'display': 'inline-block', 'vertical-align': 'middle'}),
+            dcc.RadioItems(id='stats-period', options=[{'label': ' Hourly', 'value': HOUR}, {'label': ' Daily', 'value': DAY}],
+                           value=DAY, inline=True, inputStyle={'margin-left': '15px'}, style={'display': 'inline-block'})
+            ], style={'padding-top': '25px'}),
+        dcc.Graph(id='stats-duration'),
+        dcc.Graph(id='stats-failures'),
+        dcc.Graph(id='stats-records')
+        ], style={"padding": '35px'})
+
+def stats_figure(x, series, title, yaxis):
+    # Line chart of series {name: values} over x
+    return {'data': [{'x': x, 'y': y, 'name': name, 'type': 'scatter', 'mode': 'lines+markers'} for name, y in series.items()],
+            'layout': {'title': {'text': title}, 'yaxis': {'title': {'text': yaxis}}, 'height': 300,
+                       'margin': {'t': 40, 'b': 40}}}
+
+def seconds(ms, digits=None):
+    # ms in seconds, rounded to digits if given; None, e.g. no duration in the histogram, stays None
+    if ms is None:
+        return None
+    return ms / 1000 if digits is None else round(ms / 1000, digits)
+
+def format_graph_list(title, jobs):
+    # List of upstream or downstream jobs, nearest first, with the status they inherit; scripts link to their task view
+    items = []
+    for job in jobs:
+        name = dcc.Link(job['name'], href='/' + job['name']) if job['kind'] == SCRIPT else job['name']
+        status = ' - %s' % job['status'] if job['status'] else ''
+        items.append(html.Li(['%s ' % job['kind'], name, ' (%s, %d away)%s' % (job['machine'], job['depth'], status)]))
+    return html.Div([html.H5(title), html.Ul(items) if items else html.P('None')], style={'fontSize': 13})
+
+def format_graph_panel(script_id):
+    # Upstream and downstream jobs of script_id from TaskGraph, see graph.py
+    graph = task_graph(process_automation_db, script_id)
+    children = [format_graph_list('Upstream', graph['upstream']), format_graph_list('Downstream', graph['downstream'])]
+    for cycle in graph['cycles']:
+        children.append(html.P('Dependency cycle: ' + ' -> '.join('%s %s' % node for node in cycle), style={'color': 'red'}))
+    return html.Div(children, style={'padding-bottom': '15px'})
+
+def is_task(script_id):
+    # Checks if script_id is a task in Tasks
+    return query_one(process_automation_db, 'is_task', (script_id,), read_only=True) is not None
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
+
+# Accept uploads from other machines when an ingest token is configured, see aggregate.py
+try:
+    ingest_token = get_config('INGEST_TOKEN')
+except KeyError:
+    ingest_token = None
+if ingest_token:
+    register_ingest(app.server, process_automation_db, ingest_token)
+register_graph_api(app.server, process_automation_db)
 app.layout = html.Div(
     children=[html.Div(children=[
         dcc.Location(id='url', refresh=False),
@@ -165,52 +335,199 @@ app.layout = html.Div(
               [Input('url', 'pathname')])
 def display_page(pathname):
     path = os.path.split(pathname)[-1]
-    dat = last_run_table()
-    url = get_config('HOST')+':'+get_config('PORT')
     
     # Home Page
     if path == 'home' or path == '':
-        return (format_home_table(dat), {'display':'none'})
+        return (format_home_page(), {'display':'none'})
     
+    # Statistics
+    elif path == 'stats':
+        return (format_stats_page(), {'display':'none'})
+
+    # Log Search
+    elif path == 'search':
+        return (html.Div([
+            html.H3('Search logs'),
+            html.Div([
+                dcc.Input(id='search-query', type='text', debounce=True, placeholder='Search log messages',
+                          style={'width': '40vw', 'margin-right': '15px'}),
+                dcc.Dropdown(id='search-level', options=[{'label': l, 'value': l} for l in LEVELS],
+                             placeholder='Level', style={'width': '200px', 'display': 'inline-block', 'vertical-align': 'middle'})
+                ], style={'padding-bottom': '15px'}),
+            html.Div(id='search-results')
+            ], style={"padding": '35px'}), {'display':'none'})
+
     # Task View
-    elif path in dat['Task'].tolist():
-        with sqlite3.connect(process_automation_db) as local_con:
-            hist = pd.read_sql_query(
-                f'''SELECT script_id, start_time, end_time, records, errors, warnings, result, 
-                log_file, user, machine FROM Runs WHERE script_id = '{path}' ORDER BY start_time DESC''',
-                local_con)
-            info = pd.read_sql_query(f'''SELECT * FROM Tasks WHERE script_id = '{path}' ''', local_con).to_dict('index')[0]
-        hist['log_file'] = ['[%s](/%s)' % (i, i) for i in hist['log_file'].tolist()]
+    elif is_task(path):
+        info = query_one(process_automation_db, 'task_info', (path,), sqlite3.Row, read_only=True)
         return (html.Div([
             html.H3(path),
             html.P('Script Location: %s' % info['script']),
             html.P('Executor Location: %s' % info['command']),
-            format_hist_table(hist) ], style={"padding": '35px'}), {'display':'block'})
+            format_graph_panel(path),
+            format_hist_table() ], style={"padding": '35px'}), {'display':'block'})
     
     # Log View
     else:
-        with open(os.path.join(process_automation_logs, path)) as f:
-            txt = f.read()
-            script_name = re.search('starting execution for .+', txt).group(0).replace('starting execution for ', '')
-            if re.search('[0-9]{4}-[0-9]{2}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', txt):
-                date = re.search('[0-9]{4}-[0-9]{2}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', txt).group(0)
-            elif re.search('[0-9]{2}-\w{3}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', txt):
-                date = re.search('[0-9]{2}-\w{3}-[0-9]{2}\s[0-9]{2}:[0-9]{2}:[0-9]{2}', txt).group(0)
-            else:
-                date = ''
+        log_file = path
+        path = log_path(process_automation_logs, log_file)
+        if not log_exists(path):
+            return (html.Div([html.H3('Log %s not found' % log_file)], style={"padding": '35px'}), {'display':'none'})
+        script_name, date = read_header(path)
+        txt, start, end = initial_log_window(path)
         return (html.Div([
             html.H3('Log for %s | %s' % (script_name, date)),
-            html.Div(txt, style={'whiteSpace': 'pre-line', "border":"2px #D0D0D0   solid", "background-color":'#F8F8F8', "padding": '15px', 'font':'15px Arial, sans-serif'})
+            html.Div([
+                html.Button('Older', id='log-older', n_clicks=0),
+                html.Button('Newer', id='log-newer', n_clicks=0),
+                dcc.Checklist(id='log-follow', options=[{'label': ' Follow', 'value': 'follow'}], value=[],
+                              inline=True, style={'display': 'inline-block', 'padding-left': '15px'})
+                ], style={'padding-bottom': '10px'}),
+            dcc.Store(id='log-state', data={'log_file': log_file, 'start': start, 'end': end, 'progress': read_progress(path)}),
+            dcc.Interval(id='log-interval', interval=LOG_FOLLOW_INTERVAL, disabled=True),
+            html.Div([txt], id='log-text', style=LOG_STYLE),
+            html.Div(read_progress(path), id='log-progress', style={'whiteSpace': 'pre-line', 'padding': '5px 15px', 'font':'15px Arial, sans-serif'})
             ], style={"padding": '35px'}), {'display':'none'})
 
+def initial_log_window(path):
+    # First and last CHUNK_SIZE bytes of the log at path, returns (text, start, end) of the last window
+    size = log_size(path)
+    if size <= 2 * CHUNK_SIZE:
+        return read_range(path, 0, size)
+    head, _, head_end = read_range(path, 0, CHUNK_SIZE)
+    tail, start, end = read_range(path, size - CHUNK_SIZE, size)
+    return head + SKIPPED % (start - head_end) + tail, start, end
+
+@app.callback([Output('log-text', 'children'), Output('log-state', 'data'), Output('log-progress', 'children')],
+              [Input('log-older', 'n_clicks'), Input('log-newer', 'n_clicks'), Input('log-interval', 'n_intervals')],
+              [State('log-state', 'data')], prevent_initial_call=True)
+def page_log(older, newer, n_intervals, state):
+    # Moves the log window by CHUNK_SIZE bytes, or appends the bytes written since the last poll when following
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    path = log_path(process_automation_logs, os.path.split(state['log_file'])[-1])
+    start, end = state['start'], state['end']
+    if trigger == 'log-older':
+        # Already at the top of the log
+        if start == 0:
+            raise PreventUpdate
+        txt, start, end = read_range(path, max(0, start - CHUNK_SIZE), start)
+        if not txt:
+            raise PreventUpdate
+        return [txt], dict(state, start=start, end=end), dash.no_update
+    if trigger == 'log-newer':
+        txt, start, end = read_range(path, end, end + CHUNK_SIZE)
+        if not txt:
+            raise PreventUpdate
+        return [txt], dict(state, start=start, end=end), dash.no_update
+    size = log_size(path)
+    progress = read_progress(path)
+    if size == end and progress == state['progress']:
+        raise PreventUpdate
+    children = Patch()
+    if size - end > CHUNK_SIZE:
+        txt, new_start, size = read_range(path, size - CHUNK_SIZE, size)
+        children.append(SKIPPED % (new_start - end) + txt)
+    elif size > end:
+        txt, _, size = read_range(path, end, size)
+        children.append(txt)
+    return children, dict(state, end=size, progress=progress), progress
+
+@app.callback(Output('stats-table', 'data'), [Input('stats-days', 'value')])
+def update_stats_table(days):
+    with connection(process_automation_db, read_only=True) as local:
+        summary = rollup_summary(local.cursor(), int(time.time()) - days * DAY)
+    return [{'script_id': row['script_id'], 'runs': row['runs'], 'failure_rate': '{:.1%}'.format(row['failure_rate']),
+             'records_per_run': round(row['records_per_run'], 1), 'avg_s': seconds(row['avg_ms'], 1),
+             'p50_s': seconds(row['p50_ms'], 1), 'p95_s': seconds(row['p95_ms'], 1)} for row in summary]
+
+@app.callback([Output('stats-duration', 'figure'), Output('stats-failures', 'figure'), Output('stats-records', 'figure')],
+              [Input('stats-script', 'value'), Input('stats-period', 'value'), Input('stats-days', 'value')])
+def update_stats_graphs(script_id, period, days):
+    if not script_id:
+        raise PreventUpdate
+    with connection(process_automation_db, read_only=True) as local:
+        series = rollup_series(local.cursor(), script_id, period, int(time.time()) - days * DAY)
+    x = [time.strftime('%Y-%m-%d %H:%M', time.gmtime(row['bucket'])) for row in series]
+    return (stats_figure(x, {'p50': [seconds(row['p50_ms']) for row in series], 'p95': [seconds(row['p95_ms']) for row in series]},
+                         'Duration of %s' % script_id, 'seconds'),
+            stats_figure(x, {'failure rate': [row['failure_rate'] for row in series]}, 'Failure rate', ''),
+            stats_figure(x, {'records per run': [row['records_per_run'] for row in series]}, 'Records per run', 'records'))
+
+@app.callback([Output('home-table', 'children'), Output('home-version', 'data', allow_duplicate=True)],
+              [Input('machine-filter', 'value')], prevent_initial_call=True)
+def filter_home_table(machine):
+    version = home_version(machine)
+    return format_home_table(last_run_table(machine)), version
+
+@app.callback([Output('home-changes', 'data'), Output('home-version', 'data')], [Input('home-interval', 'n_intervals')],
+              [State('home-version', 'data'), State('machine-filter', 'value')], prevent_initial_call=True)
+def refresh_home_table(n_intervals, version, machine):
+    ''' Rows of the home table changed since the version the page has, merged into the table by merge_home_changes
+        Nothing is sent while the version is current. Runs change single rows; a change of Tasks or
+        Executors, or of the machine shown, sends the whole table.
+    '''
+    current = home_version(machine)
+    if current == version:
+        raise PreventUpdate
+    full = not version or current[:2] != version[:2]
+    return {'full': full, 'rows': last_run_table(machine, None if full else version[2])}, current
+
+# Replaces the rows of the tasks changed and keeps the table ordered by start time like last_run_table
+app.clientside_callback(
+    '''
+    function(changes, rows) {
+        if (!changes) {
+            return window.dash_clientside.no_update;
+        }
+        if (changes.full) {
+            return changes.rows;
+        }
+        const changed = new Set(changes.rows.map(row => row.Task));
+        const merged = (rows || []).filter(row => !changed.has(row.Task)).concat(changes.rows);
+        return merged.sort((a, b) => (a.StartTime < b.StartTime) - (a.StartTime > b.StartTime));
+    }
+    ''',
+    Output('home-datatable', 'data'), [Input('home-changes', 'data')], [State('home-datatable', 'data')], prevent_initial_call=True)
+
+@app.callback(Output('search-results', 'children'),
+              [Input('search-query', 'value'), Input('search-level', 'value')], prevent_initial_call=True)
+def search_logs(query, level):
+    # Lists the indexed log lines matching query, the index is kept up to date by the syncs
+    if not query:
+        raise PreventUpdate
+    lines = search(process_automation_db, query, level=level)
+    data = [{'Task': '[%s](/%s)' % (l['script_id'], l['script_id']), 'LogFile': '[%s](/%s)' % (l['log_file'], l['log_file']),
+             'Level': l['level'], 'Time': l['logged_at'], 'Message': l['message']} for l in lines]
+    return [html.P('%d matching lines from %d runs' % (len(lines), len(set(l['run_id'] for l in lines)))),
+            dash_table.DataTable(
+                data=data,
+                columns=[{'id': x, 'name': x, 'presentation': 'markdown'} if x in ['LogFile', 'Task'] else {'id': x, 'name': x}
+                         for x in ['Task', 'LogFile', 'Level', 'Time', 'Message']],
+                style_cell={'textAlign': 'left', 'whiteSpace': 'normal', 'maxWidth': 800, 'padding-right': '20px',
+                            'padding-left': '20px', 'fontSize': 13},
+                style_as_list_view=True, fill_width=False, page_size=50)]
+
+@app.callback(Output('log-interval', 'disabled'), [Input('log-follow', 'value')], prevent_initial_call=True)
+def follow_log(follow):
+    return 'follow' not in (follow or [])
+
+@app.callback([Output('hist-table', 'data'), Output('hist-table', 'page_count')],
+              [Input('hist-table', 'page_current'), Input('hist-table', 'page_size'),
+               Input('hist-table', 'sort_by'), Input('hist-table', 'filter_query')],
+              [State('url', 'pathname')])
+def update_hist_table(page_current, page_size, sort_by, filter_query, pathname):
+    path = os.path.split(pathname)[-1]
+    return run_history(path, page_current or 0, page_size or HIST_PAGE_SIZE, sort_by, filter_query)
+
 @app.callback(Output('hidden-div', 'children'),
 [Input('execute-button', 'n_clicks'), Input('url', 'pathname')])
 def run_script_on_click(n_clicks, pathname):
     
     if n_clicks:
-        with sqlite3.connect(process_automation_db) as local:
-            path = os.path.split(pathname)[-1]
-            info = pd.read_sql_query(f'''SELECT * FROM Tasks WHERE script_id = '{path}' ''', local).to_dict('index')[0]
+        path = os.path.split(pathname)[-1]
+        info = query_one(process_automation_db, 'task_info', (path,), sqlite3.Row, read_only=True)
+        if info is None:
+            raise PreventUpdate
         command = info['execution_command']
         cdir = None
         if info['run_dir'] != '':
@@ -225,6 +542,8 @@ if __name__ == "__main__":
     parser.add_argument('--port', type=str)
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--update', '-u', action='store_true')
+    parser.add_argument('--serve', action='store_true')
+    parser.add_argument('--threads', type=int)
     args = parser.parse_args()
     host = '127.0.0.1'
     port = '8050'
@@ -242,4 +561,8 @@ if __name__ == "__main__":
         build()
     host = get_config('HOST')
     port = get_config('PORT')
-    app.run_server(host=host, port=port, debug=debug)
+    from task_scheduler_dashboard_shauncampbell20.serve import SERVE_THREADS, run, serve
+    if args.serve:
+        serve(app, host, port, args.threads or SERVE_THREADS)
+    else:
+        run(app, host, port, debug)
@@ -0,0 +1,9 @@
+## WSGI entry point of the dashboard
+# For WSGI servers, e.g. gunicorn -w 4 task_scheduler_dashboard_shauncampbell20.wsgi:application
+# Task syncs are not started here, where every worker process would run them: run config.py --sync
+# next to the server.
+
+from task_scheduler_dashboard_shauncampbell20.webapp import app
+from task_scheduler_dashboard_shauncampbell20.serve import production
+
+application = production(app)
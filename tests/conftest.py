@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from task_scheduler_dashboard_shauncampbell20.db import close_all
+
+DB_NAME = 'process_automation.db'
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    # Empty PROCESS_AUTOMATION_HOME the package's configs point at, see core.get_config
+    monkeypatch.setenv('TASK_DASHBOARD_PROCESS_AUTOMATION_HOME', str(tmp_path))
+    monkeypatch.setenv('TASK_DASHBOARD_DB_NAME', DB_NAME)
+    monkeypatch.setenv('COMPUTERNAME', 'TESTBOX')
+    yield tmp_path
+    close_all()
+
+@pytest.fixture
+def db_path(home):
+    return str(home / DB_NAME)
@@ -0,0 +1,122 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+from flask import Flask
+
+from task_scheduler_dashboard_shauncampbell20.aggregate import IngestQueue, merge_database, register_ingest
+from task_scheduler_dashboard_shauncampbell20.schema import migrate
+
+TOKEN = 'secret'
+
+def batch(result='running', end_time=None):
+    return {'machine': 'REMOTE01',
+            'executors': [{'name': 'Load', 'state': 'Ready', 'command': 'C:\\load.cmd', 'folder': '\\Automation'}],
+            'tasks': [{'script_id': 'load', 'command': 'C:\\load.cmd', 'script': 'C:\\load.py'}],
+            'runs': [{'run_id': 7, 'script_id': 'load', 'start_time': 1704103200, 'end_time': end_time,
+                      'records': 5, 'result': result, 'errors': 0, 'warnings': 0, 'user': 'me'}]}
+
+@pytest.fixture
+def ingest(db_path):
+    # Flask test client of a server with the ingest endpoint, and its queue
+    migrate(db_path)
+    server = Flask(__name__)
+    ingest_queue = register_ingest(server, db_path, TOKEN)
+    return server.test_client(), ingest_queue
+
+def post(client, body, token=TOKEN, **headers):
+    if token:
+        headers['Authorization'] = 'Bearer ' + token
+    return client.post('/api/ingest', data=body, headers=headers, content_type='application/json')
+
+@pytest.mark.parametrize('token', [None, 'wrong', TOKEN + 'x'])
+def test_ingest_needs_token(ingest, db_path, token):
+    client, _ = ingest
+    assert post(client, json.dumps(batch()), token=token).status_code == 401
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT COUNT(*) FROM Runs''').fetchone()[0] == 0
+    local.close()
+
+def test_ingest_rejects_malformed_batch(ingest):
+    client, _ = ingest
+    assert post(client, json.dumps({'runs': []})).status_code == 400
+    assert post(client, json.dumps({'machine': 'REMOTE01', 'runs': [{'run_id': 'seven'}]})).status_code == 400
+
+def test_ingest_upserts_runs(ingest, db_path):
+    client, _ = ingest
+    assert post(client, json.dumps(batch())).status_code == 200
+    # The same run uploaded again once it completed, gzipped as push() sends it
+    body = gzip.compress(json.dumps(batch('success', 1704103260)).encode('UTF-8'))
+    assert post(client, body, **{'Content-Encoding': 'gzip'}).status_code == 200
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT origin_run_id, machine, script_id, end_time, result FROM Runs''').fetchall() == [
+        (7, 'REMOTE01', 'load', 1704103260, 'success')]
+    assert local.execute('''SELECT result FROM LatestRuns WHERE script_id = 'load' ''').fetchall() == [('success',)]
+    assert local.execute('''SELECT name, machine FROM Executors''').fetchall() == [('Load', 'REMOTE01')]
+    assert local.execute('''SELECT script_id, machine FROM Tasks''').fetchall() == [('load', 'REMOTE01')]
+    local.close()
+
+def test_ingest_replaces_tasks_of_the_machine(ingest, db_path):
+    client, _ = ingest
+    post(client, json.dumps(batch()))
+    post(client, json.dumps({'machine': 'REMOTE01', 'executors': [], 'tasks': []}))
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT COUNT(*) FROM Executors''').fetchone()[0] == 0
+    assert local.execute('''SELECT COUNT(*) FROM Tasks''').fetchone()[0] == 0
+    assert local.execute('''SELECT COUNT(*) FROM Runs''').fetchone()[0] == 1
+    local.close()
+
+def test_ingest_reports_rows_written(ingest):
+    client, _ = ingest
+    response = post(client, json.dumps(batch()))
+    assert response.status_code == 200
+    assert response.get_json()['Runs'] == {'received': 1, 'changed': 1}
+
+def test_ingest_reports_failed_batch(ingest, db_path):
+    client, _ = ingest
+    with pytest.warns(UserWarning, match='REMOTE02'):
+        response = post(client, json.dumps({'machine': 'REMOTE02', 'runs': [{'run_id': 1, 'script_id': {'not': 'text'}}]}))
+    assert response.status_code == 500
+    assert post(client, json.dumps(batch())).status_code == 200
+
+def test_ingest_queue_writes_batches_alone_after_a_failure(db_path):
+    migrate(db_path)
+    ingest_queue = IngestQueue(db_path)
+    # Hold the write lock so the next batches wait in the queue and are written together
+    lock = sqlite3.connect(db_path, isolation_level=None)
+    lock.execute('''BEGIN IMMEDIATE''')
+    first = ingest_queue.submit({'machine': 'REMOTE01', 'runs': [{'run_id': 1, 'script_id': 'load'}]})
+    bad = ingest_queue.submit({'machine': 'REMOTE02', 'runs': [{'run_id': 1, 'script_id': {'not': 'text'}}]})
+    good = ingest_queue.submit({'machine': 'REMOTE03', 'runs': [{'run_id': 1, 'script_id': 'load'}]})
+    lock.execute('''COMMIT''')
+    lock.close()
+    with pytest.warns(UserWarning, match='REMOTE02'):
+        assert good.result(10)['Runs'] == {'received': 1, 'changed': 1}
+    assert first.result(10)['Runs'] == {'received': 1, 'changed': 1}
+    with pytest.raises(sqlite3.Error):
+        bad.result(10)
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT machine FROM Runs ORDER BY machine''').fetchall() == [('REMOTE01',), ('REMOTE03',)]
+    local.close()
+
+def test_merge_database(db_path, tmp_path):
+    migrate(db_path)
+    other_path = str(tmp_path / 'server01.db')
+    migrate(other_path)
+    other = sqlite3.connect(other_path)
+    other.execute('''INSERT INTO Executors (name, state, command, machine) VALUES ('Load', 'Ready', 'C:\\load.cmd', 'SERVER01')''')
+    other.execute('''INSERT INTO Tasks (script_id, command, script, machine) VALUES ('load', 'C:\\load.cmd', 'C:\\load.py', 'SERVER01')''')
+    other.executemany('''INSERT INTO Runs (script_id, start_time, end_time, result, machine) VALUES ('load', ?, ?, ?, ?)''',
+                      [(100, 160, 'success', 'SERVER01'), (200, None, 'running', None)])
+    other.commit()
+    other.close()
+    assert merge_database(db_path, other_path) == 2
+    # Merging again updates the same runs
+    assert merge_database(db_path, other_path) == 2
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT origin_run_id, machine, result FROM Runs ORDER BY origin_run_id''').fetchall() == [
+        (1, 'SERVER01', 'success'), (2, 'SERVER01', 'running')]
+    assert local.execute('''SELECT machine, run_id FROM LatestRuns''').fetchall() == [('SERVER01', 2)]
+    assert local.execute('''SELECT name, machine FROM Executors''').fetchall() == [('Load', 'SERVER01')]
+    local.close()
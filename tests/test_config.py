@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+from task_scheduler_dashboard_shauncampbell20.config import sync_rows
+
+@pytest.fixture
+def cursor():
+    local = sqlite3.connect(':memory:')
+    local.execute('''CREATE TABLE Jobs (machine VARCHAR, name VARCHAR, state VARCHAR, PRIMARY KEY (machine, name))''')
+    local.execute('''CREATE TABLE Edges (source VARCHAR, target VARCHAR, PRIMARY KEY (source, target))''')
+    local.executemany('''INSERT INTO Jobs VALUES (?, ?, ?)''', [('A', 'load', 'Ready'), ('A', 'export', 'Ready'), ('A', 'old', 'Ready')])
+    local.executemany('''INSERT INTO Edges VALUES (?, ?)''', [('load', 'export'), ('export', 'old')])
+    yield local.cursor()
+    local.close()
+
+def rows(cursor, table):
+    return cursor.execute('''SELECT * FROM %s ORDER BY 1, 2''' % table).fetchall()
+
+def test_sync_rows_applies_differences(cursor):
+    current = {(machine, name): (name, state, machine) for machine, name, state in cursor.execute('''SELECT * FROM Jobs''')}
+    desired = {('A', 'load'): ('load', 'Ready', 'A'),
+               ('A', 'export'): ('export', 'Disabled', 'A'),
+               ('A', 'new'): ('new', 'Ready', 'A')}
+    counts = sync_rows(cursor, 'Jobs', ['machine', 'name'], ['name', 'state', 'machine'], current, desired)
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 1}
+    assert rows(cursor, 'Jobs') == [('A', 'export', 'Disabled'), ('A', 'load', 'Ready'), ('A', 'new', 'Ready')]
+
+def test_sync_rows_without_differences_writes_nothing(cursor):
+    current = {(machine, name): (name, state, machine) for machine, name, state in cursor.execute('''SELECT * FROM Jobs''')}
+    changes = cursor.connection.total_changes
+    counts = sync_rows(cursor, 'Jobs', ['machine', 'name'], ['name', 'state', 'machine'], current, dict(current))
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 0}
+    assert cursor.connection.total_changes == changes
+
+def test_sync_rows_of_table_keyed_by_all_columns(cursor):
+    current = {row: row for row in cursor.execute('''SELECT source, target FROM Edges''')}
+    desired = {('load', 'export'): ('load', 'export'), ('export', 'report'): ('export', 'report')}
+    counts = sync_rows(cursor, 'Edges', ['source', 'target'], ['source', 'target'], current, desired)
+    assert counts == {'inserted': 1, 'updated': 0, 'deleted': 1}
+    assert rows(cursor, 'Edges') == [('export', 'report'), ('load', 'export')]
@@ -0,0 +1,188 @@
+import os
+import time
+import logging
+import threading
+import sqlite3
+
+import pytest
+
+from task_scheduler_dashboard_shauncampbell20 import core
+from task_scheduler_dashboard_shauncampbell20.core import LOG_QUEUE_SIZE, BatchFileHandler, ProcessLogger, sweep_abandoned_runs
+from task_scheduler_dashboard_shauncampbell20.schema import SCHEMA_VERSION, create_base_tables, migrate
+
+def old_database(db_path):
+    # Database of the versions before migrations, with one task
+    local = sqlite3.connect(db_path)
+    create_base_tables(local.cursor())
+    local.execute('''INSERT INTO Tasks VALUES ('load', 'C:\\load.cmd', 'C:\\load.py', 'C:\\', 'python C:\\load.py', 'TESTBOX')''')
+    local.execute('''INSERT INTO Executors (name, command, machine) VALUES ('Load', 'C:\\load.cmd', 'TESTBOX')''')
+    local.commit()
+    local.close()
+
+def test_logger_creates_database(db_path):
+    logger = ProcessLogger('load', heartbeat=None)
+    logger.records = 3
+    logger.complete()
+    local = sqlite3.connect(db_path)
+    assert local.execute('''PRAGMA user_version''').fetchone()[0] == SCHEMA_VERSION
+    assert local.execute('''SELECT run_id, script_id, records, result, machine FROM Runs''').fetchall() == [
+        (logger.run_id, 'load', 3, 'success', 'TESTBOX')]
+    local.close()
+
+def test_logger_migrates_old_database_keeping_tasks(db_path):
+    old_database(db_path)
+    logger = ProcessLogger('load', heartbeat=None)
+    logger.complete()
+    local = sqlite3.connect(db_path)
+    assert local.execute('''PRAGMA user_version''').fetchone()[0] == SCHEMA_VERSION
+    assert local.execute('''SELECT script_id FROM Tasks''').fetchall() == [('load',)]
+    assert local.execute('''SELECT name FROM Executors''').fetchall() == [('Load',)]
+    local.close()
+
+def test_logger_retries_once(db_path, monkeypatch):
+    migrations = []
+    monkeypatch.setattr(core, 'migrate', migrations.append)
+    def allocate_run(*args):
+        raise sqlite3.OperationalError('no such table: Runs')
+    monkeypatch.setattr(core, 'allocate_run', allocate_run)
+    with pytest.raises(sqlite3.OperationalError):
+        ProcessLogger('load', heartbeat=None)
+    assert migrations == [db_path]
+
+def test_logger_does_not_migrate_on_other_errors(db_path, monkeypatch):
+    old_database(db_path)
+    migrations = []
+    monkeypatch.setattr(core, 'migrate', migrations.append)
+    def allocate_run(*args):
+        raise sqlite3.IntegrityError('UNIQUE constraint failed')
+    monkeypatch.setattr(core, 'allocate_run', allocate_run)
+    with pytest.raises(sqlite3.IntegrityError):
+        ProcessLogger('load', heartbeat=None)
+    assert migrations == []
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT COUNT(*) FROM Tasks''').fetchone()[0] == 1
+    local.close()
+
+class SlowStream:
+    # Stream that takes a while to write, and fails the writes listed in fail (1 for the first)
+    def __init__(self, stream, delay=0.005, fail=()):
+        self.stream = stream
+        self.delay = delay
+        self.fail = set(fail)
+        self.writes = 0
+        self.closed = False
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes in self.fail:
+            raise OSError('disk full')
+        time.sleep(self.delay)
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.closed = True
+        self.stream.close()
+
+def batch_logger(tmp_path, capacity, flush_interval=0.05, **stream_args):
+    handler = BatchFileHandler(str(tmp_path / 'batch.log'), capacity=capacity, flush_interval=flush_interval)
+    handler.stream = SlowStream(handler.stream, **stream_args)
+    logger = logging.Logger('batch')
+    logger.addHandler(handler)
+    return logger, handler
+
+def test_batch_handler_blocks_while_full(tmp_path):
+    logger, handler = batch_logger(tmp_path, capacity=20)
+    sizes = []
+    for i in range(500):
+        logger.info('record %d', i)
+        sizes.append(len(handler.buffer))
+    handler.close()
+    assert max(sizes) <= 20
+    with open(tmp_path / 'batch.log') as f:
+        assert [line.rstrip('\n') for line in f] == ['record %d' % i for i in range(500)]
+
+def test_batch_handler_survives_write_errors(tmp_path, capsys):
+    # The failed write holds a record and the flush marker after it
+    logger, handler = batch_logger(tmp_path, capacity=20, flush_interval=60, fail=[1])
+    logger.info('lost')
+    flush = threading.Thread(target=handler.flush, daemon=True)
+    flush.start()
+    flush.join(5)
+    assert not flush.is_alive() and handler.thread.is_alive()
+    # Reported with the record, not the marker
+    assert "Message: 'lost'" in capsys.readouterr().err
+    logger.info('kept')
+    handler.close()
+    with open(tmp_path / 'batch.log') as f:
+        assert f.read() == 'kept\n'
+
+def test_async_logger_complete_writes_every_record(db_path):
+    logger = ProcessLogger('load', async_writes=True, heartbeat=None)
+    for i in range(3 * LOG_QUEUE_SIZE):
+        logger.info('record %d', i)
+    logger.complete()
+    with open(logger.log_path) as f:
+        records = [line for line in f if ' - record ' in line]
+    assert len(records) == 3 * LOG_QUEUE_SIZE
+    assert records[-1].endswith(' - record %d\n' % (3 * LOG_QUEUE_SIZE - 1))
+
+def test_sweep_waits_for_missed_heartbeats(db_path):
+    migrate(db_path)
+    now = 100000
+    local = sqlite3.connect(db_path)
+    local.executemany('''INSERT INTO Runs (run_id, script_id, start_time, result, heartbeat_interval, heartbeat_time)
+        VALUES (?, 'load', ?, 'running', ?, ?)''', [
+        (1, now - 5000, 60, now - 1000),    # slow heartbeats, 1000 s is less than 20 of them
+        (2, now - 5000, 15, now - 400),     # 400 s is more than 20 heartbeats of 15 s
+        (3, now - 1300, 60, None),          # no heartbeat in the 20 intervals since it started
+        (4, now - 5000, None, now - 400),   # started before the interval was recorded
+        (5, now - 1000, None, None)])       # started before heartbeats
+    local.commit()
+    assert sweep_abandoned_runs(db_path, now) == 3
+    assert local.execute('''SELECT run_id FROM Runs WHERE result = 'abandoned' ORDER BY run_id''').fetchall() == [(2,), (3,), (4,)]
+    local.close()
+
+def test_logger_records_heartbeat_interval(db_path):
+    logger = ProcessLogger('load', heartbeat=60)
+    logger.complete()
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT heartbeat_interval, machine FROM Runs''').fetchall() == [(60, 'TESTBOX')]
+    local.close()
+
+def progress_writes(logger, monkeypatch, items, step, **progress_args):
+    # Progress lines written to the sidecar while iterating items, step seconds apart
+    clock = [0.0]
+    monkeypatch.setattr(core.time, 'monotonic', lambda: clock[0])
+    writes = []
+    monkeypatch.setattr(logger, '_write_progress', writes.append)
+    for _ in logger.progress(items, **progress_args):
+        clock[0] += step
+    return writes
+
+def test_progress_updates_once_per_interval(db_path, monkeypatch):
+    logger = ProcessLogger('load', heartbeat=None)
+    writes = progress_writes(logger, monkeypatch, list(range(10)), 0.4, interval=1.0)
+    # The first line, then one every third item, 1.2 s after the previous one
+    assert writes == ['+PROGRESS |          | 0.0%', '+PROGRESS |---       | 30.0%', '+PROGRESS |------    | 60.0%',
+                      '+PROGRESS |--------- | 90.0%']
+    assert logger.records == 10
+
+def test_progress_updates_every_n_items(db_path, monkeypatch):
+    logger = ProcessLogger('load', heartbeat=None)
+    writes = progress_writes(logger, monkeypatch, iter(range(10)), 0, interval=3600, every=4, records=False)
+    assert writes == ['+PROGRESS | 0 items', '+PROGRESS | 4 items', '+PROGRESS | 8 items']
+    assert logger.records == 0
+
+def test_progress_cleans_up_on_early_break(db_path):
+    logger = ProcessLogger('load', heartbeat=None)
+    for item in logger.progress(list(range(10)), interval=0):
+        assert os.path.exists(logger.progress_path)
+        if item == 2:
+            break
+    assert not os.path.exists(logger.progress_path)
+    logger.complete()
+    with open(logger.log_path) as f:
+        assert '+PROGRESS |--        | 20.0%\n' in f.read()
@@ -0,0 +1,33 @@
+from task_scheduler_dashboard_shauncampbell20.graph import BATCH, EXECUTOR, SCRIPT, find_cycles
+
+def chain(machine, nodes):
+    # Edges from each node of nodes to the next
+    return [(machine,) + source + target for source, target in zip(nodes, nodes[1:])]
+
+def test_no_cycles():
+    edges = chain('A', [(EXECUTOR, 'Load'), (BATCH, 'load.cmd'), (SCRIPT, 'load'), (BATCH, 'export.cmd'), (SCRIPT, 'export')])
+    edges += chain('A', [(EXECUTOR, 'Export'), (BATCH, 'export.cmd')])
+    assert find_cycles(edges) == []
+
+def test_cycle_of_a_script_triggering_itself():
+    edges = chain('A', [(EXECUTOR, 'Load'), (BATCH, 'load.cmd'), (SCRIPT, 'load'), (BATCH, 'load.cmd')])
+    assert find_cycles(edges) == [[(BATCH, 'load.cmd'), (SCRIPT, 'load'), (BATCH, 'load.cmd')]]
+
+def test_self_loop():
+    assert find_cycles([('A', SCRIPT, 'load', SCRIPT, 'load')]) == [[(SCRIPT, 'load'), (SCRIPT, 'load')]]
+
+def test_cycle_across_machines():
+    edges = chain('A', [(BATCH, 'load.cmd'), (SCRIPT, 'load'), (BATCH, 'export.cmd')])
+    edges += chain('B', [(BATCH, 'export.cmd'), (SCRIPT, 'export'), (BATCH, 'load.cmd')])
+    assert find_cycles(edges) == [[(BATCH, 'export.cmd'), (SCRIPT, 'export'), (BATCH, 'load.cmd'), (SCRIPT, 'load'),
+                                   (BATCH, 'export.cmd')]]
+
+def test_each_separate_cycle_is_found():
+    edges = chain('A', [(BATCH, 'a.cmd'), (SCRIPT, 'a'), (BATCH, 'a.cmd')])
+    edges += chain('A', [(BATCH, 'b.cmd'), (SCRIPT, 'b'), (BATCH, 'b.cmd')])
+    assert len(find_cycles(edges)) == 2
+
+def test_long_chain_without_recursion():
+    nodes = [(SCRIPT, 'step%05d' % i) for i in range(5000)]
+    cycles = find_cycles(chain('A', nodes + [nodes[4000]]))
+    assert cycles == [nodes[4000:] + [nodes[4000]]]
@@ -0,0 +1,51 @@
+import gzip
+import shutil
+
+import pytest
+
+from task_scheduler_dashboard_shauncampbell20 import logfiles
+from task_scheduler_dashboard_shauncampbell20.logfiles import CompressedLog, compress_log, read_lines, read_range
+
+@pytest.fixture(params=['gzip', 'zstd'])
+def logs(request, tmp_path, monkeypatch):
+    ''' A plain log and a compressed copy of it in frames of 1000 bytes, lines of varying length cross the frames
+        returns (plain path, compressed path)
+    '''
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    monkeypatch.setattr(logfiles, 'FRAME_SIZE', 1000)
+    plain = tmp_path / 'plain'
+    with open(plain, 'w', newline='') as f:
+        f.writelines('INFO:2024-01-01 00:00:00,000 - line %d %s\n' % (i, 'x' * (i % 97)) for i in range(300))
+    shutil.copyfile(plain, tmp_path / '1000001')
+    return str(plain), compress_log(str(tmp_path / '1000001'), request.param)
+
+def test_compressed_log_has_frames(logs):
+    plain, compressed = logs
+    with open(plain, 'rb') as f:
+        data = f.read()
+    with CompressedLog(compressed) as log:
+        assert len(log.frames) == -(-len(data) // 1000)
+        assert log.size == len(data)
+        log.seek(995)
+        # A read across three frames
+        assert log.read(2010) == data[995:3005]
+        assert log.tell() == 3005
+    if compressed.endswith('.gz'):
+        # The frames are gzip members, read by any gzip tool as one file
+        with open(compressed, 'rb') as f:
+            assert gzip.decompress(f.read()) == data
+
+@pytest.mark.parametrize('start, end', [(0, 500), (999, 1001), (990, 2500), (1500, 10 ** 6), (5000, 5000)])
+def test_read_range_across_frames(logs, start, end):
+    plain, compressed = logs
+    assert read_range(compressed, start, end) == read_range(plain, start, end)
+
+def test_read_lines_across_frames(logs):
+    plain, compressed = logs
+    offset = 0
+    for limit in [700, 1300, 2000]:
+        expected = read_lines(plain, offset, limit)
+        assert read_lines(compressed, offset, limit) == expected
+        offset = expected[1]
+    assert offset > 3000
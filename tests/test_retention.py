@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import warnings
+
+import pytest
+
+from task_scheduler_dashboard_shauncampbell20.logfiles import archive_members, archive_path, log_path, read_range, shard_path
+from task_scheduler_dashboard_shauncampbell20.retention import archive_logs, compress_logs, compression_method, expire_runs, maintain
+from task_scheduler_dashboard_shauncampbell20.search import ingest
+from task_scheduler_dashboard_shauncampbell20.schema import migrate
+
+DAY = 86400
+NOW = 1704067200 + 100 * DAY
+
+@pytest.fixture
+def runs(db_path, home):
+    ''' Five completed runs of load a day apart, the last 1 day old, and a running run of export
+        60 days old, each with a log file last written when its run ended
+        returns (db_path, logs)
+    '''
+    migrate(db_path)
+    logs = str(home / 'logs')
+    local = sqlite3.connect(db_path)
+    rows = [('load', NOW - (5 - i) * DAY, NOW - (5 - i) * DAY + 60, 'success') for i in range(5)]
+    rows.append(('export', NOW - 60 * DAY, None, 'running'))
+    for run_id, (script_id, start_time, end_time, result) in enumerate(rows, 1):
+        log_file = str(1000000 + run_id)
+        local.execute('''INSERT INTO Runs (run_id, script_id, log_file, start_time, end_time, duration_ms, records, result, errors, warnings)
+            VALUES (?, ?, ?, ?, ?, 60000, 1, ?, 0, 0)''', (run_id, script_id, log_file, start_time, end_time, result))
+        path = shard_path(logs, log_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('INFO:2024-01-01 00:00:00,000 - run %d\n' % run_id)
+        os.utime(path, (end_time or start_time, end_time or start_time))
+    local.commit()
+    local.close()
+    return db_path, logs
+
+def remaining(db_path):
+    local = sqlite3.connect(db_path)
+    run_ids = [run_id for run_id, in local.execute('''SELECT run_id FROM Runs ORDER BY run_id''')]
+    local.close()
+    return run_ids
+
+def test_expire_keeps_last_runs(runs):
+    db_path, logs = runs
+    assert expire_runs(db_path, logs, {'*': {'runs': 2}}, NOW) == 3
+    assert remaining(db_path) == [4, 5, 6]
+    assert not os.path.exists(shard_path(logs, '1000001'))
+    assert os.path.exists(shard_path(logs, '1000005'))
+    # The deleted runs stay counted in the rollups
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT SUM(runs) FROM RunRollups WHERE script_id = 'load' AND period = ?''', (DAY,)).fetchone()[0] == 5
+    local.close()
+
+def test_expire_keeps_recent_runs_and_running_runs(runs):
+    db_path, logs = runs
+    assert expire_runs(db_path, logs, {'load': {'days': 2.5}, '*': {'days': 1}}, NOW) == 3
+    assert remaining(db_path) == [4, 5, 6]
+
+def test_expire_without_policy_keeps_everything(runs):
+    db_path, logs = runs
+    assert expire_runs(db_path, logs, {}, NOW) == 0
+    assert remaining(db_path) == [1, 2, 3, 4, 5, 6]
+
+def test_archive_old_logs(runs):
+    db_path, logs = runs
+    assert archive_logs(db_path, logs, days=3, now=NOW) == 2
+    bundle = archive_path(logs, '1000001')
+    assert sorted(archive_members(bundle)) == ['1000001', '1000002']
+    assert not os.path.exists(shard_path(logs, '1000001'))
+    # The log of the running run is left in place, whatever its age
+    assert os.path.exists(shard_path(logs, '1000006'))
+    # Archived logs can still be read
+    path = log_path(logs, '1000001')
+    assert read_range(path, 0, 1000)[0] == 'INFO:2024-01-01 00:00:00,000 - run 1\n'
+
+def test_expire_removes_archived_logs(runs):
+    db_path, logs = runs
+    archive_logs(db_path, logs, days=3, now=NOW)
+    expire_runs(db_path, logs, {'load': {'runs': 4}}, NOW)
+    assert sorted(archive_members(archive_path(logs, '1000001'))) == ['1000002']
+
+def test_maintain_records_report(runs):
+    db_path, logs = runs
+    report = maintain(db_path, logs, policies={'*': {'runs': 1}}, days=100000)
+    assert report['runs_deleted'] == 4
+    assert report['logs_archived'] == 0
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT step FROM Maintenance''').fetchall() == [('maintain',)]
+    assert local.execute('''PRAGMA auto_vacuum''').fetchone()[0] == 2
+    local.close()
+
+def test_expire_removes_indexed_lines(runs):
+    db_path, logs = runs
+    assert ingest(db_path, logs) == 6
+    expire_runs(db_path, logs, {'*': {'runs': 2}}, NOW)
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT run_id FROM LogLines ORDER BY rowid''').fetchall() == [(4,), (5,), (6,)]
+    assert local.execute('''SELECT run_id FROM LogLineRanges ORDER BY run_id''').fetchall() == [(4,), (5,), (6,)]
+    local.close()
+
+def test_compress_without_zstandard_warns_once(runs, monkeypatch):
+    db_path, logs = runs
+    monkeypatch.setattr('importlib.util.find_spec', lambda name: None)
+    compression_method.cache_clear()
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            assert compress_logs(db_path, logs, 'zstd', NOW) == 0
+            assert compress_logs(db_path, logs, 'zstd', NOW) == 0
+    finally:
+        compression_method.cache_clear()
+    assert [str(w.message) for w in caught] == ['zstandard is not installed (pip install zstandard), logs are not compressed']
+    assert os.path.exists(shard_path(logs, '1000001'))
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+from task_scheduler_dashboard_shauncampbell20.rollups import DAY, HOUR, bin_value, duration_bin, percentile, rollup_runs, rollup_series, rollup_summary
+from task_scheduler_dashboard_shauncampbell20.schema import migrate
+
+START = 1704067200
+
+@pytest.fixture
+def local(db_path):
+    migrate(db_path)
+    local = sqlite3.connect(db_path, isolation_level=None)
+    yield local
+    local.close()
+
+def add_run(local, script_id, start_time, duration_ms, result='success', records=10, completed=True):
+    local.execute('''INSERT INTO Runs (script_id, start_time, end_time, duration_ms, records, result) VALUES (?, ?, ?, ?, ?, ?)''',
+                  (script_id, start_time, start_time + (duration_ms or 0) // 1000 if completed else None, duration_ms, records, result))
+
+@pytest.mark.parametrize('duration_ms', [1, 2, 3, 7, 100, 999, 1000, 12345, 3600000, 86400000])
+def test_bin_value_within_an_eighth(duration_ms):
+    assert abs(bin_value(duration_bin(duration_ms)) - duration_ms) <= duration_ms / 8
+
+def test_bins_follow_durations():
+    bins = [duration_bin(ms) for ms in range(0, 5000)]
+    assert bins == sorted(bins)
+    assert duration_bin(0) == duration_bin(None) == duration_bin(-5) == 0
+
+def test_percentile():
+    assert percentile({}, 0.5) is None
+    assert percentile({duration_bin(1000): 0}, 0.5) is None
+    assert percentile({duration_bin(1000): 1}, 0.5) == percentile({duration_bin(1000): 1}, 0.95) == bin_value(duration_bin(1000))
+    histogram = {duration_bin(100): 90, duration_bin(10000): 10}
+    assert percentile(histogram, 0.5) == bin_value(duration_bin(100))
+    assert percentile(histogram, 0.95) == bin_value(duration_bin(10000))
+
+def test_empty_rollups(local):
+    assert rollup_runs(local.cursor()) == 0
+    assert rollup_series(local.cursor(), 'load', HOUR, 0) == []
+    assert rollup_summary(local.cursor(), 0) == []
+
+def test_single_run_bucket(local):
+    add_run(local, 'load', START + 10, 60000)
+    assert rollup_runs(local.cursor()) == 1
+    for period in [HOUR, DAY]:
+        [bucket] = rollup_series(local.cursor(), 'load', period, 0)
+        assert bucket['bucket'] == START and bucket['runs'] == 1 and bucket['failure_rate'] == 0
+        assert bucket['p50_ms'] == bucket['p95_ms'] == bin_value(duration_bin(60000))
+    [summary] = rollup_summary(local.cursor(), 0)
+    assert summary['avg_ms'] == 60000 and summary['records_per_run'] == 10
+
+def test_runs_are_counted_once_when_completed(local):
+    add_run(local, 'load', START, 1000)
+    add_run(local, 'load', START + HOUR, 3000, result='error')
+    add_run(local, 'load', START + HOUR + 60, None, completed=False)
+    assert rollup_runs(local.cursor()) == 2
+    assert rollup_runs(local.cursor()) == 0
+    hourly = rollup_series(local.cursor(), 'load', HOUR, 0)
+    assert [(row['bucket'], row['runs'], row['failure_rate']) for row in hourly] == [(START, 1, 0), (START + HOUR, 1, 1)]
+    [daily] = rollup_series(local.cursor(), 'load', DAY, 0)
+    assert daily['runs'] == 2 and daily['failure_rate'] == 0.5
+    assert rollup_series(local.cursor(), 'load', HOUR, START + HOUR) == hourly[1:]
+
+def test_buckets_without_durations(local):
+    # Percentiles are None once the duration histogram of a bucket is gone
+    add_run(local, 'load', START, 1000)
+    rollup_runs(local.cursor())
+    local.execute('''DELETE FROM RollupDurations''')
+    [bucket] = rollup_series(local.cursor(), 'load', HOUR, 0)
+    assert bucket['p50_ms'] is None and bucket['p95_ms'] is None
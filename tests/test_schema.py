@@ -0,0 +1,124 @@
+import sqlite3
+
+import pytest
+
+from task_scheduler_dashboard_shauncampbell20.db import query
+from task_scheduler_dashboard_shauncampbell20.schema import SCHEMA_VERSION, create_base_tables, create_log_line_ranges, migrate, schema_version, to_epoch
+
+def baseline_database(db_path):
+    # Database as written by the versions before migrations: text times, no keys, user_version 0
+    local = sqlite3.connect(db_path)
+    create_base_tables(local.cursor())
+    local.executemany('''INSERT INTO Runs (script_id, log_file, start_time, end_time, records, result, errors, warnings, user, machine)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'me', 'TESTBOX')''', [
+        ('load', '1700000000', '2024-01-01 10:00:00', '2024-01-01 10:00:30', 10, 'success', 0, 0),
+        ('load', '1700000100', '2024-01-02 10:00:00', '2024-01-02 10:01:00', 20, 'error', 1, 0),
+        ('export', '1700000200', '2024-01-01 12:00:00', None, 0, 'running', 0, 0)])
+    local.execute('''INSERT INTO Executors VALUES ('Load', 'Ready', '2024-01-03 10:00:00', '2024-01-02 10:00:00', '0', 'False',
+        'C:\\load.cmd', '\\Automation', 'TESTBOX')''')
+    local.execute('''INSERT INTO Tasks VALUES ('load', 'C:\\load.cmd', 'C:\\load.py', 'C:\\', 'python C:\\load.py', 'TESTBOX')''')
+    local.commit()
+    local.close()
+
+def test_migrate_baseline_database(db_path):
+    baseline_database(db_path)
+    assert migrate(db_path) == list(range(1, SCHEMA_VERSION + 1))
+    local = sqlite3.connect(db_path)
+    assert schema_version(local) == SCHEMA_VERSION
+    assert local.execute('''PRAGMA journal_mode''').fetchone()[0] == 'wal'
+    runs = local.execute('''SELECT script_id, start_time, end_time, duration_ms FROM Runs ORDER BY run_id''').fetchall()
+    assert runs == [('load', 1704103200, 1704103230, 30000), ('load', 1704189600, 1704189660, 60000),
+                    ('export', 1704110400, None, None)]
+    latest = local.execute('''SELECT script_id, run_id, result FROM LatestRuns ORDER BY script_id''').fetchall()
+    assert latest == [('export', 3, 'running'), ('load', 2, 'error')]
+    assert local.execute('''SELECT script_id, machine FROM Tasks''').fetchall() == [('load', 'TESTBOX')]
+    assert local.execute('''SELECT name, next_run_time FROM Executors''').fetchall() == [('Load', 1704276000)]
+    local.close()
+    assert migrate(db_path) == []
+
+def test_migrate_empty_database(db_path):
+    assert migrate(db_path) == list(range(1, SCHEMA_VERSION + 1))
+    local = sqlite3.connect(db_path)
+    assert local.execute('''SELECT COUNT(*) FROM Runs''').fetchone()[0] == 0
+    local.close()
+
+def test_latest_run_follows_updates(db_path):
+    migrate(db_path)
+    local = sqlite3.connect(db_path)
+    local.execute('''INSERT INTO Runs (script_id, start_time, result) VALUES ('load', 100, 'running')''')
+    local.execute('''UPDATE Runs SET end_time = 160, result = 'success' WHERE run_id = 1''')
+    local.commit()
+    assert local.execute('''SELECT run_id, end_time, result FROM LatestRuns''').fetchall() == [(1, 160, 'success')]
+    local.close()
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-01-01 10:00:00', 1704103200),
+    ('2024-01-01 10:00:00+00:00', 1704103200),
+    ('2024-01-01 11:00:00+01:00', 1704103200),
+    ('01/01/24 10:00:00', 1704103200),
+    ('01-Jan-24 10:00:00', 1704103200),
+    ('1704103200', 1704103200),
+    ('None', None),
+    ('', None),
+    (None, None),
+])
+def test_to_epoch(value, expected):
+    assert to_epoch(value) == expected
+
+def runs_version(local):
+    return local.execute('''SELECT version FROM DataVersions WHERE name = 'runs' ''').fetchone()[0]
+
+def test_data_version_follows_shown_changes(db_path):
+    migrate(db_path)
+    local = sqlite3.connect(db_path, isolation_level=None)
+    local.execute('''INSERT INTO Runs (script_id, start_time, records, result, errors, warnings) VALUES ('load', 100, 0, 'running', 0, 0)''')
+    version = runs_version(local)
+    assert local.execute('''SELECT version FROM LatestRuns''').fetchone()[0] == version
+    # A heartbeat with the same counters, and marking the run rolled up, change nothing shown
+    local.execute('''UPDATE Runs SET records = 0, errors = 0, warnings = 0, heartbeat_time = 115 WHERE run_id = 1''')
+    local.execute('''UPDATE Runs SET rolled_up = 1 WHERE run_id = 1''')
+    assert runs_version(local) == version
+    assert local.execute('''SELECT heartbeat_time FROM LatestRuns''').fetchone()[0] == 115
+    # A heartbeat with new counters does, once
+    local.execute('''UPDATE Runs SET records = 5, heartbeat_time = 130 WHERE run_id = 1''')
+    assert runs_version(local) == version + 1
+    assert local.execute('''SELECT version, records FROM LatestRuns''').fetchone() == (version + 1, 5)
+    local.close()
+
+def test_latest_run_per_machine(db_path):
+    migrate(db_path)
+    local = sqlite3.connect(db_path, isolation_level=None)
+    local.executemany('''INSERT INTO Tasks (script_id, command, script, machine) VALUES ('load', 'load.cmd', 'load.py', ?)''',
+                      [('A',), ('B',)])
+    local.executemany('''INSERT INTO Runs (script_id, start_time, result, machine) VALUES ('load', ?, ?, ?)''',
+                      [(100, 'success', 'A'), (200, 'error', 'B'), (50, 'success', 'B')])
+    assert local.execute('''SELECT machine, run_id, result FROM LatestRuns ORDER BY machine''').fetchall() == [
+        ('A', 1, 'success'), ('B', 2, 'error')]
+    rows = query(db_path, 'last_run_table', (None, None, 0), sqlite3.Row)
+    assert sorted((row['Machine'], row['Result']) for row in rows) == [('A', 'success'), ('B', 'error')]
+    # Deleting the latest run of B falls back to B's previous run, not to A's
+    local.execute('''DELETE FROM Runs WHERE run_id = 2''')
+    assert local.execute('''SELECT machine, run_id FROM LatestRuns ORDER BY machine''').fetchall() == [('A', 1), ('B', 3)]
+    local.close()
+
+def test_latest_run_moves_with_its_machine(db_path):
+    migrate(db_path)
+    local = sqlite3.connect(db_path, isolation_level=None)
+    local.execute('''INSERT INTO Runs (script_id, start_time, result, machine) VALUES ('load', 100, 'success', 'A')''')
+    # Started before runs were inserted with their machine, completed with it
+    local.execute('''INSERT INTO Runs (script_id, start_time, result) VALUES ('load', 200, 'running')''')
+    assert local.execute('''SELECT machine, run_id FROM LatestRuns ORDER BY machine''').fetchall() == [('', 2), ('A', 1)]
+    local.execute('''UPDATE Runs SET end_time = 260, result = 'success', machine = 'A' WHERE run_id = 2''')
+    assert local.execute('''SELECT machine, run_id, end_time FROM LatestRuns''').fetchall() == [('A', 2, 260)]
+    local.close()
+
+def test_log_line_ranges_of_indexed_lines(db_path):
+    migrate(db_path)
+    local = sqlite3.connect(db_path, isolation_level=None)
+    # Lines indexed before LogLineRanges, run 1 resumed after a line of run 2
+    local.executemany('''INSERT INTO LogLines (rowid, message, run_id) VALUES (?, 'line', ?)''',
+                      [(1, 1), (2, 1), (3, 2), (4, 1), (6, 1)])
+    create_log_line_ranges(local.cursor())
+    assert local.execute('''SELECT run_id, first_rowid, last_rowid FROM LogLineRanges ORDER BY first_rowid''').fetchall() == [
+        (1, 1, 2), (2, 3, 3), (1, 4, 6)]
+    local.close()
@@ -0,0 +1,52 @@
+import sqlite3
+
+from task_scheduler_dashboard_shauncampbell20.config import build
+from task_scheduler_dashboard_shauncampbell20.sources import XmlTaskSource
+
+EXPORT = '''<?xml version="1.0" encoding="{encoding}"?>
+<Task version="1.2" xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+  <RegistrationInfo>{uri}</RegistrationInfo>
+  <Settings>
+    <Enabled>{enabled}</Enabled>
+    <Hidden>{hidden}</Hidden>
+  </Settings>
+  <Actions Context="Author">
+    <Exec>
+      <Command>{command}</Command>
+    </Exec>
+  </Actions>
+</Task>
+'''
+
+def export(path, command, uri=None, enabled='true', hidden='false', encoding='UTF-8'):
+    # Writes a task as exported by Task Scheduler, which writes UTF-16 with a byte order mark
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding=encoding.lower()) as f:
+        f.write(EXPORT.format(encoding=encoding, uri='<URI>%s</URI>' % uri if uri else '', enabled=enabled,
+                              hidden=hidden, command=command))
+
+def test_xml_task_source_reads_exports(tmp_path):
+    export(tmp_path / 'load.xml', 'C:\\load.cmd', uri='\\Automation\\Load')
+    export(tmp_path / 'Reports' / 'Export.xml', ' C:\\export.cmd ', enabled='false', hidden='true', encoding='UTF-16')
+    (tmp_path / 'notes.xml').write_text('<notes/>')
+    (tmp_path / 'broken.xml').write_text('<Task')
+    records = list(XmlTaskSource(str(tmp_path), machine='SERVER01').tasks())
+    assert records == [
+        {'Name': 'Load', 'Hidden': False, 'State': 'Ready', 'Last Run': None, 'Next Run': None, 'Folder': '\\Automation',
+         'Command': 'C:\\load.cmd', 'Last Result': '', 'Machine': 'SERVER01'},
+        {'Name': 'Export', 'Hidden': True, 'State': 'Disabled', 'Last Run': None, 'Next Run': None, 'Folder': '\\Reports',
+         'Command': 'C:\\export.cmd', 'Last Result': '', 'Machine': 'SERVER01'}]
+
+def test_second_build_reports_no_changes(home):
+    batch_file = home / 'load.cmd'
+    batch_file.write_text('cd "C:/Automation"\n"C:/Python/python.exe" "C:/Automation/load.py"\n')
+    export(home / 'tasks' / 'Load.xml', str(batch_file), uri='\\Automation\\Load', encoding='UTF-16')
+    source = XmlTaskSource(str(home / 'tasks'), machine='TESTBOX')
+    first = build(source=source)
+    assert first['Executors']['inserted'] == 1
+    assert first['Tasks']['inserted'] == 1
+    second = build(source=source)
+    assert all(counts == {'inserted': 0, 'updated': 0, 'deleted': 0} for counts in second.values())
+    local = sqlite3.connect(str(home / 'process_automation.db'))
+    assert local.execute('''SELECT script_id, command, machine FROM Tasks''').fetchall() == [('load', str(batch_file), 'TESTBOX')]
+    local.close()
@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from task_scheduler_dashboard_shauncampbell20 import webapp
+from task_scheduler_dashboard_shauncampbell20.rollups import DAY, rollup_runs
+from task_scheduler_dashboard_shauncampbell20.schema import migrate
+from task_scheduler_dashboard_shauncampbell20.logfiles import CHUNK_SIZE, shard_path
+
+LOG_FILE = '1000001'
+
+@pytest.fixture
+def client(home, db_path, monkeypatch):
+    # Test client of the dashboard reading the logs of home
+    monkeypatch.setattr(webapp, 'process_automation_logs', str(home / 'logs'))
+    monkeypatch.setattr(webapp, 'process_automation_db', db_path)
+    migrate(db_path)
+    return webapp.app.server.test_client()
+
+def write_log(home, lines):
+    path = shard_path(str(home / 'logs'), LOG_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        f.writelines('INFO:2024-01-01 00:00:00,000 - line %06d\n' % i for i in range(lines))
+    return path
+
+def page_log(client, trigger, state):
+    # POSTs the page_log callback as the browser does when trigger is clicked, returns the response or None (no update)
+    response = client.post('/_dash-update-component', json={
+        'output': '..log-text.children...log-state.data...log-progress.children..',
+        'outputs': [{'id': 'log-text', 'property': 'children'}, {'id': 'log-state', 'property': 'data'},
+                    {'id': 'log-progress', 'property': 'children'}],
+        'inputs': [{'id': 'log-older', 'property': 'n_clicks', 'value': 1}, {'id': 'log-newer', 'property': 'n_clicks', 'value': 1},
+                   {'id': 'log-interval', 'property': 'n_intervals', 'value': 1}],
+        'state': [{'id': 'log-state', 'property': 'data', 'value': state}],
+        'changedPropIds': ['%s.%s' % (trigger, 'n_intervals' if trigger == 'log-interval' else 'n_clicks')]})
+    if response.status_code == 204:
+        return None
+    assert response.status_code == 200
+    return json.loads(response.data)['response']
+
+def test_older_at_top_of_log_does_nothing(client, home):
+    write_log(home, 10)
+    state = {'log_file': LOG_FILE, 'start': 0, 'end': 370, 'progress': ''}
+    assert page_log(client, 'log-older', state) is None
+
+def test_newer_at_end_of_log_does_nothing(client, home):
+    size = os.path.getsize(write_log(home, 10))
+    state = {'log_file': LOG_FILE, 'start': 0, 'end': size, 'progress': ''}
+    assert page_log(client, 'log-newer', state) is None
+
+def test_older_and_newer_move_the_window(client, home):
+    size = os.path.getsize(write_log(home, 3 * CHUNK_SIZE // 43))
+    state = {'log_file': LOG_FILE, 'start': size - CHUNK_SIZE // 2, 'end': size, 'progress': ''}
+    older = page_log(client, 'log-older', state)
+    data = older['log-state']['data']
+    assert 0 < data['start'] < state['start'] and data['end'] <= state['start']
+    assert older['log-text']['children'][0].startswith('INFO:')
+    newer = page_log(client, 'log-newer', data)
+    assert newer['log-state']['data']['start'] >= data['end']
+    assert newer['log-text']['children'][0].startswith('INFO:')
+
+def test_follow_appends_new_lines(client, home):
+    path = write_log(home, 10)
+    size = os.path.getsize(path)
+    state = {'log_file': LOG_FILE, 'start': 0, 'end': size, 'progress': ''}
+    assert page_log(client, 'log-interval', state) is None
+    with open(path, 'a') as f:
+        f.write('INFO:2024-01-01 00:00:01,000 - appended\n')
+    followed = page_log(client, 'log-interval', state)
+    assert followed['log-state']['data']['end'] == os.path.getsize(path)
+
+def test_stats_without_percentiles(client, db_path):
+    local = sqlite3.connect(db_path, isolation_level=None)
+    local.execute('''INSERT INTO Runs (script_id, start_time, end_time, duration_ms, records, result)
+        VALUES ('load', strftime('%s', 'now') - 60, strftime('%s', 'now'), 60000, 1, 'success')''')
+    rollup_runs(local.cursor())
+    local.execute('''DELETE FROM RollupDurations''')
+    local.close()
+    [row] = webapp.update_stats_table(7)
+    assert row['avg_s'] == 60 and row['p50_s'] is None and row['p95_s'] is None
+    duration = webapp.update_stats_graphs('load', DAY, 7)[0]
+    assert [series['y'] for series in duration['data']] == [[None], [None]]
+
+def test_hist_where_translates_filters():
+    where, params = webapp.hist_where('load', '{records} ge 10 && {result} contains err && {start_time} datestartswith 2024-01-02'
+                                              ' && {start_time} lt "2024-01-03 00:00:00" && {end_time} gt "not a date" && {secret} eq 1')
+    assert where == ("script_id = ? AND records >= ? AND result LIKE ? AND strftime('%Y-%m-%d %H:%M:%S', start_time, 'unixepoch') LIKE ?"
+                     " AND start_time < ?")
+    assert params == ['load', 10.0, '%err%', '2024-01-02%', 1704240000]
+
+def test_run_history_filters_sorts_and_pages(client, db_path):
+    local = sqlite3.connect(db_path)
+    local.executemany('''INSERT INTO Runs (script_id, start_time, end_time, records, result) VALUES (?, ?, ?, ?, ?)''', [
+        ('load', 1704103200 + i * DAY, 1704103260 + i * DAY, records, result)
+        for i, (records, result) in enumerate([(5, 'success'), (30, 'error'), (20, 'success'), (10, 'success')])])
+    local.execute('''INSERT INTO Runs (script_id, start_time, records, result) VALUES ('export', 1704103200, 50, 'success')''')
+    local.commit()
+    local.close()
+    # Latest first by default
+    rows, pages = webapp.run_history('load', page_size=3)
+    assert [row['start_time'] for row in rows] == ['2024-01-04 10:00:00', '2024-01-03 10:00:00', '2024-01-02 10:00:00']
+    assert pages == 2
+    rows, pages = webapp.run_history('load', page_current=1, page_size=2, filter_query='{result} eq success',
+                                     sort_by=[{'column_id': 'records', 'direction': 'desc'}])
+    assert [row['records'] for row in rows] == [5]
+    assert pages == 2
+    assert rows[0]['end_time'] == '2024-01-01 10:01:00'